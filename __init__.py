@@ -1,3 +1,115 @@
-from .utilslib import *
-from .enums import *
-from .mysql_mgr import *
+"""utilslib package.
+
+Submodules are imported on first use of one of their names, so importing the package does not load requests,
+pymysql or dateutil until something needs them.
+"""
+import importlib
+
+# the modules import each other by their top level name (from instrumentation import ...), so their directory
+# has to be on sys.path, as it always had to be. The names of the package are read from those same module
+# objects: a second copy imported as package.module would hold its own caches and switches, which the other
+# modules never read.
+
+# public names of every submodule, a name listed in several modules is taken from the last one
+_EXPORTS = {
+    'utilslib': (
+        'DT_FMT_HMSf', 'invoke_http_request', 'record_http_response', 'requests_retry_session',
+        'log_failed_http_request', 'is_success_request', 'date_within_next', 'date_within_last',
+        'str_to_datetime', 'get_datetime', 'get_unique_key', 'get_unique_keys', 'ops', 'buildquery',
+        'module_id_dict', 'vtiger_sessions', 'VTIGER_INVALID_SESSION_CODES', 'VTIGER_QUERY_PAGE_SIZE',
+        'vtiger_session_key', 'get_session_name', 'invalidate_session_name', 'is_invalid_session_response',
+        'vtiger_login', 'invoke_vtiger_request', 'enable_trigger_batching', 'disable_trigger_batching',
+        'flush_trigger_batching', 'trigger_workflow', 'send_workflow_trigger', 'json_logic_replace_data',
+        'json_logic_replacements', 'map_json_logic_rules', 'map_json_logic_replace_data',
+        'iter_vtiger_query_pages', 'iter_vtiger_query',
+        'run_external_workflow', 'trigger_set_value_task', 'build_set_value_element', 'revise_record',
+        'trigger_bulk_set_value_task', 'invoke_set_value_task', 'invoke_web_service_task',
+        'invoke_conditional_task', 'build_search_query',
+    ),
+    'enums': (
+        'HttpMethodEnum',
+    ),
+    'mysql_mgr': (
+        'MysqlDatabaseHandler', 'MysqlConnectionPool', 'PooledMysqlDatabaseHandler', 'get_mysql_pool',
+        'close_mysql_pools', 'fetch_single_row', 'fetch_rows', 'iter_rows', 'iter_row_batches', 'transaction',
+        'execute_many', 'insert_rows', 'upsert_rows',
+    ),
+    'http_client': (
+        'configure_http_pool', 'get_http_session', 'close_http_sessions', 'reset_http_sessions',
+    ),
+    'http_cache': (
+        'HttpResponseCache', 'enable_http_cache', 'disable_http_cache', 'get_http_cache',
+    ),
+    'host_scheduler': (
+        'HostPolicy', 'HostScheduler', 'CircuitOpenError', 'SlotTimeoutError', 'enable_host_scheduler',
+        'disable_host_scheduler', 'get_host_scheduler',
+    ),
+    'instrumentation': (
+        'logger', 'payload_logger', 'log_payload', 'set_payload_logging', 'span', 'timed', 'add_phase',
+        'inc_counter', 'observe', 'add_metrics_callback', 'remove_metrics_callback', 'metrics_snapshot',
+        'prometheus_text', 'reset_metrics', 'set_instrumentation_enabled', 'DEFAULT_BUCKETS',
+    ),
+    'async_utilslib': (
+        'configure_async', 'shutdown_async_executor', 'ainvoke_http_request', 'aget_session_name',
+        'atrigger_workflow', 'arun_external_workflow', 'ainvoke_set_value_task', 'ainvoke_web_service_task',
+    ),
+    'session_cache': (
+        'SessionCache',
+    ),
+    'rule_compiler': (
+        'compile_rule', 'evaluate_rule', 'rule_hash', 'clear_rule_cache', 'set_rule_cache_size',
+    ),
+    'expression': (
+        'ExpressionError', 'compile_expression', 'evaluate_expression', 'register_expression_helper',
+        'clear_expression_cache',
+    ),
+    'rule_batch': (
+        'evaluate_rule_batch', 'register_vector_op', 'DATE_VECTOR_OPS',
+    ),
+    'date_utils': (
+        'DT_FMT_YMDHMS', 'parse_datetime', 'parse_iso_datetime', 'utc_now', 'frozen_utc_now',
+    ),
+    'substitution': (
+        'replace_placeholders', 'replace_placeholders_in',
+    ),
+    'trigger_batcher': (
+        'WorkflowTriggerBatcher', 'BatcherClosedError',
+    ),
+    'query_builder': (
+        'QueryTemplate', 'compile_condition', 'render_condition', 'mysql_condition', 'escape_query_value',
+    ),
+    'workflow_engine': (
+        'run_workflow', 'STEP_DONE', 'STEP_SKIPPED', 'STEP_FAILED',
+    ),
+    'rule_pool': (
+        'map_rules', 'map_in_processes', 'resolve_reference',
+    ),
+    'unique_key': (
+        'new_unique_key', 'new_unique_keys',
+    ),
+}
+
+_ATTRIBUTES = {name: module_name for module_name, names in _EXPORTS.items() for name in names}
+
+__all__ = list(_ATTRIBUTES)
+
+
+def __getattr__(name):
+    module_name = _ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    value = getattr(_module(module_name), name)
+    globals()[name] = value
+    return value
+
+
+def _module(module_name):
+    """ the module module_name of the package, as imported by the other modules """
+    if module_name == __name__.rpartition('.')[2]:
+        # a package named like one of its modules hides it, only the package sees that one
+        return importlib.import_module('.' + module_name, __name__)
+    return importlib.import_module(module_name)
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_ATTRIBUTES))
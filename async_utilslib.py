@@ -0,0 +1,177 @@
+"""Asyncio entry points for the http and task helpers.
+
+The blocking helpers of utilslib run on a shared thread pool, on top of the pooled sessions of
+http_client, so they keep the exact retry/backoff behaviour of the sync API. The HTTP requests they send
+are bounded per host: a call first waits on the event loop for a slot of the host it is made for (the vtiger
+instance of a task), so calls to a slow host queue there instead of holding the threads the other hosts need,
+then every request it sends holds a slot of its own host (a workflow talks to vtiger and to the workflow
+service) while it is sent. That lets one event loop drive many workflow executions without flooding a
+vtiger instance.
+"""
+import asyncio
+import os
+import sys
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from utilslib import (invoke_http_request, get_session_name, trigger_workflow, run_external_workflow,
+                      invoke_set_value_task, invoke_web_service_task)
+
+# read from the module itself: when the package is named utilslib, 'utilslib' is the package, which only gives
+# the public names
+_request_context = sys.modules[invoke_http_request.__module__]._request_context
+
+__all__ = ['configure_async', 'shutdown_async_executor', 'ainvoke_http_request', 'aget_session_name',
+           'atrigger_workflow', 'arun_external_workflow', 'ainvoke_set_value_task', 'ainvoke_web_service_task']
+
+_config = {
+    'max_workers': 100,
+    'per_host_limit': 10,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+# event loop -> _HostLimits of the requests run for that loop
+_host_limits = weakref.WeakKeyDictionary()
+
+
+def configure_async(max_workers=None, per_host_limit=None):
+    """ max_workers: threads used to run the blocking calls, only the calls given a slot of their host take one
+        per_host_limit: max calls and max requests in flight to the same host from one event loop
+        """
+    if max_workers is not None:
+        _config['max_workers'] = max_workers
+        shutdown_async_executor(wait=False)
+    if per_host_limit is not None:
+        _config['per_host_limit'] = per_host_limit
+        _host_limits.clear()
+
+
+def shutdown_async_executor(wait=True):
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=_config['max_workers'],
+                                               thread_name_prefix='utilslib-async')
+    return _executor
+
+
+def _reset_after_fork():
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+    _host_limits.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class _HostLimits(object):
+    """ per host semaphores of one event loop: the asyncio ones are acquired on the loop before a call goes to
+        an executor thread, the threading ones by the executor threads around each request
+        """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._semaphores = {}
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def call(self, host):
+        semaphore = self._calls.get(host)
+        if semaphore is None:
+            semaphore = self._calls[host] = asyncio.Semaphore(self.limit)
+        return semaphore
+
+    def session(self, session, host):
+        semaphore = self._semaphores.get(host)
+        if semaphore is None:
+            with self._lock:
+                semaphore = self._semaphores.setdefault(host, threading.BoundedSemaphore(self.limit))
+        return _LimitedSession(session, semaphore)
+
+
+class _LimitedSession(object):
+    def __init__(self, session, semaphore):
+        self._session = session
+        self._semaphore = semaphore
+
+    def _run(self, func, args, kwargs):
+        with self._semaphore:
+            return func(*args, **kwargs)
+
+    def get(self, *args, **kwargs):
+        return self._run(self._session.get, args, kwargs)
+
+    def post(self, *args, **kwargs):
+        return self._run(self._session.post, args, kwargs)
+
+    def put(self, *args, **kwargs):
+        return self._run(self._session.put, args, kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._run(self._session.delete, args, kwargs)
+
+
+def _limited_call(host_limits, func, args, kwargs):
+    _request_context.host_limits = host_limits
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _request_context.host_limits = None
+
+
+def _host(url):
+    return urlsplit(url or '').hostname or ''
+
+
+async def _run(host, func, *args, **kwargs):
+    """ run func on the executor once the call got a slot of host """
+    loop = asyncio.get_running_loop()
+    host_limits = _host_limits.get(loop)
+    if host_limits is None:
+        host_limits = _host_limits[loop] = _HostLimits(_config['per_host_limit'])
+    async with host_limits.call(host):
+        return await loop.run_in_executor(_get_executor(), _limited_call, host_limits, func, args, kwargs)
+
+
+async def ainvoke_http_request(endpoint, method, headers, payload=None, json_data=None, timeout=61, session=None):
+    """ async version of invoke_http_request, returns (response, status) """
+    return await _run(_host(endpoint), invoke_http_request, endpoint, method, headers, payload=payload,
+                      json_data=json_data, timeout=timeout, session=session)
+
+
+async def aget_session_name(user_access_key, vtiger_url, vtiger_username):
+    return await _run(_host(vtiger_url), get_session_name, user_access_key, vtiger_url, vtiger_username)
+
+
+async def atrigger_workflow(workflow, event_type, data, service_url):
+    return await _run(_host(service_url), trigger_workflow, workflow, event_type, data, service_url)
+
+
+async def arun_external_workflow(conf, external_workflow_config, vtiger_access):
+    return await _run(_host(vtiger_access.get('vtiger_url')), run_external_workflow, conf, external_workflow_config,
+                      vtiger_access)
+
+
+async def ainvoke_set_value_task(conf, set_value_configs, vtiger_access):
+    return await _run(_host(vtiger_access.get('vtiger_url')), invoke_set_value_task, conf, set_value_configs,
+                      vtiger_access)
+
+
+async def ainvoke_web_service_task(conf, web_service_configs):
+    # the url of the request object may still hold placeholders, it is good enough to group the calls
+    url = (web_service_configs.get('request_object') or {}).get('url')
+    return await _run(_host(url), invoke_web_service_task, conf, web_service_configs)
@@ -0,0 +1,96 @@
+"""Import time of the package and its modules, in fresh interpreters.
+
+Fails (exit code 1) when importing the package or utilslib loads one of the heavy dependencies, when the
+package export table is out of date with the __all__ of the modules, or when an import takes longer than
+--max-ms.
+
+    python benchmarks/bench_import.py [--repeat N] [--max-ms MS]
+"""
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(ROOT)
+HEAVY = ('requests', 'urllib3', 'pymysql', 'dateutil', 'numpy')
+
+SCRIPT = '''
+import sys, time, json
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'heavy': [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+
+def run(statement):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.path.dirname(ROOT)]))
+    output = subprocess.check_output([sys.executable, '-c', SCRIPT.format(statement=statement, heavy=HEAVY)],
+                                     env=env, cwd=ROOT)
+    return json.loads(output)
+
+
+def check_exports():
+    """ names of the package export table missing from the __all__ of their module, and the other way round """
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.dirname(ROOT))
+    package = importlib.import_module(PACKAGE)
+    problems = []
+    listed = set()
+    for module_name, names in package._EXPORTS.items():
+        module = package._module(module_name)
+        exported = set(getattr(module, '__all__', names))
+        listed.update(names)
+        problems += ['{}.{} is not exported'.format(module_name, name) for name in names if name not in exported]
+        if module_name != 'utilslib':
+            problems += ['{}.{} is missing from the package'.format(module_name, name)
+                         for name in sorted(exported - set(names))]
+    utilslib = package._module('utilslib')
+    problems += ['utilslib.{} is missing from the package'.format(name)
+                 for name in utilslib.__all__ if name not in listed]
+    return problems
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--repeat', type=int, default=10)
+    arg_parser.add_argument('--max-ms', type=float, default=None, help='fail when an import is slower')
+    args = arg_parser.parse_args()
+
+    cases = [
+        ('package', 'import {}'.format(PACKAGE), False),
+        ('package get_unique_key', 'import {0}; {0}.get_unique_key()'.format(PACKAGE), False),
+        ('utilslib', 'import utilslib', False),
+        ('utilslib date helpers', 'import utilslib; utilslib.str_to_datetime("2022-01-10 00:00:00")', False),
+        ('utilslib http', 'import utilslib; utilslib.get_http_session("http://localhost")', True),
+        ('mysql_mgr', 'import mysql_mgr', True),
+        ('requests', 'import requests', True),
+    ]
+
+    failed = False
+    print('{:<26} {:>10} {:>10}  {}'.format('import', 'median ms', 'min ms', 'heavy modules loaded'))
+    for name, statement, heavy_allowed in cases:
+        results = [run(statement) for _ in range(args.repeat)]
+        timings = [result['seconds'] * 1000 for result in results]
+        heavy = results[0]['heavy']
+        print('{:<26} {:>10.1f} {:>10.1f}  {}'.format(name, statistics.median(timings), min(timings),
+                                                      ', '.join(heavy) or '-'))
+        if heavy and not heavy_allowed:
+            print('  FAIL: {} should not import {}'.format(name, ', '.join(heavy)))
+            failed = True
+        if args.max_ms is not None and not heavy_allowed and statistics.median(timings) > args.max_ms:
+            print('  FAIL: {} takes more than {} ms'.format(name, args.max_ms))
+            failed = True
+
+    for problem in check_exports():
+        print('  FAIL: ' + problem)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Compare the original string-concat buildquery with the query builder, which escapes and validates.
+
+The query builder keeps no cache of configs, every call renders the config it is given ("render"). "fresh"
+renders a config loaded again for each call (copied outside the timing), like configs read per event.
+
+    python benchmarks/bench_query.py [--number N]
+"""
+import argparse
+import copy
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from query_builder import compile_condition, render_condition  # noqa: E402
+
+
+def concat_buildquery(json_object):
+    # buildquery as it was before query_builder
+    if 'field' in json_object.keys():
+        if json_object.get("operator") != 'BETWEEN':
+            return json_object.get("field") + " " + json_object.get("operator") + " '" + json_object.get("value") + "' "
+        else:
+            return json_object.get("field") + " " + json_object.get("operator") + " '" + json_object.get(
+                "value") + "' " + 'AND' + " '" + json_object.get("value2") + "' "
+    else:
+        i = 0
+        result = ""
+        filter_array = json_object.get("filters")
+        while i < len(filter_array):
+            result += " " + concat_buildquery(filter_array[i]) + " "
+            if i != len(filter_array) - 1:
+                result += json_object.get("condition")
+            i = i + 1
+        return result
+
+
+def tree(depth, width, prefix='f'):
+    if depth == 0:
+        return {'field': prefix, 'operator': '=', 'value': '{{data.%s}}' % prefix}
+    return {'condition': 'AND' if depth % 2 else 'OR',
+            'filters': [tree(depth - 1, width, '%s_%d' % (prefix, index)) for index in range(width)]}
+
+
+TREES = {
+    'flat-5': tree(1, 5),
+    'wide-100': tree(1, 100),
+    'deep-8x2': tree(8, 2),
+    'deep-4x5': tree(4, 5),
+}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--number', type=int, default=2000)
+    args = arg_parser.parse_args()
+
+    print('{:<10} {:>8} {:>12} {:>12} {:>12} {:>8}'.format('tree', 'leaves', 'concat us', 'render us', 'fresh us',
+                                                           'speedup'))
+    for name, condition_object in TREES.items():
+        leaves = len(compile_condition(condition_object).params)
+        concat = timeit.timeit(lambda: concat_buildquery(condition_object), number=args.number)
+        rendered = timeit.timeit(lambda: render_condition(condition_object), number=args.number)
+        copies = [copy.deepcopy(condition_object) for _ in range(args.number)]
+        fresh = timeit.timeit(lambda: render_condition(copies.pop()), number=args.number)
+        print('{:<10} {:>8} {:>12.2f} {:>12.2f} {:>12.2f} {:>7.1f}x'.format(
+            name, leaves, concat / args.number * 1e6, rendered / args.number * 1e6, fresh / args.number * 1e6,
+            concat / fresh))
+
+
+if __name__ == '__main__':
+    main()
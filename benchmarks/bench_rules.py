@@ -0,0 +1,75 @@
+"""Compare compiled and interpreted JSON-Logic evaluation.
+
+miss: evaluate_rule with an empty rule cache (snapshot, compile and evaluate), hit: evaluate_rule with the
+rule in the cache (snapshot and evaluate), compiled: the compiled rule called directly.
+
+    python benchmarks/bench_rules.py [--number N]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_logic import jsonLogic  # noqa: E402
+from rule_compiler import clear_rule_cache, compile_rule, evaluate_rule  # noqa: E402
+from utilslib import ops  # noqa: E402
+
+CONF = {
+    'data': {
+        'id': '1234',
+        'firstname': 'John',
+        'lastname': 'Doe',
+        'leadsource': 'Web Site',
+        'annualrevenue': 125000,
+        'createdtime': '2022-01-10 10:00:00',
+        'tags': ['vip', 'newsletter'],
+    }
+}
+
+RULES = {
+    'condition': {'and': [
+        {'==': [{'var': 'data.leadsource'}, 'Web Site']},
+        {'>': [{'var': 'data.annualrevenue'}, 100000]},
+        {'starts_with': [{'var': 'data.lastname'}, 'D']},
+        {'in': ['vip', {'var': 'data.tags'}]},
+    ]},
+    'replace': ['{{id}}', {'var': 'data.id'}, '{{firstname}}', {'var': 'data.firstname'},
+                '{{lastname}}', {'var': 'data.lastname'}, '{{source}}', {'var': 'data.leadsource'}],
+    'dates': {'or': [
+        {'date_after': [{'var': 'data.createdtime'}, '2023-01-01 00:00:00']},
+        {'date_between': [{'var': 'data.createdtime'}, '2022-01-01 00:00:00', '2022-02-01 00:00:00']},
+    ]},
+    'nested': {'if': [
+        {'some': [{'var': 'data.tags'}, {'==': [{'var': ''}, 'vip']}]},
+        {'cat': ['VIP ', {'var': 'data.firstname'}]},
+        {'cat': ['Regular ', {'var': 'data.firstname'}]},
+    ]},
+}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--number', type=int, default=20000)
+    args = arg_parser.parse_args()
+
+    print('{:<10} {:>14} {:>10} {:>10} {:>12} {:>12}'.format(
+        'rule', 'interpreted us', 'miss us', 'hit us', 'compiled us', 'hit speedup'))
+    for name, rule in RULES.items():
+        assert jsonLogic(rule, CONF, ops) == evaluate_rule(rule, CONF, ops)
+        compiled = compile_rule(rule, ops)
+        interpreted = timeit.timeit(lambda: jsonLogic(rule, CONF, ops), number=args.number)
+
+        def miss():
+            clear_rule_cache()
+            evaluate_rule(rule, CONF, ops)
+        missed = timeit.timeit(miss, number=args.number)
+        hit = timeit.timeit(lambda: evaluate_rule(rule, CONF, ops), number=args.number)
+        direct = timeit.timeit(lambda: compiled(CONF), number=args.number)
+        print('{:<10} {:>14.2f} {:>10.2f} {:>10.2f} {:>12.2f} {:>11.1f}x'.format(
+            name, interpreted / args.number * 1e6, missed / args.number * 1e6, hit / args.number * 1e6,
+            direct / args.number * 1e6, interpreted / hit))
+
+if __name__ == '__main__':
+    main()
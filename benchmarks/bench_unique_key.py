@@ -0,0 +1,85 @@
+"""Compare the original get_unique_key with the unique_key generator, and check keys for collisions.
+
+Collisions are checked across threads of one process and across forked worker processes.
+
+    python benchmarks/bench_unique_key.py [--number N] [--threads T] [--processes P]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import string
+import sys
+import threading
+import timeit
+from datetime import datetime
+
+import shortuuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from unique_key import new_unique_key, new_unique_keys  # noqa: E402
+
+
+def old_unique_key():
+    # get_unique_key as it was before unique_key
+    timestamp = datetime.now().strftime('%H%M%S%f')
+    random_str = timestamp + ''.join(random.choice(string.digits + string.ascii_letters) for _ in range(8))
+    uuid_str = shortuuid.ShortUUID().random(length=12)
+    return '{}{}'.format(uuid_str, random_str)
+
+
+def thread_keys(count, threads):
+    results = [None] * threads
+
+    def work(index):
+        results[index] = [new_unique_key() for _ in range(count)]
+    workers = [threading.Thread(target=work, args=(index,)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
+
+
+def process_keys(count):
+    return new_unique_keys(count // 2) + [new_unique_key() for _ in range(count - count // 2)]
+
+
+def check(name, per_worker):
+    keys = [key for worker in per_worker for key in worker]
+    assert all(len(key) == 32 and key.isalnum() for key in keys), 'bad key format'
+    assert all(worker == sorted(worker) and len(set(worker)) == len(worker) for worker in per_worker), \
+        'keys of a worker are not increasing'
+    collisions = len(keys) - len(set(keys))
+    print('{:<28} {:>10} keys {:>6} collisions'.format(name, len(keys), collisions))
+    return collisions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--number', type=int, default=100000)
+    arg_parser.add_argument('--threads', type=int, default=8)
+    arg_parser.add_argument('--processes', type=int, default=4)
+    args = arg_parser.parse_args()
+
+    print('{:<28} {:>12}'.format('generator', 'us per key'))
+    for name, func in [('old get_unique_key', old_unique_key),
+                       ('new_unique_key', new_unique_key),
+                       ('new_unique_keys(1000)', lambda: new_unique_keys(1000))]:
+        per_call = 1000 if name.endswith('(1000)') else 1
+        number = max(1, args.number // per_call)
+        seconds = min(timeit.repeat(func, number=number, repeat=3))
+        print('{:<28} {:>12.3f}'.format(name, seconds / (number * per_call) * 1e6))
+    print()
+
+    collisions = check('{} threads'.format(args.threads), thread_keys(args.number, args.threads))
+    context = multiprocessing.get_context('fork')
+    with context.Pool(args.processes) as pool:
+        per_process = pool.map(process_keys, [args.number] * args.processes)
+    collisions += check('{} forked processes'.format(args.processes), per_process)
+    sys.exit(1 if collisions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""Throughput and latency of the main functions of the library, against local stand-ins.
+
+HTTP functions talk to benchmarks/stubs.StubServer (vtiger webservice.php and the workflow trigger
+endpoint), the MySQL helpers to an in-memory sqlite stand-in or to a real server given with --mysql.
+Results are printed and written as JSON, compare two runs with --compare.
+
+    python benchmarks/run_benchmarks.py [--scale S] [--only NAME ...] [--output FILE] [--compare FILE]
+                                        [--mysql user:password@host/database] [--no-instrumentation]
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from json_logic import jsonLogic  # noqa: E402
+
+import instrumentation  # noqa: E402
+import mysql_mgr  # noqa: E402
+import utilslib  # noqa: E402
+from stubs import SqliteConnection, StubServer  # noqa: E402
+
+CONF = {'data': {'id': '10x1', 'firstname': 'John', 'lastname': 'Doe', 'leadsource': 'Web Site',
+                 'annualrevenue': 125000, 'createdtime': '2022-01-10 10:00:00'}}
+
+CONDITION = {'and': [
+    {'==': [{'var': 'data.leadsource'}, 'Web Site']},
+    {'>': [{'var': 'data.annualrevenue'}, 100000]},
+    {'starts_with': [{'var': 'data.lastname'}, 'D']},
+    {'date_between': [{'var': 'data.createdtime'}, '2022-01-01 00:00:00', '2022-02-01 00:00:00']},
+]}
+
+REPLACE_RULE = ['{{firstname}}', {'var': 'data.firstname'}, '{{lastname}}', {'var': 'data.lastname'},
+                '{{source}}', {'var': 'data.leadsource'}]
+
+FUNCTION_FIELDS = [
+    {'name': 'description', 'type': 'function', 'value': "'{{firstname}} {{lastname}}'.upper()"},
+    {'name': 'annualrevenue', 'type': 'function', 'value': "round(data['annualrevenue'] * 1.1, 2)"},
+    {'name': 'followup', 'type': 'function', 'value': "format_date(add_days(data['createdtime'], 7))"},
+]
+
+CONDITION_OBJECT = {'condition': 'AND', 'filters': [
+    {'field': 'leadsource', 'operator': '=', 'value': '{{source}}'},
+    {'condition': 'OR', 'filters': [
+        {'field': 'lastname', 'operator': '=', 'value': '{{lastname}}'},
+        {'field': 'firstname', 'operator': '=', 'value': '{{firstname}}'},
+    ]},
+    {'field': 'createdtime', 'operator': 'BETWEEN', 'value': '2022-01-01', 'value2': '2022-12-31'},
+]}
+
+
+def percentile(sorted_timings, percent):
+    index = max(0, int(math.ceil(percent / 100.0 * len(sorted_timings))) - 1)
+    return sorted_timings[index]
+
+
+def measure(func, number, warmup):
+    for _ in range(warmup):
+        func()
+    timings = []
+    perf_counter = time.perf_counter
+    started = perf_counter()
+    for _ in range(number):
+        start = perf_counter()
+        func()
+        timings.append(perf_counter() - start)
+    elapsed = perf_counter() - started
+    timings.sort()
+    return {
+        'number': number,
+        'ops_per_sec': number / elapsed,
+        'mean_us': sum(timings) / number * 1e6,
+        'p50_us': percentile(timings, 50) * 1e6,
+        'p90_us': percentile(timings, 90) * 1e6,
+        'p99_us': percentile(timings, 99) * 1e6,
+        'max_us': timings[-1] * 1e6,
+    }
+
+
+def http_cases(url):
+    vtiger_access = {'user_access_key': 'benchkey', 'vtiger_url': url, 'vtiger_username': 'bench',
+                     'service_url': url}
+    session_name = utilslib.get_session_name('benchkey', url, 'bench')
+    query_url = '{}/webservice.php?operation=query&sessionName={}&query=SELECT%20*%20FROM%20Leads%20LIMIT%2010;'.format(
+        url, session_name)
+    trigger_url = '{}/api/v1/trigger_external_workflow'.format(url)
+    external_workflow_config = {
+        'workflow': 'bench', 'event_type': 'import',
+        'search_object': {'condition_object': CONDITION_OBJECT, 'rule': REPLACE_RULE,
+                          'search_module': {'name': 'Leads'}, 'fetch_record': 200,
+                          'sort': {'column': 'id', 'type': 'ASC'}},
+    }
+    set_value_configs = {
+        'rule': REPLACE_RULE,
+        'search_module_object': {'name': 'Leads', 'condition_object': CONDITION_OBJECT, 'fetch_record': 1},
+        'set_value_fields': [{'name': 'description', 'type': 'static', 'value': '{{firstname}} {{lastname}}'}],
+    }
+    return [
+        ('invoke_http_request GET', 200,
+         lambda: utilslib.invoke_http_request(query_url, 'GET', {'content-type': 'application/json'})),
+        ('invoke_http_request POST', 200,
+         lambda: utilslib.invoke_http_request(trigger_url, 'POST', {}, json_data={'data': CONF['data']})),
+        ('get_session_name cached', 20000, lambda: utilslib.get_session_name('benchkey', url, 'bench')),
+        ('get_session_name login', 100,
+         lambda: utilslib.get_session_name('benchkey', url, 'bench', use_cache=False)),
+        ('run_external_workflow', 50,
+         lambda: utilslib.run_external_workflow(CONF, external_workflow_config, vtiger_access)),
+        ('invoke_set_value_task', 100,
+         lambda: utilslib.invoke_set_value_task(CONF, set_value_configs, vtiger_access)),
+    ]
+
+
+def cpu_cases():
+    text = 'SELECT * FROM Leads WHERE firstname = {{firstname}} AND lastname = {{lastname}} ' \
+           'AND leadsource = {{source}};'
+    return [
+        ('jsonLogic ops', 20000, lambda: jsonLogic(CONDITION, CONF, utilslib.ops)),
+        ('evaluate_rule ops', 20000, lambda: utilslib.evaluate_rule(CONDITION, CONF, utilslib.ops)),
+        ('buildquery', 20000, lambda: utilslib.buildquery(CONDITION_OBJECT)),
+        ('json_logic_replace_data', 20000, lambda: utilslib.json_logic_replace_data(REPLACE_RULE, CONF, text)),
+        ('get_unique_key', 50000, utilslib.get_unique_key),
+        ('set_value function fields', 20000,
+         lambda: utilslib.build_set_value_element(FUNCTION_FIELDS, CONF, REPLACE_RULE, '10x1')),
+    ]
+
+
+def mysql_cases(conn):
+    mysql_mgr.execute_many(conn, 'DROP TABLE IF EXISTS bench_leads', [()])
+    mysql_mgr.execute_many(conn, 'CREATE TABLE bench_leads (id INTEGER PRIMARY KEY, firstname VARCHAR(64), '
+                                 'lastname VARCHAR(64))', [()])
+    rows = [(index, 'First{}'.format(index), 'Last{}'.format(index)) for index in range(1000)]
+    mysql_mgr.execute_many(conn, 'INSERT INTO bench_leads (id, firstname, lastname) VALUES (%s, %s, %s)', rows)
+
+    def insert_batch():
+        mysql_mgr.execute_many(conn, 'DELETE FROM bench_leads WHERE id >= %s', [(100000,)])
+        mysql_mgr.execute_many(conn, 'INSERT INTO bench_leads (id, firstname, lastname) VALUES (%s, %s, %s)',
+                               [(100000 + index, 'a', 'b') for index in range(100)])
+    return [
+        ('fetch_single_row', 5000,
+         lambda: mysql_mgr.fetch_single_row(conn, 'SELECT * FROM bench_leads WHERE id = %s', (500,))),
+        ('fetch_rows 1000', 200, lambda: mysql_mgr.fetch_rows(conn, 'SELECT * FROM bench_leads')),
+        ('execute_many 100 rows', 200, insert_batch),
+    ]
+
+
+def mysql_connection(spec):
+    if not spec:
+        return SqliteConnection()
+    credentials, _, location = spec.rpartition('@')
+    user, _, password = credentials.partition(':')
+    host, _, database = location.partition('/')
+    return mysql_mgr.connect(user, password, host, database)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_results(results, baseline):
+    header = '{:<28} {:>12} {:>10} {:>10} {:>10} {:>10}'.format('benchmark', 'ops/sec', 'p50 us', 'p90 us',
+                                                                 'p99 us', 'max us')
+    if baseline:
+        header += ' {:>9}'.format('change')
+    print(header)
+    for name, result in results.items():
+        line = '{:<28} {:>12.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+            name, result['ops_per_sec'], result['p50_us'], result['p90_us'], result['p99_us'], result['max_us'])
+        previous = baseline.get(name)
+        if previous:
+            line += ' {:>+8.1f}%'.format((result['ops_per_sec'] / previous['ops_per_sec'] - 1) * 100)
+        print(line)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--scale', type=float, default=1.0, help='multiply the number of calls')
+    arg_parser.add_argument('--only', nargs='*', help='run the benchmarks whose name starts with one of these')
+    arg_parser.add_argument('--output', help='JSON results file, default benchmark-<commit>.json')
+    arg_parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    arg_parser.add_argument('--mysql', help='user:password@host/database of a MySQL server to use instead of '
+                                            'the sqlite stand-in')
+    arg_parser.add_argument('--no-instrumentation', action='store_true', help='turn spans and metrics off')
+    args = arg_parser.parse_args()
+
+    instrumentation.set_instrumentation_enabled(not args.no_instrumentation)
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+    results = {}
+    conn = mysql_connection(args.mysql)
+    with StubServer() as server:
+        cases = http_cases(server.url) + cpu_cases() + mysql_cases(conn)
+        for name, number, func in cases:
+            if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                continue
+            number = max(1, int(number * args.scale))
+            results[name] = measure(func, number, warmup=max(1, number // 10))
+    conn.close()
+
+    print_results(results, baseline)
+    commit = git_commit()
+    output = args.output or 'benchmark-{}.json'.format(commit)
+    with open(output, 'w') as output_file:
+        json.dump({'commit': commit, 'python': platform.python_version(), 'platform': platform.platform(),
+                   'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'scale': args.scale,
+                   'instrumentation': not args.no_instrumentation, 'results': results},
+                  output_file, indent=2, sort_keys=True)
+    print('results written to', output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Local stand-ins for the services used by the benchmarks.
+
+StubServer serves a vtiger webservice.php (getchallenge, login, query, revise) and the workflow service
+trigger endpoint on 127.0.0.1. SqliteConnection is an in-memory sqlite3 database with the part of the pymysql
+connection interface used by mysql_mgr.fetch_rows, fetch_single_row and execute_many.
+"""
+import json
+import re
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+_LIMIT = re.compile(r'LIMIT\s+(?:(\d+)\s*,\s*)?(\d+)', re.IGNORECASE)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, obj, status=200):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        params = dict(parse_qsl(parts.query))
+        operation = params.get('operation')
+        if operation == 'getchallenge':
+            return self._send({'success': True, 'result': {'token': 'stubtoken', 'serverTime': 1000,
+                                                           'expireTime': 1300}})
+        if operation == 'query':
+            if params.get('sessionName') not in self.server.sessions:
+                return self._send({'success': False, 'error': {'code': 'INVALID_SESSIONID', 'message': ''}})
+            match = _LIMIT.search(params.get('query', ''))
+            offset = int(match.group(1) or 0) if match else 0
+            size = min(int(match.group(2)) if match else 100, 100)
+            return self._send({'success': True, 'result': self.server.records[offset:offset + size]})
+        self._send({'success': True, 'result': {}})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode()
+        if self.path.startswith('/api/v1/trigger_external_workflow'):
+            return self._send({'success': True})
+        params = dict(parse_qsl(body))
+        operation = params.get('operation')
+        if operation == 'login':
+            with self.server.lock:
+                session_name = 'session{}'.format(len(self.server.sessions))
+                self.server.sessions.add(session_name)
+            return self._send({'success': True, 'result': {'sessionName': session_name}})
+        if operation == 'revise':
+            if params.get('sessionName') not in self.server.sessions:
+                return self._send({'success': False, 'error': {'code': 'INVALID_SESSIONID', 'message': ''}})
+            return self._send({'success': True, 'result': json.loads(params.get('element', '{}'))})
+        self._send({'success': False, 'error': {'code': 'UNKNOWN_OPERATION', 'message': ''}}, 400)
+
+
+class StubServer(object):
+    """ vtiger and workflow service stand-in, use it as a context manager. url is the base url of both """
+
+    def __init__(self, records=500):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.lock = threading.Lock()
+        self._server.sessions = set()
+        self._server.records = [{'id': '10x{}'.format(index), 'firstname': 'First{}'.format(index),
+                                 'lastname': 'Last{}'.format(index), 'leadsource': 'Web Site'}
+                                for index in range(records)]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self.url = 'http://127.0.0.1:{}'.format(self._server.server_port)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _Cursor(object):
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._cursor.close()
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def execute(self, sql, params=None):
+        self._cursor.execute(sql.replace('%s', '?'), params or ())
+        return self._cursor.rowcount
+
+    def executemany(self, sql, seq_of_params):
+        self._cursor.executemany(sql.replace('%s', '?'), seq_of_params)
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+
+class SqliteConnection(object):
+    """ in-memory sqlite3 database answering like a pymysql connection with DictCursor """
+
+    def __init__(self):
+        self._conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self._conn.row_factory = lambda cursor, row: {column[0]: value
+                                                      for column, value in zip(cursor.description, row)}
+        self.encoding = 'utf8'
+
+    def cursor(self, cursor_class=None):
+        return _Cursor(self._conn.cursor())
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,59 @@
+"""Fast date parsing and a shared "now" for rule evaluation"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from functools import lru_cache
+
+__all__ = ['DT_FMT_YMDHMS', 'parse_datetime', 'parse_iso_datetime', 'utc_now', 'frozen_utc_now']
+
+DT_FMT_YMDHMS = '%Y-%m-%d %H:%M:%S'
+
+_now_holder = ContextVar('utilslib_utc_now', default=None)
+
+
+@lru_cache(maxsize=4096)
+def parse_datetime(date_time):
+    """ same result as datetime.strptime(date_time, '%Y-%m-%d %H:%M:%S') without going through strptime
+        for well formed values. results are memoized, rules compare the same literal dates again and again.
+        """
+    if len(date_time) == 19 and date_time[4] == '-' and date_time[7] == '-' and date_time[10] == ' ' \
+            and date_time[13] == ':' and date_time[16] == ':':
+        try:
+            return datetime.fromisoformat(date_time)
+        except ValueError:
+            pass
+    return datetime.strptime(date_time, DT_FMT_YMDHMS)
+
+
+@lru_cache(maxsize=4096)
+def parse_iso_datetime(date_string):
+    """ parse ISO 8601 strings with datetime.fromisoformat, None when it is not one """
+    try:
+        return datetime.fromisoformat(date_string)
+    except ValueError:
+        return None
+
+
+def utc_now():
+    """ datetime.utcnow(), or the snapshot of the current frozen_utc_now() block """
+    holder = _now_holder.get()
+    if holder is None:
+        return datetime.utcnow()
+    if holder[0] is None:
+        holder[0] = datetime.utcnow()
+    return holder[0]
+
+
+@contextmanager
+def frozen_utc_now(now=None):
+    """ every utc_now() inside the block returns the same value, read from the clock on first use.
+        nested blocks keep the outer snapshot unless now is given.
+        """
+    if now is None and _now_holder.get() is not None:
+        yield
+        return
+    token = _now_holder.set([now])
+    try:
+        yield
+    finally:
+        _now_holder.reset(token)
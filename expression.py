@@ -0,0 +1,572 @@
+"""Safe evaluation of the python expressions of 'function' set-value fields.
+
+An expression is parsed once with ast and compiled into a chain of closures, kept in a bounded LRU cache keyed
+by the expression text and its placeholders. Only expressions are accepted: literals, names, arithmetic,
+comparisons, boolean logic, conditional expressions, subscripts, f-strings and calls. Names are looked up in
+the names given to evaluate_expression, then in the helpers (see register_expression_helper). Attributes
+starting with '_', format/format_map and attributes of anything else than plain data, dates and the helpers
+are refused, so an expression can't reach modules, builtins or the interpreter. Lists, dicts and sets only
+give their methods which don't change them: the names are the caller's objects (e.g. the record). Operations
+and methods which can build a value much larger than their operands (*, **, +, %, str.ljust, str.join,
+strftime, int() of a Decimal, ...) refuse results of more than _MAX_SIZE characters, bytes or items, or of
+more than _MAX_INT_BITS bits. utilslib registers its own helpers (str_to_datetime, get_unique_key, ...).
+
+Placeholders (e.g. '{{firstname}}') are bound when the expression is evaluated instead of being pasted into
+its text, so one compiled form serves every record: inside a string literal a placeholder is replaced by the
+text of its value, elsewhere by the value itself (a string value is read as a python literal when it is one).
+"""
+import ast
+import functools
+import math
+import operator
+import re
+import sys
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from functools import lru_cache
+
+from date_utils import parse_datetime, utc_now
+from instrumentation import span
+
+__all__ = ['ExpressionError', 'compile_expression', 'evaluate_expression', 'register_expression_helper',
+           'clear_expression_cache']
+
+# limits of the values an expression can build: items and characters of strings and containers (nested ones
+# included), bits of integers
+_MAX_SIZE = 1000000
+_MAX_INT_BITS = 65536
+_PLACEHOLDER = '_utilslib_placeholder_{}_'
+_PLACEHOLDER_NAME = re.compile(r'_utilslib_placeholder_(\d+)_')
+_MISSING = object()
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_size = 1024
+
+
+class ExpressionError(ValueError):
+    """ the expression can't be parsed or uses something that is not allowed """
+
+
+def _format_date(value, fmt='%Y-%m-%d'):
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    return _strftime(value, fmt)
+
+
+def _add_days(value, days):
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    return value + timedelta(days=days)
+
+
+def _coalesce(*values):
+    return next((value for value in values if value is not None and value != ''), None)
+
+
+def _sum(iterable, start=0):
+    if not isinstance(start, (int, float, Decimal)):
+        raise ExpressionError('sum only adds numbers')
+    return sum(iterable, start)
+
+
+def _int(value=0, *args):
+    _check_decimal(value)
+    return _check_int(int(value, *args))
+
+
+def _round(number, *args):
+    _check_decimal(number)
+    return _check_int(round(number, *args))
+
+
+def _integral(func):
+    """ math.floor & co: the int of a Decimal has as many digits as its exponent """
+    def integral(value):
+        _check_decimal(value)
+        return func(value)
+    return integral
+
+
+_helpers = {
+    'datetime': datetime, 'date': date, 'timedelta': timedelta, 'Decimal': Decimal, 'math': math,
+    'now': datetime.now, 'today': date.today, 'utc_now': utc_now, 'parse_datetime': parse_datetime,
+    'format_date': _format_date, 'add_days': _add_days, 'coalesce': _coalesce,
+    'str': str, 'int': _int, 'float': float, 'bool': bool, 'len': len, 'abs': abs, 'round': _round, 'min': min,
+    'max': max, 'sum': _sum, 'sorted': sorted, 'list': list, 'tuple': tuple, 'dict': dict,
+}
+
+# attributes are only read on values of these exact types (or on these classes), and on the helpers
+_DATA_TYPES = frozenset([str, int, float, bool, type(None), list, tuple, dict, set, frozenset, date, datetime,
+                         timedelta, Decimal])
+_REFUSED_ATTRIBUTES = frozenset(['format', 'format_map', 'translate', 'maketrans'])
+# the only attributes of these types: names and conf are the caller's objects, expressions can't change them,
+# and int.to_bytes & co can't allocate without bounds
+_SET_METHODS = frozenset(['copy', 'difference', 'intersection', 'isdisjoint', 'issubset', 'issuperset',
+                          'symmetric_difference', 'union'])
+_NUMBER_ATTRIBUTES = frozenset(['real', 'imag', 'numerator', 'denominator', 'conjugate', 'bit_length',
+                                'is_integer', 'as_integer_ratio'])
+_ALLOWED_ATTRIBUTES = {
+    list: frozenset(['copy', 'count', 'index']),
+    # no as_integer_ratio: the ints of a Decimal can have a million digits
+    Decimal: frozenset(['adjusted', 'as_tuple', 'compare', 'copy_abs', 'copy_negate', 'copy_sign', 'exp',
+                        'is_finite', 'is_infinite', 'is_nan', 'is_signed', 'is_zero', 'ln', 'log10', 'normalize',
+                        'quantize', 'sqrt', 'to_eng_string', 'to_integral', 'to_integral_value', 'real', 'imag']),
+    dict: frozenset(['copy', 'get', 'items', 'keys', 'values']),
+    set: _SET_METHODS,
+    frozenset: _SET_METHODS,
+    int: _NUMBER_ATTRIBUTES,
+    bool: _NUMBER_ATTRIBUTES,
+    float: _NUMBER_ATTRIBUTES,
+    math: frozenset(['ceil', 'copysign', 'e', 'exp', 'fabs', 'floor', 'fmod', 'fsum', 'gcd', 'inf', 'isclose',
+                     'isfinite', 'isinf', 'isnan', 'log', 'log10', 'log2', 'nan', 'pi', 'pow', 'sqrt', 'tau',
+                     'trunc']),
+}
+
+_BINARY_OPERATORS = {
+    ast.Sub: operator.sub, ast.Div: operator.truediv, ast.FloorDiv: operator.floordiv,
+}
+_UNARY_OPERATORS = {ast.UAdd: operator.pos, ast.USub: operator.neg, ast.Not: operator.not_,
+                    ast.Invert: operator.invert}
+_COMPARISONS = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt, ast.LtE: operator.le, ast.Gt: operator.gt,
+    ast.GtE: operator.ge, ast.Is: operator.is_, ast.IsNot: operator.is_not,
+    ast.In: lambda a, b: a in b, ast.NotIn: lambda a, b: a not in b,
+}
+
+
+def register_expression_helper(name, value):
+    """ make value (a function, a class or a module) available to expressions as name """
+    if name.startswith('_'):
+        raise ValueError('helper names can not start with _')
+    _helpers[name] = value
+
+
+def evaluate_expression(source, names=None, replacements=None):
+    """ value of the expression source.
+        names: {name: value} available to the expression, before the helpers
+        replacements: {placeholder: value} found in source, e.g. the result of a json_logic replace rule
+        """
+    keys = tuple(sorted(key for key in replacements if key != '')) if replacements else ()
+    return compile_expression(source, keys)(names or {}, [replacements[key] for key in keys])
+
+
+def compile_expression(source, placeholders=()):
+    """ return a callable f(names, values) giving the value of source, where the n-th placeholder of source
+        stands for values[n]. raises ExpressionError when source is not an allowed expression.
+        """
+    key = (source, placeholders)
+    with _cache_lock:
+        func = _cache.get(key)
+        if func is not None:
+            _cache.move_to_end(key)
+            return func
+
+    with span('expression_compile'):
+        func = _compile_source(source, placeholders)
+
+    with _cache_lock:
+        _cache[key] = func
+        while len(_cache) > _cache_size:
+            _cache.popitem(last=False)
+    return func
+
+
+def clear_expression_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def _compile_source(source, placeholders):
+    if _PLACEHOLDER_NAME.search(source):
+        raise ExpressionError('invalid expression: {!r}'.format(source))
+    present = [key for key in placeholders if key in source]
+    if present:
+        # longest first, so a placeholder that is the prefix of another one can't cut it
+        pattern = re.compile('|'.join(re.escape(key) for key in sorted(present, key=len, reverse=True)))
+        indexes = {key: index for index, key in enumerate(placeholders)}
+        source = pattern.sub(lambda match: _PLACEHOLDER.format(indexes[match.group(0)]), source)
+    try:
+        tree = ast.parse(source.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ExpressionError('invalid expression {!r}: {}'.format(source, e.msg))
+    return _compile(tree.body)
+
+
+def _compile(node):
+    compiler = _COMPILERS.get(type(node))
+    if compiler is None:
+        raise ExpressionError('{} is not allowed in expressions'.format(type(node).__name__))
+    return compiler(node)
+
+
+def _compile_constant(node):
+    value = node.value
+    if isinstance(value, str) and _PLACEHOLDER_NAME.search(value):
+        parts = _PLACEHOLDER_NAME.split(value)
+        texts = parts[0::2]
+        indexes = [int(index) for index in parts[1::2]]
+
+        def evaluate(names, values):
+            result = texts[0]
+            for index, text in zip(indexes, texts[1:]):
+                result += str(values[index]) + text
+            return result
+        return evaluate
+    return lambda names, values: value
+
+
+def _compile_name(node):
+    name = node.id
+    match = _PLACEHOLDER_NAME.fullmatch(name)
+    if match:
+        index = int(match.group(1))
+        return lambda names, values: _placeholder_value(values[index])
+    if name.startswith('_'):
+        raise ExpressionError('name {!r} is not allowed in expressions'.format(name))
+
+    def evaluate(names, values):
+        value = names.get(name, _MISSING)
+        if value is _MISSING:
+            value = _helpers.get(name, _MISSING)
+            if value is _MISSING:
+                raise NameError('name {!r} is not defined'.format(name))
+        return value
+    return evaluate
+
+
+def _placeholder_value(value):
+    if isinstance(value, str):
+        return _literal(value)
+    return value
+
+
+@lru_cache(maxsize=4096)
+def _literal(text):
+    try:
+        return ast.literal_eval(text.strip())
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        return text
+
+
+def _compile_attribute(node):
+    attribute = node.attr
+    if attribute.startswith('_') or attribute in _REFUSED_ATTRIBUTES:
+        raise ExpressionError('attribute {!r} is not allowed in expressions'.format(attribute))
+    owner = _compile(node.value)
+    return lambda names, values: _attribute(owner(names, values), attribute)
+
+
+def _attribute(value, attribute):
+    bound = type(value) in _DATA_TYPES
+    if bound:
+        kind = type(value)
+    elif isinstance(value, type) and value in _DATA_TYPES or value is math:
+        kind = value
+    elif any(value is helper for helper in _helpers.values()):
+        return getattr(value, attribute)
+    else:
+        raise ExpressionError('attributes of {} are not allowed in expressions'.format(type(value).__name__))
+    allowed = _ALLOWED_ATTRIBUTES.get(kind)
+    if allowed is not None and attribute not in allowed:
+        raise ExpressionError('{}.{} is not allowed in expressions'.format(getattr(kind, '__name__', kind), attribute))
+    sized = _SIZED_METHODS.get(kind, {}).get(attribute)
+    if sized is not None:
+        if not bound:
+            raise ExpressionError('{0}.{1} is not allowed in expressions, call it on a {0}'.format(
+                kind.__name__, attribute))
+        return functools.partial(sized, value)
+    if kind is math and attribute in _INTEGRAL_MATH:
+        return _INTEGRAL_MATH[attribute]
+    return getattr(value, attribute)
+
+
+def _compile_call(node):
+    if any(isinstance(arg, ast.Starred) for arg in node.args) or any(kw.arg is None for kw in node.keywords):
+        raise ExpressionError('argument unpacking is not allowed in expressions')
+    func = _compile(node.func)
+    args = [_compile(arg) for arg in node.args]
+    kwargs = [(kw.arg, _compile(kw.value)) for kw in node.keywords]
+
+    def evaluate(names, values):
+        return func(names, values)(*[arg(names, values) for arg in args],
+                                   **{name: arg(names, values) for name, arg in kwargs})
+    return evaluate
+
+
+def _size(value, budget=_MAX_SIZE):
+    """ characters and items of value, nested containers included, counted up to a bit more than budget """
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, (list, tuple, set, frozenset, dict)):
+        total = len(value)
+        for item in (value.items() if isinstance(value, dict) else value):
+            if total > budget:
+                break
+            total += _size(item, budget - total)
+        return total
+    return 1
+
+
+def _check_size(size):
+    if size > _MAX_SIZE:
+        raise ExpressionError('value too large')
+
+
+def _check_int(value):
+    if isinstance(value, int) and value.bit_length() > _MAX_INT_BITS:
+        raise ExpressionError('integer too large')
+    return value
+
+
+# digits of an int of _MAX_INT_BITS bits
+_MAX_INT_DIGITS = int(_MAX_INT_BITS * math.log10(2)) + 1
+
+
+def _check_decimal(value):
+    """ refuse a Decimal whose int (or fixed-point text) would be too large, before it is built """
+    if isinstance(value, Decimal) and value.is_finite() and value.adjusted() > _MAX_INT_DIGITS:
+        raise ExpressionError('number too large')
+
+
+_SEQUENCES = (str, bytes, list, tuple)
+
+
+def _add(left, right):
+    if isinstance(left, _SEQUENCES) and isinstance(right, _SEQUENCES):
+        _check_size(_size(left) + _size(right))
+    return left + right
+
+
+def _multiply(left, right):
+    if isinstance(left, int) and isinstance(right, int):
+        if left.bit_length() + right.bit_length() > _MAX_INT_BITS:
+            raise ExpressionError('integer too large')
+    else:
+        for sequence, count in ((left, right), (right, left)):
+            if isinstance(sequence, _SEQUENCES) and isinstance(count, int):
+                _check_size(_size(sequence) * count)
+    return left * right
+
+
+def _power(base, exponent):
+    if isinstance(base, int) and isinstance(exponent, int) and abs(base) > 1 and exponent > 0 \
+            and (abs(base).bit_length() - 1) * exponent > _MAX_INT_BITS:
+        raise ExpressionError('integer too large')
+    return base ** exponent
+
+
+_WIDTHS = re.compile(r'\d+')
+
+
+def _check_widths(spec):
+    """ widths and precisions of a format spec or of a %-format string """
+    for width in _WIDTHS.findall(spec):
+        _check_size(int(width))
+
+
+def _modulo(left, right):
+    if isinstance(left, (str, bytes)):
+        _check_widths(left if isinstance(left, str) else left.decode('latin-1'))
+        for arg in (right if isinstance(right, tuple) else (right,)):
+            if isinstance(arg, int) and not isinstance(arg, bool):
+                # a '*' width is taken from the arguments
+                _check_size(arg)
+            # %d of a Decimal goes through its int
+            _check_decimal(arg)
+    return left % right
+
+
+def _ljust(text, width, *args):
+    _check_size(width)
+    return text.ljust(width, *args)
+
+
+def _rjust(text, width, *args):
+    _check_size(width)
+    return text.rjust(width, *args)
+
+
+def _center(text, width, *args):
+    _check_size(width)
+    return text.center(width, *args)
+
+
+def _zfill(text, width):
+    _check_size(width)
+    return text.zfill(width)
+
+
+def _expandtabs(text, tabsize=8):
+    _check_size(len(text) * max(tabsize, 1))
+    return text.expandtabs(tabsize)
+
+
+def _join(text, iterable):
+    items = list(iterable)
+    _check_size(sum(len(item) for item in items if isinstance(item, str)) + len(text) * max(len(items) - 1, 0))
+    return text.join(items)
+
+
+def _replace(text, old, new, count=-1):
+    found = text.count(old) if old else len(text) + 1
+    if count >= 0:
+        found = min(found, count)
+    _check_size(len(text) + found * len(new))
+    return text.replace(old, new, count)
+
+
+def _check_date_format(fmt):
+    # a directive gives at most a few dozen characters (%c is the longest)
+    _check_size(len(fmt) + 64 * fmt.count('%'))
+
+
+def _strftime(value, fmt):
+    _check_date_format(fmt)
+    return value.strftime(fmt)
+
+
+# methods whose result can be much longer than the value, their arguments are checked first
+_SIZED_STR_METHODS = {'ljust': _ljust, 'rjust': _rjust, 'center': _center, 'zfill': _zfill,
+                      'expandtabs': _expandtabs, 'join': _join, 'replace': _replace}
+_SIZED_METHODS = {str: _SIZED_STR_METHODS, date: {'strftime': _strftime}, datetime: {'strftime': _strftime}}
+_INTEGRAL_MATH = {name: _integral(getattr(math, name)) for name in ('ceil', 'floor', 'trunc')}
+
+
+def _compile_binary(node):
+    if isinstance(node.op, ast.Add):
+        func = _add
+    elif isinstance(node.op, ast.Mult):
+        func = _multiply
+    elif isinstance(node.op, ast.Pow):
+        func = _power
+    elif isinstance(node.op, ast.Mod):
+        func = _modulo
+    else:
+        func = _BINARY_OPERATORS.get(type(node.op))
+        if func is None:
+            raise ExpressionError('{} is not allowed in expressions'.format(type(node.op).__name__))
+    left = _compile(node.left)
+    right = _compile(node.right)
+    return lambda names, values: func(left(names, values), right(names, values))
+
+
+def _compile_unary(node):
+    func = _UNARY_OPERATORS[type(node.op)]
+    operand = _compile(node.operand)
+    return lambda names, values: func(operand(names, values))
+
+
+def _compile_bool(node):
+    operands = [_compile(value) for value in node.values]
+    is_and = isinstance(node.op, ast.And)
+
+    def evaluate(names, values):
+        for operand in operands:
+            result = operand(names, values)
+            if bool(result) is not is_and:
+                return result
+        return result
+    return evaluate
+
+
+def _compile_compare(node):
+    left = _compile(node.left)
+    steps = [(_COMPARISONS[type(op)], _compile(comparator)) for op, comparator in zip(node.ops, node.comparators)]
+
+    def evaluate(names, values):
+        value = left(names, values)
+        for func, comparator in steps:
+            other = comparator(names, values)
+            if not func(value, other):
+                return False
+            value = other
+        return True
+    return evaluate
+
+
+def _compile_if(node):
+    test = _compile(node.test)
+    body = _compile(node.body)
+    orelse = _compile(node.orelse)
+    return lambda names, values: body(names, values) if test(names, values) else orelse(names, values)
+
+
+def _compile_subscript(node):
+    value = _compile(node.value)
+    index = _compile(node.slice)
+    return lambda names, values: value(names, values)[index(names, values)]
+
+
+def _compile_slice(node):
+    parts = [_compile(part) if part is not None else None for part in (node.lower, node.upper, node.step)]
+    return lambda names, values: slice(*[part(names, values) if part else None for part in parts])
+
+
+def _compile_sequence(build):
+    def compiler(node):
+        if any(isinstance(item, ast.Starred) for item in node.elts):
+            raise ExpressionError('unpacking is not allowed in expressions')
+        items = [_compile(item) for item in node.elts]
+        return lambda names, values: build(item(names, values) for item in items)
+    return compiler
+
+
+def _compile_dict(node):
+    if any(key is None for key in node.keys):
+        raise ExpressionError('unpacking is not allowed in expressions')
+    items = [(_compile(key), _compile(value)) for key, value in zip(node.keys, node.values)]
+    return lambda names, values: {key(names, values): value(names, values) for key, value in items}
+
+
+def _compile_joined(node):
+    parts = [_compile(value) for value in node.values]
+    return lambda names, values: ''.join(str(part(names, values)) for part in parts)
+
+
+def _compile_formatted(node):
+    value = _compile(node.value)
+    spec = _compile(node.format_spec) if node.format_spec is not None else None
+    convert = {-1: None, 115: str, 114: repr, 97: ascii}[node.conversion]
+
+    def evaluate(names, values):
+        result = value(names, values)
+        if convert is not None:
+            result = convert(result)
+        if spec is None:
+            return format(result)
+        format_spec = spec(names, values)
+        _check_widths(format_spec)
+        if isinstance(result, date):
+            _check_date_format(format_spec)
+        elif isinstance(result, Decimal) and result.is_finite():
+            # fixed-point formats write every digit of the exponent
+            _check_size(abs(result.adjusted()))
+        return format(result, format_spec)
+    return evaluate
+
+
+_COMPILERS = {
+    ast.Constant: _compile_constant,
+    ast.Name: _compile_name,
+    ast.Attribute: _compile_attribute,
+    ast.Call: _compile_call,
+    ast.BinOp: _compile_binary,
+    ast.UnaryOp: _compile_unary,
+    ast.BoolOp: _compile_bool,
+    ast.Compare: _compile_compare,
+    ast.IfExp: _compile_if,
+    ast.Subscript: _compile_subscript,
+    ast.Slice: _compile_slice,
+    ast.List: _compile_sequence(list),
+    ast.Tuple: _compile_sequence(tuple),
+    ast.Set: _compile_sequence(set),
+    ast.Dict: _compile_dict,
+    ast.JoinedStr: _compile_joined,
+    ast.FormattedValue: _compile_formatted,
+}
+if sys.version_info < (3, 9):
+    # python 3.8 wraps subscripts in an Index node
+    _COMPILERS[ast.Index] = lambda node: _compile(node.value)
@@ -0,0 +1,311 @@
+"""Per-host scheduling of HTTP requests: rate limit, in-flight cap, 429 handling and circuit breaker.
+
+Every request to a host goes through the HostState of the host:
+    1. wait for a free in-flight slot (max_in_flight)
+    2. wait for a token of the token bucket (rate requests per second, bursts of up to burst)
+    3. wait while the host asked us to back off (429/503 with Retry-After)
+    4. send, then retry with jittered exponential backoff on 429/503 (and on 5xx and connection errors for
+       idempotent methods)
+After failure_threshold consecutive failures (request exceptions and 5xx) the circuit of the host opens and
+requests fail right away with CircuitOpenError for reset_timeout seconds, then one probe request is let
+through: it closes the circuit again if it succeeds.
+
+invoke_http_request sends scheduled requests with a pooled session that never retries
+(get_http_session(scheduled=True)): errors and statuses are retried by the scheduler alone.
+CircuitOpenError and SlotTimeoutError are RequestExceptions: callers handling failed requests handle them too.
+"""
+import functools
+import os
+import random
+import threading
+import time
+import weakref
+from email.utils import parsedate_to_datetime
+
+import requests
+
+from instrumentation import add_phase, inc_counter, logger
+
+__all__ = ['HostPolicy', 'HostScheduler', 'CircuitOpenError', 'SlotTimeoutError', 'enable_host_scheduler',
+           'disable_host_scheduler', 'get_host_scheduler']
+
+_IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+_instances = weakref.WeakSet()
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """ the circuit breaker of the host is open, the request was not sent """
+
+
+class SlotTimeoutError(requests.exceptions.RequestException, TimeoutError):
+    """ no in-flight slot of the host got free within slot_timeout, the request was not sent """
+
+
+class HostPolicy(object):
+    """ limits of one host.
+        params:
+        1. rate: requests per second, None for no rate limit
+        2. burst: requests that can be sent at once after an idle time, default rate (at least 1)
+        3. max_in_flight: concurrent requests, None for no cap
+        4. max_retries: retries of a request on 429/503, 5xx or connection errors
+        5. backoff_base, backoff_max: retry n waits a random time up to min(backoff_max, backoff_base * 2 ** n)
+        6. max_retry_after: a longer Retry-After is not waited for, the response is returned
+        7. retry_statuses: statuses retried for every method, 5xx are retried for idempotent methods only
+        8. failure_threshold: consecutive failures opening the circuit, None to never open it
+        9. reset_timeout: seconds the circuit stays open before a probe request
+        10. slot_timeout: max seconds to wait for an in-flight slot, SlotTimeoutError after that
+        """
+
+    def __init__(self, rate=None, burst=None, max_in_flight=None, max_retries=3, backoff_base=0.5, backoff_max=30,
+                 max_retry_after=120, retry_statuses=(429, 503), failure_threshold=5, reset_timeout=30,
+                 slot_timeout=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, rate or 1)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.retry_statuses = tuple(retry_statuses)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slot_timeout = slot_timeout
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+
+class _TokenBucket(object):
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """ take a token, returns the seconds to wait before it is really available """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class HostState(object):
+    """ rate limit, slots, back off time and circuit of one host """
+
+    def __init__(self, host, policy):
+        self.host = host
+        self.policy = policy
+        self.bucket = _TokenBucket(policy.rate, policy.burst) if policy.rate else None
+        self.slots = threading.BoundedSemaphore(policy.max_in_flight) if policy.max_in_flight else None
+        self.lock = threading.Lock()
+        self.paused_until = 0.0
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def before_request(self):
+        """ raise CircuitOpenError when the circuit is open, returns True for a probe request """
+        if self.opened_at is None:
+            return False
+        with self.lock:
+            if self.opened_at is None:
+                return False
+            if self.probing or time.monotonic() - self.opened_at < self.policy.reset_timeout:
+                raise CircuitOpenError('circuit open for {}'.format(self.host))
+            self.probing = True
+            return True
+
+    def record(self, failed, probe):
+        with self.lock:
+            if probe:
+                self.probing = False
+            if not failed:
+                self.failures = 0
+                if self.opened_at is not None:
+                    logger.info('circuit closed for %s', self.host)
+                self.opened_at = None
+                return
+            self.failures += 1
+            threshold = self.policy.failure_threshold
+            if probe or (threshold is not None and self.failures >= threshold and self.opened_at is None):
+                self.opened_at = time.monotonic()
+                inc_counter('http_circuit_open_total', host=self.host)
+                logger.warning('circuit opened for %s after %s failures', self.host, self.failures)
+
+    def end_probe(self):
+        with self.lock:
+            self.probing = False
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def wait_turn(self):
+        """ wait for a token and for the end of a back off, returns the seconds waited """
+        waited = 0.0
+        if self.bucket is not None:
+            delay = self.bucket.reserve()
+            if delay > 0:
+                time.sleep(delay)
+                waited += delay
+        delay = self.paused_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+            waited += delay
+        return waited
+
+
+class HostScheduler(object):
+    """ schedules requests per host, see the module doc.
+        default: HostPolicy of the hosts without their own one, host_policies: {host: HostPolicy}
+        """
+
+    def __init__(self, default=None, host_policies=None):
+        self.default = default or HostPolicy()
+        self.host_policies = {host.lower(): policy for host, policy in (host_policies or {}).items()}
+        self._states = {}
+        self._lock = threading.Lock()
+        _instances.add(self)
+
+    def state(self, host):
+        host = host.lower()
+        state = self._states.get(host)
+        if state is None:
+            with self._lock:
+                state = self._states.get(host)
+                if state is None:
+                    state = self._states[host] = HostState(host, self.host_policies.get(host, self.default))
+        return state
+
+    def run(self, host, method, send):
+        """ call send() for a request to host under the limits of the host, returns its response """
+        state = self.state(host)
+        attempt = 0
+        while True:
+            probe = state.before_request()
+            try:
+                delay, reason, response = self._attempt(state, method, send, attempt, probe)
+            finally:
+                if probe:
+                    # a probe ending without a response (slot timeout, unexpected error) lets the next one in
+                    state.end_probe()
+            if delay is None:
+                return response
+            inc_counter('http_scheduler_retries_total', host=host, reason=reason)
+            time.sleep(delay)
+            attempt += 1
+
+    def _attempt(self, state, method, send, attempt, probe):
+        """ send once, returns (None, None, response) when done or (delay, reason, None) to retry """
+        policy = state.policy
+        started = time.perf_counter()
+        if state.slots is not None and not state.slots.acquire(timeout=policy.slot_timeout):
+            raise SlotTimeoutError('no free request slot for {} within {}s'.format(state.host, policy.slot_timeout))
+        try:
+            state.wait_turn()
+            add_phase('queue', time.perf_counter() - started)
+            try:
+                response = send()
+            except requests.exceptions.RequestException as e:
+                state.record(True, probe)
+                retry = isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+                if (not retry or attempt >= policy.max_retries or method not in _IDEMPOTENT_METHODS
+                        or state.opened_at is not None):
+                    raise
+                return policy.backoff(attempt), 'error', None
+
+            status = response.status_code
+            state.record(status >= 500, probe)
+            retry = status in policy.retry_statuses or (status >= 500 and method in _IDEMPOTENT_METHODS)
+            # no retry once this request opened the circuit: the caller gets the failure itself
+            if not retry or attempt >= policy.max_retries or state.opened_at is not None:
+                return None, None, response
+            delay = _retry_after(response)
+            if delay is None:
+                delay = policy.backoff(attempt)
+            elif delay > policy.max_retry_after:
+                return None, None, response
+            else:
+                # the whole host is asked to wait, not only this request
+                state.pause(delay)
+            return delay, str(status), None
+        finally:
+            if state.slots is not None:
+                state.slots.release()
+
+    def session(self, session, host):
+        """ session whose get/post/put/delete go through run() """
+        return _ScheduledSession(self, session, host)
+
+    def _reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._states = {}
+
+
+class _ScheduledSession(object):
+    def __init__(self, scheduler, session, host):
+        self._scheduler = scheduler
+        self._session = session
+        self._host = host
+
+    def _run(self, method, func, args, kwargs):
+        return self._scheduler.run(self._host, method, functools.partial(func, *args, **kwargs))
+
+    def get(self, *args, **kwargs):
+        return self._run('GET', self._session.get, args, kwargs)
+
+    def post(self, *args, **kwargs):
+        return self._run('POST', self._session.post, args, kwargs)
+
+    def put(self, *args, **kwargs):
+        return self._run('PUT', self._session.put, args, kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._run('DELETE', self._session.delete, args, kwargs)
+
+
+def _retry_after(response):
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+_default_scheduler = None
+
+
+def enable_host_scheduler(default=None, host_policies=None):
+    """ send the requests of invoke_http_request through a HostScheduler from now on """
+    global _default_scheduler
+    _default_scheduler = HostScheduler(default, host_policies)
+    return _default_scheduler
+
+
+def disable_host_scheduler():
+    global _default_scheduler
+    _default_scheduler = None
+
+
+def get_host_scheduler():
+    """ the scheduler enabled by enable_host_scheduler, or None """
+    return _default_scheduler
+
+
+def _reset_schedulers_after_fork():
+    for scheduler in list(_instances):
+        scheduler._reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_schedulers_after_fork)
@@ -0,0 +1,258 @@
+"""Opt-in cache for the responses of idempotent GET requests"""
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+__all__ = ['HttpResponseCache', 'enable_http_cache', 'disable_http_cache', 'get_http_cache']
+
+_CACHEABLE_STATUS = (200, 203)
+_instances = weakref.WeakSet()
+
+
+class _Entry(object):
+    __slots__ = ('response', 'expires', 'etag', 'last_modified', 'must_revalidate')
+
+    def __init__(self, response, expires, must_revalidate):
+        self.response = response
+        self.expires = expires
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+        self.must_revalidate = must_revalidate
+
+
+class _Call(object):
+    def __init__(self):
+        self.event = threading.Event()
+
+
+class HttpResponseCache(object):
+    """ LRU cache of GET responses keyed by (method, url, key headers, body).
+        a hit returns a new Response holding the cached status, headers and content, so the json parsed by
+        one caller can't be changed by another one. identical requests made while one of them is on the
+        network wait for it instead of sending their own (single-flight).
+
+        params:
+        1. ttl: seconds a response is fresh, when the server does not say otherwise
+        2. max_entries: responses kept, the least recently used one is dropped past that
+        3. max_entry_size: bodies bigger than this many bytes are not cached
+        4. respect_cache_control: follow Cache-Control of the response (no-store, no-cache, max-age) and of
+           the request (no-cache, no-store bypass the cache)
+        5. revalidate: once a response with an ETag or Last-Modified is stale, ask the server with
+           If-None-Match/If-Modified-Since and keep the cached body on 304
+        6. key_headers: names of the request headers that are part of the key, None means all of them
+        """
+
+    def __init__(self, ttl=30, max_entries=1024, max_entry_size=1024 * 1024, respect_cache_control=True,
+                 revalidate=True, key_headers=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_entry_size = max_entry_size
+        self.respect_cache_control = respect_cache_control
+        self.revalidate = revalidate
+        self.key_headers = None if key_headers is None else frozenset(name.lower() for name in key_headers)
+        self._entries = OrderedDict()
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(('hits', 'misses', 'revalidated', 'stored', 'evicted', 'bypassed'), 0)
+        _instances.add(self)
+
+    def get(self, session, url, headers=None, data=None, timeout=None):
+        """ GET url through session, or answer from the cache """
+        headers = headers or {}
+        request_directives = _cache_control(_header(headers, 'Cache-Control')) if self.respect_cache_control else {}
+        if 'no-store' in request_directives:
+            self._count('bypassed')
+            return session.get(url=url, data=data, headers=headers, timeout=timeout)
+        key = self._key(url, headers, data)
+        try:
+            hash(key)
+        except TypeError:
+            self._count('bypassed')
+            return session.get(url=url, data=data, headers=headers, timeout=timeout)
+
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and 'no-cache' not in request_directives and not entry.must_revalidate \
+                        and entry.expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._counters['hits'] += 1
+                    hit = _copy(entry.response)
+                    hit.from_cache = True
+                    return hit
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+            if leader:
+                break
+            # the same request is on its way, use its response once it is there
+            call.event.wait()
+            request_directives = dict(request_directives)
+            request_directives.pop('no-cache', None)
+
+        try:
+            return self._fetch(key, entry, session, url, headers, data, timeout)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def _fetch(self, key, entry, session, url, headers, data, timeout):
+        send_headers = headers
+        if entry is not None and self.revalidate and (entry.etag or entry.last_modified):
+            send_headers = dict(headers)
+            if entry.etag:
+                send_headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                send_headers['If-Modified-Since'] = entry.last_modified
+        response = session.get(url=url, data=data, headers=send_headers, timeout=timeout)
+
+        if response.status_code == 304 and send_headers is not headers:
+            with self._lock:
+                self._counters['revalidated'] += 1
+                # a 304 without freshness headers keeps the ones of the cached response
+                fresh = response if response.headers.get('Cache-Control') or response.headers.get('Expires') \
+                    else entry.response
+                entry.expires, entry.must_revalidate, _ = self._freshness(fresh)
+                if self._entries.get(key) is entry:
+                    self._entries.move_to_end(key)
+            return _copy(entry.response)
+
+        self._count('misses')
+        expires, must_revalidate, store = self._freshness(response)
+        if store and response.status_code in _CACHEABLE_STATUS and len(response.content) <= self.max_entry_size:
+            with self._lock:
+                self._entries[key] = _Entry(_copy(response), expires, must_revalidate)
+                self._entries.move_to_end(key)
+                self._counters['stored'] += 1
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._counters['evicted'] += 1
+        return response
+
+    def _freshness(self, response):
+        """ (expires, must_revalidate, store) for a response """
+        ttl = self.ttl
+        must_revalidate = False
+        if self.respect_cache_control:
+            directives = _cache_control(response.headers.get('Cache-Control'))
+            if 'no-store' in directives:
+                return 0, True, False
+            must_revalidate = 'no-cache' in directives
+            max_age = directives.get('max-age')
+            if max_age is not None:
+                try:
+                    ttl = max(0, int(max_age))
+                except ValueError:
+                    pass
+            elif response.headers.get('Expires'):
+                ttl = _seconds_until(response.headers['Expires'], ttl)
+        return time.monotonic() + ttl, must_revalidate, True
+
+    def _key(self, url, headers, data):
+        items = tuple(sorted((name.lower(), str(value)) for name, value in headers.items()
+                             if self.key_headers is None or name.lower() in self.key_headers))
+        if isinstance(data, dict):
+            data = tuple(sorted(data.items()))
+        return 'GET', url, items, data
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        """ hit/miss counters and the number of cached responses """
+        with self._lock:
+            return {**self._counters, 'entries': len(self._entries)}
+
+    def invalidate(self, url=None):
+        """ drop the responses of url, or every response when url is None """
+        with self._lock:
+            if url is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[1] == url]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for name in self._counters:
+                self._counters[name] = 0
+
+    def _reset_after_fork(self):
+        # a lock held or a request in flight in another thread of the parent would never be released here
+        self._lock = threading.Lock()
+        self._calls = {}
+
+
+def _copy(response):
+    copy = requests.Response()
+    copy.status_code = response.status_code
+    copy.headers = CaseInsensitiveDict(response.headers)
+    copy._content = response.content
+    copy.encoding = response.encoding
+    copy.reason = response.reason
+    copy.url = response.url
+    copy.request = response.request
+    copy.elapsed = response.elapsed
+    return copy
+
+
+def _header(headers, name):
+    for key, value in headers.items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+
+def _cache_control(value):
+    directives = {}
+    for part in (value or '').split(','):
+        name, _, argument = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip('"') or None
+    return directives
+
+
+def _seconds_until(http_date, default):
+    try:
+        return max(0, parsedate_to_datetime(http_date).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+_default_cache = None
+
+
+def enable_http_cache(**options):
+    """ cache the GETs of invoke_http_request from now on. options are passed to HttpResponseCache """
+    global _default_cache
+    _default_cache = HttpResponseCache(**options)
+    return _default_cache
+
+
+def disable_http_cache():
+    global _default_cache
+    _default_cache = None
+
+
+def get_http_cache():
+    """ the cache enabled by enable_http_cache, or None """
+    return _default_cache
+
+
+def _reset_caches_after_fork():
+    for cache in list(_instances):
+        cache._reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_caches_after_fork)
@@ -0,0 +1,161 @@
+"""Process wide registry of pooled HTTP sessions"""
+import os
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from instrumentation import add_phase
+
+__all__ = ['configure_http_pool', 'get_http_session', 'close_http_sessions', 'reset_http_sessions']
+
+_pool_config = {
+    'pool_connections': 10,
+    'pool_maxsize': 20,
+    'pool_block': False,
+    'keep_alive': True,
+    'host_limits': {},
+}
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+def configure_http_pool(pool_connections=None, pool_maxsize=None, pool_block=None, keep_alive=None,
+                        host_limits=None):
+    """ change the pool settings used for sessions created from now on.
+        params:
+        1. pool_connections: number of host pools cached by a session
+        2. pool_maxsize: max connections kept alive per host
+        3. pool_block: wait for a free connection instead of opening an extra one when the pool is busy
+        4. keep_alive: False sends "Connection: close" on every request
+        5. host_limits: {host: pool_maxsize} overrides for single hosts
+
+        Sessions which are already pooled are closed so the new settings apply on the next request.
+        """
+    with _lock:
+        if pool_connections is not None:
+            _pool_config['pool_connections'] = pool_connections
+        if pool_maxsize is not None:
+            _pool_config['pool_maxsize'] = pool_maxsize
+        if pool_block is not None:
+            _pool_config['pool_block'] = pool_block
+        if keep_alive is not None:
+            _pool_config['keep_alive'] = keep_alive
+        if host_limits is not None:
+            _pool_config['host_limits'] = {host.lower(): size for host, size in host_limits.items()}
+        sessions = list(_sessions.values())
+        _sessions.clear()
+
+    for session in sessions:
+        session.close()
+
+
+def get_http_session(endpoint, retries=3, backoff_factor=0.3, status_forcelist=(500, 502, 504), scheduled=False):
+    """ return the shared session for the scheme and host of endpoint.
+        one session is kept per (scheme, host, retry policy), so connections to vtiger and the
+        workflow service are reused across calls and threads.
+        scheduled: True for requests retried by host_scheduler, the session then never retries (errors are
+        raised and responses returned whatever their status), so there is a single retry layer
+        """
+    parts = urlsplit(endpoint)
+    if scheduled:
+        retries, status_forcelist = 0, ()
+    key = (parts.scheme, parts.netloc.lower(), retries, backoff_factor, tuple(status_forcelist), scheduled)
+
+    session = _sessions.get(key)
+    if session is None:
+        with _lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _build_session(parts.scheme, parts.hostname or '', retries, backoff_factor,
+                                         status_forcelist, scheduled)
+                _sessions[key] = session
+    return session
+
+
+def _build_session(scheme, host, retries, backoff_factor, status_forcelist, scheduled=False):
+    session = requests.Session()
+    # every call used to get a fresh session, so don't let cookies leak from one call to the next
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    if not _pool_config['keep_alive']:
+        session.headers['Connection'] = 'close'
+
+    if scheduled:
+        # the default of requests: no retry, read errors raised as they are
+        retry = Retry(0, read=False)
+    else:
+        retry = Retry(
+            total=retries,
+            read=retries,
+            connect=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=status_forcelist,
+        )
+    adapter = HTTPAdapter(max_retries=retry,
+                          pool_connections=_pool_config['pool_connections'],
+                          pool_maxsize=_pool_config['host_limits'].get(host.lower(), _pool_config['pool_maxsize']),
+                          pool_block=_pool_config['pool_block'])
+    adapter.poolmanager.pool_classes_by_scheme = _TIMED_POOL_CLASSES
+    session.mount('{}://'.format(scheme or 'http'), adapter)
+    return session
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    # time spent opening new connections (dns + tcp), reported as the connect phase of the current span
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            add_phase('connect', time.perf_counter() - start)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    # dns + tcp + tls handshake
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            add_phase('connect', time.perf_counter() - start)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+_TIMED_POOL_CLASSES = {'http': _TimedHTTPConnectionPool, 'https': _TimedHTTPSConnectionPool}
+
+
+def close_http_sessions():
+    """ close every pooled session and its connections """
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+
+    for session in sessions:
+        session.close()
+
+
+def reset_http_sessions():
+    """ forget pooled sessions without closing them.
+        used in a forked child, where the sockets still belong to the parent process.
+        """
+    global _lock
+    _lock = threading.Lock()
+    _sessions.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_http_sessions)
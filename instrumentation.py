@@ -0,0 +1,269 @@
+"""Timing spans, counters and histograms for the HTTP and task functions, and the utilslib loggers.
+
+    with span('http_request', host=host) as request_span:
+        ...
+        request_span.phase('ttfb', seconds)
+
+A finished span is observed in the histogram <name>_seconds with its labels plus outcome ("ok" or "error"),
+each phase in <name>_<phase>_seconds, then passed to every callback of add_metrics_callback.
+metrics_snapshot() returns everything recorded so far, prometheus_text() the same in the Prometheus text
+format.
+
+Diagnostics go to logging.getLogger('utilslib'). Request and response bodies are only logged through
+log_payload, which does nothing until set_payload_logging(True) and formats lazily.
+"""
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+
+__all__ = ['logger', 'payload_logger', 'log_payload', 'set_payload_logging', 'span', 'timed', 'add_phase',
+           'inc_counter', 'observe', 'add_metrics_callback', 'remove_metrics_callback', 'metrics_snapshot',
+           'prometheus_text', 'reset_metrics', 'set_instrumentation_enabled', 'DEFAULT_BUCKETS']
+
+logger = logging.getLogger('utilslib')
+logger.addHandler(logging.NullHandler())
+payload_logger = logging.getLogger('utilslib.payload')
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_enabled = True
+_log_payloads = False
+_lock = threading.Lock()
+_local = threading.local()
+_counters = {}
+_histograms = {}
+_callbacks = []
+
+
+def set_instrumentation_enabled(enabled):
+    """ turn spans and metrics on or off, off makes span() a no-op """
+    global _enabled
+    _enabled = enabled
+
+
+def set_payload_logging(enabled):
+    """ log request/response payloads at DEBUG level on the utilslib.payload logger """
+    global _log_payloads
+    _log_payloads = enabled
+
+
+def log_payload(msg, *args):
+    if _log_payloads and payload_logger.isEnabledFor(logging.DEBUG):
+        payload_logger.debug(msg, *args)
+
+
+class _Histogram(object):
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def inc_counter(name, value=1, **labels):
+    if not _enabled:
+        return
+    key = (name, _labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """ add value to the histogram name """
+    if not _enabled:
+        return
+    _observe(name, _labels_key(labels), value)
+
+
+def _observe(name, labels_key, value):
+    key = (name, labels_key)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram(DEFAULT_BUCKETS)
+        histogram.observe(value)
+
+
+class Span(object):
+    """ timing of one call, use it as a context manager """
+    __slots__ = ('name', 'labels', 'phases', 'start', 'duration', 'error')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.phases = {}
+        self.start = None
+        self.duration = None
+        self.error = None
+
+    def label(self, **labels):
+        self.labels.update(labels)
+
+    def phase(self, name, seconds):
+        """ add seconds to a phase of the span, e.g. connect or ttfb """
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def __enter__(self):
+        spans = getattr(_local, 'spans', None)
+        if spans is None:
+            spans = _local.spans = []
+        spans.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        self.error = exc
+        _local.spans.pop()
+        labels_key = _labels_key(self.labels)
+        _observe(self.name + '_seconds', labels_key + (('outcome', 'ok' if exc is None else 'error'),),
+                 self.duration)
+        for phase, seconds in self.phases.items():
+            _observe('{}_{}_seconds'.format(self.name, phase), labels_key, seconds)
+        for callback in _callbacks:
+            try:
+                callback(self)
+            except Exception:
+                logger.exception('metrics callback %r failed', callback)
+        return False
+
+
+class _NullSpan(object):
+    __slots__ = ()
+
+    def label(self, **labels):
+        pass
+
+    def phase(self, name, seconds):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, **labels):
+    """ context manager timing the block, see the module doc """
+    if not _enabled:
+        return _NULL_SPAN
+    return Span(name, labels)
+
+
+def timed(name, **labels):
+    """ decorator running every call of the function in span(name, **labels) """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_phase(name, seconds):
+    """ add seconds to a phase of the innermost span running in this thread, if any """
+    spans = getattr(_local, 'spans', None)
+    if spans:
+        spans[-1].phase(name, seconds)
+
+
+def add_metrics_callback(callback):
+    """ callback(span) is called with every finished span """
+    _callbacks.append(callback)
+
+
+def remove_metrics_callback(callback):
+    _callbacks.remove(callback)
+
+
+def metrics_snapshot():
+    """ {'counters': {name: {labels: value}}, 'histograms': {name: {labels: {...}}}}, labels being a tuple of
+        (label, value) pairs
+        """
+    with _lock:
+        counters = {}
+        for (name, labels), value in _counters.items():
+            counters.setdefault(name, {})[labels] = value
+        histograms = {}
+        for (name, labels), histogram in _histograms.items():
+            histograms.setdefault(name, {})[labels] = {
+                'buckets': dict(zip(histogram.buckets + (float('inf'),), _cumulative(histogram.counts))),
+                'sum': histogram.sum,
+                'count': histogram.count,
+            }
+    return {'counters': counters, 'histograms': histograms}
+
+
+def prometheus_text(namespace='utilslib'):
+    """ every metric in the Prometheus text exposition format """
+    snapshot = metrics_snapshot()
+    prefix = namespace + '_' if namespace else ''
+    lines = []
+    for name, series in sorted(snapshot['counters'].items()):
+        lines.append('# TYPE {}{} counter'.format(prefix, name))
+        for labels, value in sorted(series.items()):
+            lines.append('{}{}{} {}'.format(prefix, name, _format_labels(labels), _format_value(value)))
+    for name, series in sorted(snapshot['histograms'].items()):
+        lines.append('# TYPE {}{} histogram'.format(prefix, name))
+        for labels, histogram in sorted(series.items()):
+            for bound, count in histogram['buckets'].items():
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                lines.append('{}{}_bucket{} {}'.format(prefix, name, _format_labels(labels + (('le', le),)), count))
+            lines.append('{}{}_sum{} {}'.format(prefix, name, _format_labels(labels),
+                                                _format_value(histogram['sum'])))
+            lines.append('{}{}_count{} {}'.format(prefix, name, _format_labels(labels), histogram['count']))
+    return '\n'.join(lines) + '\n'
+
+
+def reset_metrics():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def _cumulative(counts):
+    total = 0
+    result = []
+    for count in counts:
+        total += count
+        result.append(total)
+    return result
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                          for name, value in labels) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _reset_lock_after_fork():
+    global _lock
+    _lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_lock_after_fork)
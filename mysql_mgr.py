@@ -1,7 +1,15 @@
 """Handle the MySql Database Connection"""
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
 import pymysql
 
-__all__ = ['MysqlDatabaseHandler', 'fetch_single_row', 'fetch_rows']
+__all__ = ['MysqlDatabaseHandler', 'MysqlConnectionPool', 'PooledMysqlDatabaseHandler', 'get_mysql_pool',
+           'close_mysql_pools', 'fetch_single_row', 'fetch_rows', 'iter_rows', 'iter_row_batches',
+           'transaction', 'execute_many', 'insert_rows', 'upsert_rows']
 
 
 def connect(user, password, host, database):
@@ -35,6 +43,245 @@ class MysqlDatabaseHandler(object):
         close(self.conn)
 
 
+class MysqlConnectionPool(object):
+    """ thread safe pool of pymysql connections.
+        params:
+        1. min_size: connections opened by the first acquire and kept open even when idle
+        2. max_size: max connections open at the same time, acquire waits when all are in use
+        3. idle_timeout: seconds after which an idle connection above min_size is closed (on acquire and
+           release)
+        4. max_lifetime: seconds after which a connection is replaced, None keeps it forever
+        5. ping_on_checkout: check the connection with a ping before handing it out
+        """
+
+    def __init__(self, user, password, host, database, min_size=1, max_size=10, idle_timeout=300,
+                 max_lifetime=3600, ping_on_checkout=True):
+        self.user = user
+        self.password = password
+        self.host = host
+        self.database = database
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.ping_on_checkout = ping_on_checkout
+
+        self._idle = []  # (conn, created_at, released_at), last released at the end
+        self._created_at = {}
+        self._size = 0
+        self._filled = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._metrics = {'checkouts': 0, 'waits': 0, 'wait_time': 0.0, 'timeouts': 0, 'created': 0,
+                         'recycled': 0}
+
+    def acquire(self, timeout=None):
+        """ check out a connection, waits up to timeout seconds (None: forever) when the pool is exhausted """
+        if not self._filled:
+            self._fill()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waited_since = None
+        with self._cond:
+            self._reap_idle()
+            while True:
+                if self._closed:
+                    raise pymysql.err.InterfaceError('connection pool is closed')
+                if self._idle:
+                    conn, created_at, released_at = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn = None
+                    break
+                if waited_since is None:
+                    waited_since = time.monotonic()
+                    self._metrics['waits'] += 1
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._metrics['timeouts'] += 1
+                    self._metrics['wait_time'] += time.monotonic() - waited_since
+                    raise pymysql.err.OperationalError('timed out waiting for a connection from the pool')
+                self._cond.wait(remaining)
+            if waited_since is not None:
+                self._metrics['wait_time'] += time.monotonic() - waited_since
+            self._metrics['checkouts'] += 1
+
+        try:
+            if conn is not None and not self._usable(conn, created_at, released_at):
+                self._discard(conn, recycled=True, reserve=True)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def release(self, conn, discard=False):
+        """ give a connection back. open transactions are rolled back, like closing the connection did.
+            discard=True closes it instead, e.g. after a connection error.
+            """
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+        with self._cond:
+            if discard or self._closed or not conn.open:
+                self._size -= 1
+                self._created_at.pop(id(conn), None)
+                close(conn)
+            else:
+                self._idle.append((conn, self._created_at.get(id(conn), time.monotonic()), time.monotonic()))
+                self._reap_idle()
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            close(conn)
+
+    def metrics(self):
+        with self._cond:
+            return {**self._metrics, 'size': self._size, 'idle': len(self._idle),
+                    'in_use': self._size - len(self._idle), 'max_size': self.max_size}
+
+    def _fill(self):
+        """ open the min_size connections, they are kept idle until checked out """
+        with self._cond:
+            if self._filled or self._closed:
+                return
+            self._filled = True
+            count = max(0, min(self.min_size, self.max_size) - self._size)
+            self._size += count
+        opened = 0
+        try:
+            for _ in range(count):
+                conn = self._connect()
+                opened += 1
+                with self._cond:
+                    if self._closed:
+                        self._size -= 1
+                        close(conn)
+                        continue
+                    self._idle.append((conn, self._created_at[id(conn)], time.monotonic()))
+                    self._cond.notify()
+        except Exception:
+            with self._cond:
+                # the next acquire tries again
+                self._filled = False
+                self._size -= count - opened
+            raise
+
+    def _connect(self):
+        conn = connect(self.user, self.password, self.host, self.database)
+        with self._cond:
+            self._created_at[id(conn)] = time.monotonic()
+            self._metrics['created'] += 1
+        return conn
+
+    def _usable(self, conn, created_at, released_at):
+        now = time.monotonic()
+        if not conn.open:
+            return False
+        if self.max_lifetime is not None and now - created_at > self.max_lifetime:
+            return False
+        if self.ping_on_checkout:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    def _discard(self, conn, recycled=False, reserve=False):
+        """ close conn, with reserve=True its slot is kept for the replacement connection """
+        with self._cond:
+            self._created_at.pop(id(conn), None)
+            if recycled:
+                self._metrics['recycled'] += 1
+            if not reserve:
+                self._size -= 1
+                self._cond.notify()
+        close(conn)
+
+    def _reap_idle(self):
+        # called with the lock held, oldest released connections are at the start of the list
+        if self.idle_timeout is None:
+            return
+        now = time.monotonic()
+        while self._idle and self._size > self.min_size and now - self._idle[0][2] > self.idle_timeout:
+            conn, _, _ = self._idle.pop(0)
+            self._size -= 1
+            self._created_at.pop(id(conn), None)
+            self._metrics['recycled'] += 1
+            close(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_mysql_pool(user, password, host, database, **pool_options):
+    """ return the process wide pool for these credentials, pool_options are used when it is created """
+    key = (user, password, host, database)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = MysqlConnectionPool(user, password, host, database, **pool_options)
+    return pool
+
+
+def close_mysql_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def _reset_pools_after_fork():
+    # the connections belong to the parent process, the child starts with new pools
+    global _pools_lock
+    _pools_lock = threading.Lock()
+    _pools.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
+
+class PooledMysqlDatabaseHandler(object):
+    """ drop-in replacement of MysqlDatabaseHandler which checks a connection out of the shared pool
+        instead of opening a new one.
+
+        with PooledMysqlDatabaseHandler(user, password, host, database) as conn:
+            row = fetch_single_row(conn, sql, params)
+        """
+
+    def __init__(self, user, password, host, database, timeout=None, **pool_options):
+        self.conn = None
+        self.timeout = timeout
+        self.pool = get_mysql_pool(user, password, host, database, **pool_options)
+
+    def __enter__(self):
+        self.conn = self.pool.acquire(self.timeout)
+        return self.conn
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        conn, self.conn = self.conn, None
+        broken = exc_type is not None and issubclass(exc_type, (pymysql.err.OperationalError,
+                                                                 pymysql.err.InterfaceError))
+        self.pool.release(conn, discard=broken)
+
+
 def fetch_single_row(conn, sql_stmt, params):
     with conn.cursor() as cursor:
         cursor.execute(sql_stmt, params)
@@ -48,3 +295,161 @@ def fetch_rows(conn, sql_stmt, params=None):
         else:
             cursor.execute(sql_stmt)
         return cursor.fetchall()
+
+
+def iter_rows(conn, sql_stmt, params=None, as_tuples=False):
+    """ generator over the result of sql_stmt read with a server side cursor, so only one row at a time
+        is held in memory.
+        as_tuples=True yields (columns, row) with row a tuple and columns the same tuple of column names for
+        every row, instead of one dict per row.
+        the connection can't run other queries until the generator is exhausted or closed.
+        """
+    for columns, rows in _iter_batches(conn, sql_stmt, params, 100, as_tuples):
+        for row in rows:
+            yield (columns, row) if as_tuples else row
+
+
+def iter_row_batches(conn, sql_stmt, params=None, size=1000, as_tuples=False):
+    """ same as iter_rows but yields lists of up to size rows, or (columns, rows) when as_tuples=True """
+    for columns, rows in _iter_batches(conn, sql_stmt, params, size, as_tuples):
+        yield (columns, rows) if as_tuples else rows
+
+
+def _iter_batches(conn, sql_stmt, params, size, as_tuples):
+    cursor_class = pymysql.cursors.SSCursor if as_tuples else pymysql.cursors.SSDictCursor
+    with conn.cursor(cursor_class) as cursor:
+        if params:
+            cursor.execute(sql_stmt, params)
+        else:
+            cursor.execute(sql_stmt)
+        columns = tuple(column[0] for column in cursor.description or ())
+        while True:
+            rows = cursor.fetchmany(size)
+            if not rows:
+                break
+            yield columns, rows
+
+
+@contextmanager
+def transaction(conn):
+    """ run the block as one transaction: commit when it ends, rollback when it raises.
+        helpers called inside with commit=False become part of it.
+        """
+    conn.begin()
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def execute_many(conn, sql_stmt, seq_of_params, batch_size=1000, commit=True):
+    """ execute sql_stmt for every params of seq_of_params, batch_size params per round-trip.
+        for "INSERT ... VALUES (...)" pymysql sends each batch as one multi-row insert.
+        returns the number of affected rows.
+        """
+    affected = 0
+    with conn.cursor() as cursor:
+        for batch in _chunks(seq_of_params, batch_size):
+            affected += cursor.executemany(sql_stmt, batch) or 0
+    if commit:
+        conn.commit()
+    return affected
+
+
+def insert_rows(conn, table, rows, columns=None, batch_size=1000, max_packet_size=None, commit=True):
+    """ multi-row INSERT of rows, see upsert_rows for the arguments """
+    return _write_rows(conn, table, rows, columns, None, batch_size, max_packet_size, commit)
+
+
+def upsert_rows(conn, table, rows, columns=None, update_columns=None, batch_size=1000, max_packet_size=None,
+                commit=True):
+    """ INSERT ... ON DUPLICATE KEY UPDATE of many rows in as few statements as possible.
+        params:
+        1. rows: dicts, or sequences in the order of columns
+        2. columns: column names, taken from the first dict when not given
+        3. update_columns: columns updated when the key exists, default all columns
+        4. batch_size: max rows per statement
+        5. max_packet_size: max statement size in bytes, default the server max_allowed_packet
+        6. commit: commit once after the last statement
+        returns the number of affected rows as reported by MySQL.
+        """
+    return _write_rows(conn, table, rows, columns, update_columns, batch_size, max_packet_size, commit,
+                       upsert=True)
+
+
+def _write_rows(conn, table, rows, columns, update_columns, batch_size, max_packet_size, commit,
+                upsert=False):
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return 0
+    if columns is None:
+        columns = list(first.keys())
+
+    head = 'INSERT INTO {} ({}) VALUES '.format(quote_identifier(table), ', '.join(map(quote_identifier, columns)))
+    tail = ''
+    if upsert:
+        update_columns = columns if update_columns is None else update_columns
+        tail = ' ON DUPLICATE KEY UPDATE ' + ', '.join(
+            '{0} = VALUES({0})'.format(quote_identifier(column)) for column in update_columns)
+
+    if max_packet_size is None:
+        max_packet_size = _max_allowed_packet(conn)
+    encoding = conn.encoding or 'utf8'
+    budget = max_packet_size - len((head + tail).encode(encoding)) - 1024
+
+    affected = 0
+    with conn.cursor() as cursor:
+        values = []
+        size = 0
+        for row in _prepend(first, rows):
+            if isinstance(row, dict):
+                row = [row.get(column) for column in columns]
+            literal = conn.escape(tuple(row))
+            literal_size = len(literal.encode(encoding)) + 1
+            if values and (len(values) >= batch_size or size + literal_size > budget):
+                affected += cursor.execute(head + ','.join(values) + tail)
+                values, size = [], 0
+            values.append(literal)
+            size += literal_size
+        if values:
+            affected += cursor.execute(head + ','.join(values) + tail)
+    if commit:
+        conn.commit()
+    return affected
+
+
+def quote_identifier(name):
+    """ `name`, a qualified name is quoted part by part: 'db.table' gives `db`.`table` """
+    return '.'.join('`{}`'.format(part.replace('`', '``')) for part in str(name).split('.'))
+
+
+# connection -> its max_allowed_packet, the session value is set at connect time and kept by the connection
+_max_allowed_packets = weakref.WeakKeyDictionary()
+
+
+def _max_allowed_packet(conn):
+    packet = _max_allowed_packets.get(conn)
+    if packet is None:
+        with conn.cursor(pymysql.cursors.Cursor) as cursor:
+            cursor.execute('SELECT @@max_allowed_packet')
+            packet = _max_allowed_packets[conn] = int(cursor.fetchone()[0])
+    return packet
+
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+
+def _chunks(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,180 @@
+"""Compile condition_object filter trees into query templates.
+
+A condition_object is either a single filter {"field", "operator", "value"[, "value2"]} or a group
+{"condition": "AND"/"OR", "filters": [...]}. It is rendered in one pass over the config into the SQL and the
+list of its values. Nothing is cached but the validated field, operator and condition names: configs get
+their values replaced for every event, so a cache of whole configs would mostly miss, and rendering is
+cheaper than hashing the config.
+
+dialect 'vtiger' renders the values inline, escaped, for the vtiger query API.
+dialect 'mysql' keeps %s placeholders and the values as params for pymysql (fetch_rows, iter_rows), nested
+groups are put in parentheses there.
+"""
+import re
+
+__all__ = ['QueryTemplate', 'compile_condition', 'render_condition', 'mysql_condition', 'escape_query_value']
+
+_FIELD = re.compile(r'[A-Za-z_][A-Za-z0-9_.]*')
+_OPERATOR = re.compile(r'[A-Za-z<>=! ]+')
+_CONDITION = re.compile(r'[A-Za-z]+')
+_DIALECTS = ('vtiger', 'mysql')
+
+# validated and rendered names: configs repeat the same fields, operators and conditions
+_MAX_NAMES = 4096
+# field -> {operator: ('field OPERATOR ', is BETWEEN)}
+_prefixes = {}
+# condition -> ' CONDITION '
+_conditions = {}
+
+
+class QueryTemplate(object):
+    """ rendered condition: sql is the condition for vtiger, or the %s template for mysql, params its values """
+
+    def __init__(self, sql, params, dialect):
+        self.sql = sql
+        self.params = tuple(params)
+        self.dialect = dialect
+
+    @property
+    def fragments(self):
+        """ the sql between the values """
+        if self.dialect == 'mysql':
+            # fields, operators and conditions can't contain '%', only the placeholders do
+            return self.sql.split('%s')
+        # nor quotes: the next quote starts the next value
+        fragments = []
+        position = 0
+        for value in self.params:
+            start = self.sql.index("'", position)
+            fragments.append(self.sql[position:start])
+            position = start + len(escape_query_value(value))
+        fragments.append(self.sql[position:])
+        return fragments
+
+
+def escape_query_value(value):
+    """ quote a value as a string literal """
+    text = value if value.__class__ is str else str(value)
+    if '\\' in text or "'" in text:
+        text = text.replace('\\', '\\\\').replace("'", "\\'")
+    return "'" + text + "'"
+
+
+def compile_condition(condition_object, dialect='vtiger'):
+    """ render condition_object for dialect. the config is read on every call, so it can be changed freely """
+    if dialect not in _DIALECTS:
+        raise ValueError('unknown query dialect {!r}'.format(dialect))
+    pieces = []
+    params = []
+    _render(condition_object, pieces, params, dialect == 'mysql', False)
+    return QueryTemplate(''.join(pieces), params, dialect)
+
+
+def render_condition(condition_object):
+    """ condition rendered for the vtiger query API """
+    pieces = []
+    _render(condition_object, pieces, [], False, False)
+    return ''.join(pieces)
+
+
+def mysql_condition(condition_object):
+    """ (sql, params) of the condition for pymysql """
+    template = compile_condition(condition_object, 'mysql')
+    return template.sql, template.params
+
+
+def _render(condition_object, pieces, params, mysql, nested):
+    """ append the sql of condition_object to pieces and its values to params.
+        values are %s placeholders for mysql, else they are escaped inline.
+        """
+    if 'field' in condition_object:
+        _render_filter(condition_object, pieces, params, mysql)
+        return
+
+    filters = condition_object.get('filters') or []
+    if len(filters) < 2:
+        if filters:
+            _render(filters[0], pieces, params, mysql, True)
+        return
+    try:
+        condition = _conditions[condition_object.get('condition')]
+    except (KeyError, TypeError):
+        condition = _condition(condition_object.get('condition'))
+    parenthesize = nested and mysql
+    if parenthesize:
+        pieces.append('(')
+    append = pieces.append
+    first = len(pieces)
+    for sub_object in filters:
+        append(condition)
+        if 'field' not in sub_object:
+            _render(sub_object, pieces, params, mysql, True)
+            continue
+        # filters are rendered here rather than by a call: most of a config is filters
+        try:
+            prefix, between = _prefixes[sub_object['field']][sub_object['operator']]
+        except (KeyError, TypeError):
+            prefix, between = _prefix(sub_object.get('field'), sub_object.get('operator'))
+        value = sub_object.get('value')
+        params.append(value)
+        if mysql:
+            append(prefix + '%s')
+        elif value.__class__ is str and '\\' not in value and "'" not in value:
+            append(f"{prefix}'{value}'")
+        else:
+            append(prefix + escape_query_value(value))
+        if between:
+            append(' AND ')
+            _value(sub_object.get('value2'), pieces, params, mysql)
+    # no condition before the first filter
+    pieces[first] = ''
+    if parenthesize:
+        append(')')
+
+
+def _render_filter(condition_object, pieces, params, mysql):
+    get = condition_object.get
+    prefix, between = _prefix(get('field'), get('operator'))
+    pieces.append(prefix)
+    _value(get('value'), pieces, params, mysql)
+    if between:
+        pieces.append(' AND ')
+        _value(get('value2'), pieces, params, mysql)
+
+
+def _value(value, pieces, params, mysql):
+    params.append(value)
+    pieces.append('%s' if mysql else escape_query_value(value))
+
+
+def _prefix(field, operator):
+    """ ('field OPERATOR ', is BETWEEN) """
+    try:
+        return _prefixes[field][operator]
+    except (KeyError, TypeError):
+        pass
+    _checked(_FIELD, field, 'field')
+    text = _checked(_OPERATOR, operator, 'operator').strip()
+    operators = _prefixes.get(field)
+    if operators is None:
+        operators = _remember(_prefixes, field, {})
+    operators[operator] = prefix = (field + ' ' + text + ' ', text.upper() == 'BETWEEN')
+    return prefix
+
+
+def _condition(text):
+    """ ' CONDITION ' """
+    return _remember(_conditions, text, ' {} '.format(_checked(_CONDITION, text, 'condition')))
+
+
+def _checked(pattern, text, what):
+    if not isinstance(text, str) or not pattern.fullmatch(text):
+        raise ValueError('invalid {} in condition_object: {!r}'.format(what, text))
+    return text
+
+
+def _remember(known, key, value):
+    if len(known) >= _MAX_NAMES:
+        known.clear()
+    known[key] = value
+    return value
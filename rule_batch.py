@@ -0,0 +1,313 @@
+"""Evaluate one JSON-Logic rule over many records.
+
+records is either a list of dicts (one per record) or a columnar batch: a dict mapping a var path such as
+'data.createdtime' to the list of values of that path, one per record.
+
+Without numpy the rule is compiled once (see rule_compiler) and run on every record. With use_numpy=True
+the rule is evaluated column by column: vars are read once per column, numeric comparisons and the
+registered date operators run as numpy operations, and whatever can't be vectorized falls back to the
+exact per-record operation, so results always match jsonLogic.
+"""
+import re
+from datetime import timedelta
+from itertools import repeat
+
+from json_logic.builtins import BUILTINS, to_bool, op_var
+from date_utils import parse_datetime, utc_now, frozen_utc_now
+from rule_compiler import compile_rule, _is_const
+from instrumentation import inc_counter, span
+
+__all__ = ['evaluate_rule_batch', 'register_vector_op', 'DATE_VECTOR_OPS']
+
+# operation function -> vectorized implementation impl(np, args, batch)
+_vector_ops = {}
+
+_COMPARISONS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '>': lambda a, b: a > b,
+    '<=': lambda a, b: a <= b,
+    '>=': lambda a, b: a >= b,
+}
+_DATA_OPS = ('var', 'missing', 'missing_some')
+_BUILTIN_FUNCS = set(BUILTINS.values())
+# larger ints lose precision as float64
+_MAX_EXACT_INT = 2 ** 53
+_DATETIME_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}')
+
+
+class _Fallback(Exception):
+    """ raised by a vector implementation that can't handle its arguments """
+
+
+class _Scalar(object):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+def register_vector_op(func, vector_func):
+    """ register vector_func(np, args, batch) as the column implementation of the operation func.
+        args are _Scalar values or columns (list or numpy array), vector_func returns a column or raises
+        _Fallback to let the operation run record by record.
+        """
+    _vector_ops[func] = vector_func
+
+
+def evaluate_rule_batch(rule, records, operations=BUILTINS, use_numpy=False):
+    """ evaluate rule on every record and return the truthiness of each result.
+        returns a list of bool, or a numpy bool array when use_numpy is True.
+        """
+    batch = _Batch.from_records(records)
+    with span('rule_evaluation', mode='numpy' if use_numpy else 'batch'):
+        inc_counter('rule_evaluation_records_total', len(batch), mode='numpy' if use_numpy else 'batch')
+        return _evaluate_batch(rule, batch, operations, use_numpy)
+
+
+def _evaluate_batch(rule, batch, operations, use_numpy):
+    if not use_numpy:
+        func = compile_rule(rule, operations)
+        with frozen_utc_now():
+            return [to_bool(func(row)) for row in batch.rows]
+
+    import numpy as np
+
+    evaluate = _compile_vector(rule, operations, np)
+    with frozen_utc_now():
+        values = evaluate(batch)
+    if isinstance(values, _Scalar):
+        return np.full(len(batch), to_bool(values.value), dtype=bool)
+    if isinstance(values, np.ndarray) and values.dtype == bool:
+        return values
+    return np.fromiter((to_bool(value) for value in values), dtype=bool, count=len(batch))
+
+
+class _Batch(object):
+    def __init__(self, size, rows=None, columns=None):
+        self.size = size
+        self._rows = rows
+        self._columns = columns if columns is not None else {}
+
+    @classmethod
+    def from_records(cls, records):
+        if isinstance(records, dict):
+            columns = {path: list(values) for path, values in records.items()}
+            sizes = {len(values) for values in columns.values()}
+            if len(sizes) > 1:
+                raise ValueError('all columns of a batch must have the same length')
+            return cls(sizes.pop() if sizes else 0, columns=columns)
+        records = list(records)
+        return cls(len(records), rows=records)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = [{} for _ in range(self.size)]
+            for path, values in self._columns.items():
+                props = path.split('.')
+                for row, value in zip(self._rows, values):
+                    for prop in props[:-1]:
+                        row = row.setdefault(prop, {})
+                    row[props[-1]] = value
+        return self._rows
+
+    def column(self, path):
+        values = self._columns.get(path)
+        if values is None:
+            values = self._columns[path] = [op_var(row, path) for row in self.rows]
+        return values
+
+    def take(self, indices):
+        rows = [self._rows[i] for i in indices] if self._rows is not None else None
+        columns = {path: [values[i] for i in indices] for path, values in self._columns.items()}
+        return _Batch(len(indices), rows=rows, columns=columns)
+
+
+def _as_list(values, size):
+    if isinstance(values, _Scalar):
+        return [values.value] * size
+    if isinstance(values, list):
+        return values
+    # numpy array
+    return values.tolist()
+
+
+def _compile_vector(logic, operations, np):
+    if _is_const(logic):
+        value = _Scalar(logic)
+        return lambda batch: value
+
+    func = compile_rule(logic, operations)
+    per_record = lambda batch: [func(row) for row in batch.rows]
+    if isinstance(logic, list):
+        return per_record
+
+    op = next(iter(logic))
+    args = logic[op]
+    if not isinstance(args, list):
+        args = [args]
+
+    if op == 'and' or op == 'or':
+        return _vector_and_or(op, [_compile_vector(arg, operations, np) for arg in args])
+    if op not in operations:
+        # control flow, iteration and dotted operations run record by record
+        return per_record
+    if op == 'var':
+        return _vector_var(args, per_record)
+
+    arg_funcs = [_compile_vector(arg, operations, np) for arg in args]
+    operation = operations[op]
+    vector_func = _vector_ops.get(operation)
+    if vector_func is None and op in _COMPARISONS and operation is BUILTINS[op]:
+        vector_func = _numeric_comparison(_COMPARISONS[op])
+    needs_data = op in _DATA_OPS or operation not in _BUILTIN_FUNCS
+
+    def evaluate(batch):
+        values = [arg_func(batch) for arg_func in arg_funcs]
+        if vector_func is not None:
+            try:
+                return vector_func(np, values, batch)
+            except _Fallback:
+                pass
+        data = batch.rows if needs_data else repeat(None, len(batch))
+        columns = [repeat(value.value, len(batch)) if isinstance(value, _Scalar) else _as_list(value, len(batch))
+                   for value in values]
+        return [operation(row, *row_args) for row, *row_args in zip(data, *columns)]
+    return evaluate
+
+
+def _vector_var(args, per_record):
+    if not args or not _is_const(args) or not isinstance(args[0], str) or not args[0] or len(args) > 2:
+        return per_record
+    path = args[0]
+    default = args[1] if len(args) > 1 else None
+
+    def evaluate(batch):
+        values = batch.column(path)
+        if default is not None:
+            return [default if value is None else value for value in values]
+        return values
+    return evaluate
+
+
+def _vector_and_or(op, arg_funcs):
+    stop_on_truthy = op == 'or'
+
+    def evaluate(batch):
+        size = len(batch)
+        result = [None] * size
+        pending = list(range(size))
+        sub_batch = batch
+        for arg_func in arg_funcs:
+            values = _as_list(arg_func(sub_batch), len(sub_batch))
+            still_pending = []
+            for index, value in zip(pending, values):
+                result[index] = value
+                if to_bool(value) != stop_on_truthy:
+                    still_pending.append(index)
+            if not still_pending:
+                break
+            if len(still_pending) != len(pending):
+                sub_batch = batch.take(still_pending)
+            pending = still_pending
+        return result
+    return evaluate
+
+
+def _numeric_column(np, value):
+    if isinstance(value, _Scalar):
+        if type(value.value) is float or (type(value.value) is int and abs(value.value) <= _MAX_EXACT_INT):
+            return value.value
+        raise _Fallback
+    if isinstance(value, list):
+        # a column of one type only: numpy compares ints mixed with floats as float64
+        types = set(map(type, value))
+        if types == {float}:
+            return np.asarray(value, dtype=np.float64)
+        if types == {int} and -_MAX_EXACT_INT <= min(value) and max(value) <= _MAX_EXACT_INT:
+            return np.asarray(value, dtype=np.int64)
+        raise _Fallback
+    if value.dtype.kind in 'iuf':
+        return value
+    raise _Fallback
+
+
+def _numeric_comparison(compare):
+    def vector_func(np, args, batch):
+        # only the plain two argument form where both sides are numbers, anything else needs js coercion
+        if len(args) != 2 or all(isinstance(arg, _Scalar) for arg in args):
+            raise _Fallback
+        a = _numeric_column(np, args[0])
+        b = _numeric_column(np, args[1])
+        return np.asarray(compare(a, b), dtype=bool)
+    return vector_func
+
+
+def _datetime_column(np, value):
+    """ parse a DT_FMT_YMDHMS column, anything else goes through str_to_datetime record by record """
+    if isinstance(value, _Scalar):
+        try:
+            return np.datetime64(parse_datetime(value.value))
+        except (TypeError, ValueError):
+            raise _Fallback
+    values = _as_list(value, 0)
+    try:
+        if not all(map(_DATETIME_PATTERN.fullmatch, values)):
+            raise _Fallback
+        return np.array(values, dtype='datetime64[s]')
+    except (TypeError, ValueError):
+        raise _Fallback
+
+
+def _vector_date_op(arity, compare):
+    def vector_func(np, args, batch):
+        if len(args) != arity or all(isinstance(arg, _Scalar) for arg in args):
+            raise _Fallback
+        return np.asarray(compare(np, *[_datetime_column(np, arg) for arg in args]), dtype=bool)
+    return vector_func
+
+
+def _vector_date_day(days):
+    def compare(np, a):
+        day = np.datetime64(utc_now().date() + timedelta(days=days))
+        return a.astype('datetime64[D]') == day
+    return _vector_date_op(1, compare)
+
+
+def _vector_date_within(next_period):
+    def vector_func(np, args, batch):
+        if len(args) != 3 or isinstance(args[0], _Scalar) or not isinstance(args[1], _Scalar) \
+                or not isinstance(args[2], _Scalar):
+            raise _Fallback
+        period = args[2].value
+        if period not in ('days', 'weeks'):
+            # the scalar operation returns None for any other period
+            return _Scalar(None)
+        try:
+            delta = timedelta(**{period: int(args[1].value)})
+        except (TypeError, ValueError):
+            raise _Fallback
+        a = _datetime_column(np, args[0])
+        now = np.datetime64(utc_now())
+        if next_period:
+            return (now <= a) & (a <= now + np.timedelta64(delta))
+        return (now - np.timedelta64(delta) <= a) & (a <= now)
+    return vector_func
+
+
+# vector implementations of the date operators of utilslib.ops, by operator name
+DATE_VECTOR_OPS = {
+    'date_between': _vector_date_op(3, lambda np, a, b, c: (b <= a) & (a <= c)),
+    'date_after': _vector_date_op(2, lambda np, a, b: a > b),
+    'date_before': _vector_date_op(2, lambda np, a, b: a < b),
+    'date_yesterday': _vector_date_day(-1),
+    'date_today': _vector_date_day(0),
+    'date_tomorrow': _vector_date_day(1),
+    'date_within_next': _vector_date_within(True),
+    'date_within_last': _vector_date_within(False),
+}
@@ -0,0 +1,285 @@
+"""Compile JSON-Logic rules into python callables.
+
+A compiled rule gives the same results as json_logic.jsonLogic(rule, data, operations) but the rule tree is
+walked only once; evaluating it is a chain of closures. Compiled rules are kept in a bounded LRU cache keyed
+by a snapshot of the rule (its marshal dump, a canonical hash for rules marshal can't dump), so configs
+evaluated many times are compiled once and a rule changed in place is compiled again. A rule is compiled from
+a copy of it, and list and dict results are new objects, so neither the caller's rule nor its results share
+objects with the cache.
+
+Operations are looked up in the operations table when the rule is evaluated, as json_logic does: operations
+added or replaced after a rule was compiled are used by it.
+"""
+import copy
+import hashlib
+import json
+import marshal
+import threading
+from collections import OrderedDict
+
+from json_logic.builtins import BUILTINS, to_bool, not_
+from instrumentation import span
+
+__all__ = ['compile_rule', 'evaluate_rule', 'rule_hash', 'clear_rule_cache', 'set_rule_cache_size']
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_size = 1024
+_encoder = json.JSONEncoder(sort_keys=True, separators=(',', ':'), default=repr, check_circular=False)
+
+
+def rule_hash(rule):
+    """ canonical hash of a rule: the same rule written with a different key order gives the same hash """
+    canonical = _encoder.encode(rule)
+    return hashlib.sha1(canonical.encode()).hexdigest()
+
+
+def _rule_key(rule):
+    # marshal version 2 has no back references: equal rules give equal bytes and the bytes give back the rule
+    try:
+        return marshal.dumps(rule, 2)
+    except ValueError:
+        # types marshal can't dump (dict subclasses, dates...)
+        return rule_hash(rule)
+
+
+def compile_rule(rule, operations=BUILTINS):
+    """ return a callable f(data) giving jsonLogic(rule, data, operations).
+        the cache is kept per operations table.
+        """
+    key = (_rule_key(rule), id(operations))
+    with _cache_lock:
+        compiled = _cache.get(key)
+        if compiled is not None:
+            _cache.move_to_end(key)
+            return compiled[0]
+
+    # compiled from a private copy: the caller can change its rule afterwards without changing the entry
+    snapshot = marshal.loads(key[0]) if isinstance(key[0], bytes) else copy.deepcopy(rule)
+    with span('rule_compile'):
+        func = _compile(snapshot, operations)
+
+    with _cache_lock:
+        # keep a reference on operations so its id can't be reused while the entry lives
+        _cache[key] = (func, operations)
+        while len(_cache) > _cache_size:
+            _cache.popitem(last=False)
+    return func
+
+
+def evaluate_rule(rule, data=None, operations=BUILTINS):
+    return compile_rule(rule, operations)(data)
+
+
+def clear_rule_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def set_rule_cache_size(size):
+    global _cache_size
+    with _cache_lock:
+        _cache_size = size
+        while len(_cache) > _cache_size:
+            _cache.popitem(last=False)
+
+
+def _is_const(logic):
+    if isinstance(logic, list):
+        return all(_is_const(item) for item in logic)
+    return not isinstance(logic, dict) or len(logic) != 1
+
+
+def _const(value):
+    # a list or dict result is a new object on every evaluation, as with jsonLogic: value belongs to the cache
+    if isinstance(value, list) and not any(isinstance(item, (list, dict)) for item in value):
+        func = lambda data: value[:]
+    elif isinstance(value, (list, dict)):
+        func = lambda data: copy.deepcopy(value)
+    else:
+        func = lambda data: value
+    func.const = True
+    func.value = value
+    return func
+
+
+def _compile(logic, operations):
+    if _is_const(logic):
+        return _const(logic)
+
+    if isinstance(logic, list):
+        items = [_compile(item, operations) for item in logic]
+        return lambda data: [item(data) for item in items]
+
+    op = next(iter(logic))
+    args = logic[op]
+    if not isinstance(args, list):
+        args = [args]
+
+    if op == 'if' or op == '?:':
+        return _compile_if([_compile(arg, operations) for arg in args])
+    if op == 'and':
+        return _compile_and([_compile(arg, operations) for arg in args])
+    if op == 'or':
+        return _compile_or([_compile(arg, operations) for arg in args])
+    if op in ('filter', 'map', 'all', 'some', 'none', 'reduce'):
+        return _compile_iteration(op, args, [_compile(arg, operations) for arg in args])
+
+    return _compile_call(op, [_compile(arg, operations) for arg in args], operations)
+
+
+def _compile_if(args):
+    argc = len(args)
+
+    def evaluate(data):
+        last_index = argc - 1
+        index = 0
+        while index < last_index:
+            if to_bool(args[index](data)):
+                index += 1
+                if index >= argc:
+                    return None
+                return args[index](data)
+            index += 2
+
+        if index >= argc:
+            return None
+        return args[index](data)
+    return evaluate
+
+
+def _compile_and(args):
+    def evaluate(data):
+        current = None
+        for arg in args:
+            current = arg(data)
+            if not_(current):
+                return current
+        return current
+    return evaluate
+
+
+def _compile_or(args):
+    def evaluate(data):
+        current = None
+        for arg in args:
+            current = arg(data)
+            if to_bool(current):
+                return current
+        return current
+    return evaluate
+
+
+def _compile_iteration(op, raw_args, args):
+    argc = len(args)
+    items_of = args[0] if argc > 0 else None
+    sublogic = args[1] if argc > 1 else _const(None)
+
+    if op == 'filter':
+        if argc < 2:
+            return lambda data: []
+
+        def evaluate(data):
+            items = items_of(data)
+            if not isinstance(items, list):
+                return []
+            return [item for item in items if to_bool(sublogic(item))]
+    elif op == 'map':
+        if argc < 1:
+            return lambda data: []
+
+        def evaluate(data):
+            items = items_of(data)
+            if not isinstance(items, list):
+                return []
+            return [sublogic(item) for item in items]
+    elif op == 'reduce':
+        if argc < 1:
+            return lambda data: None
+        # the initial value is not evaluated, same as json_logic
+        init = raw_args[2] if argc > 2 else None
+
+        def evaluate(data):
+            items = items_of(data)
+            if not isinstance(items, list):
+                return init
+            context = {'accumulator': init}
+            for item in items:
+                context['current'] = item
+                context['accumulator'] = sublogic(context)
+            return context['accumulator']
+    elif op == 'all':
+        if argc < 2:
+            return lambda data: False
+
+        def evaluate(data):
+            items = items_of(data)
+            if not isinstance(items, list) or not items:
+                return False
+            return all(to_bool(sublogic(item)) for item in items)
+    elif op == 'some':
+        if argc < 2:
+            return lambda data: False
+
+        def evaluate(data):
+            items = items_of(data)
+            if not isinstance(items, list):
+                return False
+            return any(to_bool(sublogic(item)) for item in items)
+    else:
+        if argc < 2:
+            return lambda data: True
+
+        def evaluate(data):
+            items = items_of(data)
+            if not isinstance(items, list):
+                return True
+            return not any(to_bool(sublogic(item)) for item in items)
+    return evaluate
+
+
+def _resolve_operation(op, operations):
+    if op in operations:
+        return operations[op]
+    if '.' in op:
+        props = op.split('.')
+        ops = operations
+        for index, prop in enumerate(props):
+            if isinstance(ops, dict) and prop not in ops:
+                return _unknown_operation('.'.join(props[:index + 1]))
+            ops = ops[prop]
+        return ops
+    return _unknown_operation(op)
+
+
+def _unknown_operation(name):
+    # json_logic only fails when the operation is reached, so fail at evaluation and not at compile time
+    def raise_error(data, *args):
+        raise ReferenceError(f"Unrecognized operation: {name!r}")
+    return raise_error
+
+
+def _compile_call(op, args, operations):
+    # looked up on every call: the operations table can change after the rule was compiled
+    get = operations.get
+
+    if all(getattr(arg, 'const', False) for arg in args):
+        values = [arg.value for arg in args]
+        return lambda data: (get(op) or _resolve_operation(op, operations))(data, *values)
+
+    if len(args) == 1:
+        a = args[0]
+        return lambda data: (get(op) or _resolve_operation(op, operations))(data, a(data))
+
+    if len(args) == 2:
+        a, b = args
+        if getattr(b, 'const', False):
+            b_value = b.value
+            return lambda data: (get(op) or _resolve_operation(op, operations))(data, a(data), b_value)
+        return lambda data: (get(op) or _resolve_operation(op, operations))(data, a(data), b(data))
+
+    if len(args) == 3:
+        a, b, c = args
+        return lambda data: (get(op) or _resolve_operation(op, operations))(data, a(data), b(data), c(data))
+
+    return lambda data: (get(op) or _resolve_operation(op, operations))(data, *[arg(data) for arg in args])
@@ -0,0 +1,123 @@
+"""Evaluate a rule over many records on a pool of processes.
+
+JSON-Logic evaluation is pure python and holds the GIL, so large batches only scale across processes. The
+records are sent to the workers in chunks, the rule is sent once to every worker (pool initializer) and
+results come back in the order of the records, as soon as each chunk is done. Batches smaller than
+min_parallel records are evaluated in this process: starting workers and pickling would cost more.
+
+Functions and operation tables are sent to the workers by reference: operations can be given as
+'module:attribute' (e.g. 'utilslib:ops'), which works with every start method. A dict is only accepted
+with the fork start method, where the workers inherit it.
+"""
+import importlib
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+
+from json_logic.builtins import BUILTINS
+from date_utils import frozen_utc_now, utc_now
+from rule_compiler import compile_rule
+from instrumentation import inc_counter
+
+__all__ = ['map_rules', 'map_in_processes', 'resolve_reference']
+
+_BUILTINS_REFERENCE = 'json_logic.builtins:BUILTINS'
+_worker = {}
+
+
+def resolve_reference(reference):
+    """ the object named by 'module:attribute' """
+    module_name, _, attribute = reference.partition(':')
+    value = importlib.import_module(module_name)
+    for name in attribute.split('.') if attribute else ():
+        value = getattr(value, name)
+    return value
+
+
+def map_rules(rule, records, operations=BUILTINS, workers=None, chunk_size=None, min_parallel=2000,
+              mp_context=None):
+    """ yield evaluate_rule(rule, record, operations) for every record, in order.
+        see map_in_processes for the other arguments.
+        """
+    if operations is BUILTINS:
+        operations = _BUILTINS_REFERENCE
+    elif not isinstance(operations, str):
+        start_method = (mp_context or multiprocessing).get_start_method()
+        if start_method != 'fork':
+            raise ValueError("operations must be given as 'module:attribute' with the {} start method"
+                             .format(start_method))
+    return map_in_processes(_rule_evaluator, (rule, operations), records, workers, chunk_size, min_parallel,
+                            mp_context)
+
+
+def _rule_evaluator(rule, operations):
+    if isinstance(operations, str):
+        operations = resolve_reference(operations)
+    return compile_rule(rule, operations)
+
+
+def map_in_processes(prepare, args, items, workers=None, chunk_size=None, min_parallel=2000, mp_context=None):
+    """ yield call(item) for every item, in order, where call = prepare(*args).
+        prepare runs once per worker process; it must be a module level function so it can be pickled by
+        reference, args are pickled once per worker. utc_now() gives the same value for every item.
+        params:
+        1. workers: number of processes, default the number of CPUs
+        2. chunk_size: items sent per task, default about 4 tasks per worker (64 to 2048 items)
+        3. min_parallel: fewer items are run in this process
+        4. mp_context: multiprocessing context, default the platform default
+        """
+    workers = workers or os.cpu_count() or 1
+    items = iter(items)
+    head = list(islice(items, min_parallel))
+    if workers <= 1 or len(head) < min_parallel:
+        return _map_here(prepare, args, chain(head, items))
+    if chunk_size is None:
+        size_hint = len(head) + getattr(items, '__length_hint__', lambda: 0)()
+        chunk_size = min(2048, max(64, size_hint // (workers * 4)))
+    return _map_pool(prepare, args, chain(head, items), workers, chunk_size, mp_context)
+
+
+def _map_here(prepare, args, items):
+    call = prepare(*args)
+    now = utc_now()
+    for chunk in _chunks(items, 256):
+        with frozen_utc_now(now):
+            results = [call(item) for item in chunk]
+        inc_counter('rule_pool_items_total', len(results), mode='inline')
+        yield from results
+
+
+def _map_pool(prepare, args, items, workers, chunk_size, mp_context):
+    chunks = _chunks(items, chunk_size)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=_init_worker,
+                             initargs=(prepare, args, utc_now())) as executor:
+        # keep a bounded number of chunks in flight so a long input is not read ahead all at once
+        pending = deque(executor.submit(_run_chunk, chunk) for chunk in islice(chunks, workers * 2))
+        while pending:
+            results = pending.popleft().result()
+            chunk = next(chunks, None)
+            if chunk is not None:
+                pending.append(executor.submit(_run_chunk, chunk))
+            inc_counter('rule_pool_items_total', len(results), mode='processes')
+            yield from results
+
+
+def _chunks(items, size):
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _init_worker(prepare, args, now):
+    _worker['call'] = prepare(*args)
+    _worker['now'] = now
+
+
+def _run_chunk(chunk):
+    call = _worker['call']
+    with frozen_utc_now(_worker['now']):
+        return [call(item) for item in chunk]
@@ -0,0 +1,79 @@
+"""In memory cache for login sessions with single-flight creation"""
+import threading
+import time
+
+__all__ = ['SessionCache']
+
+
+class _Call(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SessionCache(object):
+    """ keeps one session per key until its ttl runs out.
+        when many threads ask for a missing key at the same time only the first one creates the
+        session, the others wait for it and share the result.
+        """
+
+    def __init__(self, default_ttl=300, max_ttl=86400):
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+        self._entries = {}
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        return None
+
+    def get_or_create(self, key, create):
+        """ return the cached value for key or call create() to make it.
+            create must return (value, ttl); ttl None means default_ttl. a None value is not cached.
+            """
+        with self._lock:
+            value = self.get(key)
+            if value is not None:
+                return value
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            value, ttl = create()
+            call.value = value
+            return value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if call.value is not None:
+                    ttl = self.default_ttl if ttl is None else min(ttl, self.max_ttl)
+                    self._entries[key] = (call.value, time.monotonic() + ttl)
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def invalidate(self, key, value=None):
+        """ drop the cached session. when value is given it is only dropped if it is still the cached one,
+            so a session that another thread already renewed is kept.
+            """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (value is None or entry[0] == value):
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
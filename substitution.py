@@ -0,0 +1,82 @@
+"""Single pass placeholder substitution for strings and json like structures"""
+import os
+import re
+from functools import lru_cache
+
+__all__ = ['replace_placeholders', 'replace_placeholders_in']
+
+
+_MAX_TEMPLATES = 4096
+
+
+class _Matcher(object):
+    """ one combined pattern for a set of placeholders, with the split of the texts it has already seen """
+
+    def __init__(self, keys):
+        # longest first, so a placeholder that is the prefix of another one can't cut it
+        self.pattern = re.compile('(' + '|'.join(re.escape(key) for key in sorted(keys, key=len, reverse=True)) + ')')
+        self.prefix = os.path.commonprefix(keys)
+        self.templates = {}
+
+    def parts(self, text):
+        """ text split into [literal, placeholder, literal, placeholder, ..., literal] """
+        parts = self.templates.get(text)
+        if parts is None:
+            if len(self.templates) >= _MAX_TEMPLATES:
+                self.templates.clear()
+            parts = self.templates[text] = self.pattern.split(text)
+        return parts
+
+
+@lru_cache(maxsize=1024)
+def _matcher(keys):
+    return _Matcher(keys)
+
+
+def _replacer(replacements):
+    values = {key: str(value) for key, value in replacements.items() if key != ''}
+    if not values:
+        return None
+    matcher = _matcher(tuple(sorted(values)))
+    prefix = matcher.prefix
+
+    def replace(text):
+        if prefix and prefix not in text:
+            return text
+        parts = matcher.parts(text)
+        if len(parts) == 1:
+            return text
+        parts = parts[:]
+        parts[1::2] = [values[key] for key in parts[1::2]]
+        return ''.join(parts)
+    return replace
+
+
+def replace_placeholders(text, replacements):
+    """ replace every key of replacements found in text by str(value), in one scan of text.
+        replaced values are not scanned again.
+        """
+    replace = _replacer(replacements)
+    if replace is None:
+        return text
+    return replace(text)
+
+
+def replace_placeholders_in(obj, replacements):
+    """ return a copy of a json like obj (dicts, lists, scalars) with placeholders replaced in every string,
+        dict keys included. numbers, booleans and None are kept as they are.
+        """
+    replace = _replacer(replacements)
+    if replace is None:
+        return obj
+    return _walk(obj, replace)
+
+
+def _walk(obj, replace):
+    if isinstance(obj, str):
+        return replace(obj)
+    if isinstance(obj, dict):
+        return {(replace(key) if isinstance(key, str) else key): _walk(value, replace) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_walk(item, replace) for item in obj]
+    return obj
@@ -0,0 +1,106 @@
+"""The asyncio entry points bound the requests in flight per host of each request."""
+import asyncio
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+import requests
+
+import async_utilslib
+import http_client
+from stubs import StubServer
+
+
+class _TrackingSession(requests.Session):
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.in_flight = Counter()
+        self.max_in_flight = Counter()
+
+    def request(self, method, url, **kwargs):
+        host = urlsplit(url).hostname
+        with self.lock:
+            self.in_flight[host] += 1
+            self.max_in_flight[host] = max(self.max_in_flight[host], self.in_flight[host])
+        try:
+            time.sleep(0.05)
+            return super().request(method, url, **kwargs)
+        finally:
+            with self.lock:
+                self.in_flight[host] -= 1
+
+
+def test_requests_are_limited_per_host_of_the_request():
+    async_utilslib.configure_async(per_host_limit=2)
+    session = _TrackingSession()
+    try:
+        with StubServer() as server:
+            port = urlsplit(server.url).port
+            urls = ['http://{}:{}/webservice.php'.format(host, port) for host in ('127.0.0.1', 'localhost')]
+
+            async def main():
+                await asyncio.gather(*[async_utilslib.ainvoke_http_request(url, 'GET', {}, session=session)
+                                       for url in urls * 5])
+            asyncio.run(main())
+    finally:
+        async_utilslib.configure_async(per_host_limit=10)
+        session.close()
+    assert session.max_in_flight == {'127.0.0.1': 2, 'localhost': 2}
+
+
+def test_requests_of_helper_threads_are_limited(monkeypatch):
+    # bulk set-value revises the records from a thread pool of its own
+    session = _TrackingSession()
+    monkeypatch.setattr(http_client, 'get_http_session', lambda endpoint, **kwargs: session)
+    async_utilslib.configure_async(per_host_limit=2)
+    try:
+        with StubServer(records=12) as server:
+            vtiger_access = {'user_access_key': 'key', 'vtiger_url': server.url, 'vtiger_username': 'user'}
+            set_value_configs = {
+                'update_matched_records': True,
+                'search_module_object': {'name': 'Leads', 'condition_object': {'condition': 'AND', 'filters': [
+                    {'field': 'leadsource', 'operator': '=', 'value': 'Web Site'}]}},
+                'set_value_fields': [{'name': 'description', 'type': 'static', 'value': 'bulk'}],
+            }
+            results = asyncio.run(async_utilslib.ainvoke_set_value_task({'data': {}}, set_value_configs,
+                                                                         vtiger_access))
+    finally:
+        async_utilslib.configure_async(per_host_limit=10)
+        session.close()
+    assert len(results) == 12 and all(result['success'] for result in results)
+    assert session.max_in_flight == {'127.0.0.1': 2}
+
+
+def test_a_slow_host_does_not_starve_the_others():
+    class SlowSession(_TrackingSession):
+        def request(self, method, url, **kwargs):
+            if urlsplit(url).hostname == 'localhost':
+                time.sleep(0.3)
+            return super().request(method, url, **kwargs)
+
+    async_utilslib.configure_async(max_workers=4, per_host_limit=2)
+    session = SlowSession()
+    try:
+        with StubServer() as server:
+            port = urlsplit(server.url).port
+            slow_url, fast_url = ['http://{}:{}/webservice.php'.format(host, port)
+                                  for host in ('localhost', '127.0.0.1')]
+
+            async def fast():
+                await async_utilslib.ainvoke_http_request(fast_url, 'GET', {}, session=session)
+                return time.monotonic()
+
+            async def main():
+                slow = [async_utilslib.ainvoke_http_request(slow_url, 'GET', {}, session=session) for _ in range(10)]
+                started = time.monotonic()
+                results = await asyncio.gather(*slow, fast(), fast())
+                return started, results[-2:]
+            started, fast_done = asyncio.run(main())
+    finally:
+        async_utilslib.configure_async(max_workers=100, per_host_limit=10)
+        session.close()
+    # the ten slow calls take 1.5s two at a time, they must not hold the threads the fast host needs
+    assert max(fast_done) - started < 0.5
+    assert session.max_in_flight['localhost'] == 2
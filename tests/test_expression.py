@@ -0,0 +1,141 @@
+"""The expression sandbox: what 'function' set-value fields can and can't do."""
+import pytest
+
+from expression import ExpressionError, evaluate_expression
+
+RECORD = {'firstname': 'John', 'annualrevenue': 125000, 'tags': ['a', 'b'], 'createdtime': '2022-01-10 10:00:00'}
+
+
+def evaluate(source, replacements=None):
+    data = dict(RECORD, tags=list(RECORD['tags']))
+    conf = {'data': data}
+    return evaluate_expression(source, {'conf': conf, 'data': data, 'record': None}, replacements), conf
+
+
+@pytest.mark.parametrize('source, expected', [
+    ("'{{firstname}}'.upper()", 'JOHN'),
+    ('{{annualrevenue}} * 2', 250000),
+    ("data.get('firstname', '').lower()", 'john'),
+    ("sorted(data.keys())[0]", 'annualrevenue'),
+    ("data['tags'].count('a') + len(data['tags'])", 3),
+    ("format_date(add_days(data['createdtime'], 7), '%d/%m/%Y')", '17/01/2022'),
+    ("math.floor(math.sqrt(17))", 4),
+    ("'-'.join(data['tags']).rjust(5, '*')", '**a-b'),
+    ("f\"{data['firstname']:>6}\"", '  John'),
+    ("'%05d' % 42", '00042'),
+    ('(10 ** 100) ** 3 > 0', True),
+    ('sum([1, 2, 3])', 6),
+    ("'ab'.encode() * 2", b'abab'),
+    ("now().strftime('%Y') == str(now().year)", True),
+    ("f\"{add_days(data['createdtime'], 1):%d/%m}\"", '11/01'),
+    ("int(Decimal('12.7')) + round(Decimal('2.5')) + math.floor(Decimal('1.5'))", 15),
+    ("int('ff', 16)", 255),
+])
+def test_allowed(source, expected):
+    replacements = {'{{firstname}}': 'John', '{{annualrevenue}}': 125000}
+    assert evaluate(source, replacements)[0] == expected
+
+
+@pytest.mark.parametrize('source', [
+    "data.update({'id': 'hacked'})",
+    'conf.clear()',
+    "data['tags'].append('c')",
+    "data.setdefault('id', 1)",
+    "dict.update(data, {'id': 1})",
+    "list.append(data['tags'], 'c')",
+    "data.pop('firstname')",
+])
+def test_caller_objects_can_not_be_changed(source):
+    with pytest.raises(ExpressionError):
+        evaluate(source)
+
+
+def test_caller_objects_are_left_untouched():
+    _, conf = evaluate("data.copy().get('firstname')")
+    assert conf['data'] == RECORD
+
+
+@pytest.mark.parametrize('source', [
+    "'a'.ljust(10 ** 7)",
+    "'a'.rjust(10 ** 7)",
+    "'a'.center(10 ** 7)",
+    "'1'.zfill(10 ** 7)",
+    "('\\t' * 1000).expandtabs(10 ** 6)",
+    "','.join(['a'] * 1000000)",
+    "('a' * 1000).replace('a', 'b' * 10000)",
+    "str.ljust('a', 10 ** 7)",
+    "'a' * 10 ** 7",
+    "[[1] * 1000] * 10000",
+    "[[[1] * 100] * 100] * 1000",
+    "sum([[1]] * 1000, [])",
+    "('a' * 1000000) + ('a' * 1000000)",
+    '(10 ** 10000) ** 3',
+    '2 ** 10 ** 8',
+    '(10 ** 10000) * (10 ** 10000) * (10 ** 10000)',
+    'math.factorial(10 ** 5)',
+    'math.comb(10 ** 6, 10 ** 5)',
+    '(1).to_bytes(10 ** 9, "big")',
+    "'%*s' % (10 ** 8, 'a')",
+    "'%100000000s' % 'a'",
+    "f\"{'a':>100000000}\"",
+    "'{}'.format(1)",
+    "'a'.translate({97: 'b' * 1000})",
+    "'a'.encode() * 10 ** 8",
+    "b'a' * 10 ** 8",
+    "('a' * 1000000).encode() + ('a' * 1000000).encode()",
+    "b'%100000000s' % b'a'",
+    "now().strftime('%c' * 400000)",
+    "datetime.strftime(now(), '%c')",
+    "format_date(now(), '%c' * 400000)",
+    "f\"{now():{'%c' * 400000}}\"",
+    "int(Decimal('1e999999'))",
+    "round(Decimal('1e999999'))",
+    "math.floor(Decimal('1e999999'))",
+    "'%d' % Decimal('1e999999')",
+    "Decimal('1e999999').as_integer_ratio()",
+    "f\"{Decimal('1e9999999'):f}\"",
+    "int('1' * 100000, 2)",
+])
+def test_large_values_are_refused(source):
+    with pytest.raises(ExpressionError):
+        evaluate(source)
+
+
+@pytest.mark.parametrize('source', [
+    "__import__('os')",
+    '().__class__.__mro__',
+    "'{0.__class__}'.format(1)",
+    "str.format('{0.__class__}', 1)",
+    'now.__self__',
+    "[x for x in 'ab']",
+    'lambda: 1',
+    'data.__class__',
+    '_utilslib_placeholder_0_',
+])
+def test_escapes_are_refused(source):
+    with pytest.raises(ExpressionError):
+        evaluate(source)
+
+
+def test_unknown_names():
+    with pytest.raises(NameError):
+        evaluate("open('/etc/passwd')")
+
+
+def test_placeholder_values_are_not_code():
+    value = "x'); __import__('os')  #"
+    assert evaluate("'{{name}}'", {'{{name}}': value})[0] == value
+    assert evaluate('{{name}}', {'{{name}}': value})[0] == value
+
+
+@pytest.mark.parametrize('source, check', [
+    ("str_to_datetime('2022-01-10 10:00:00').day", lambda value: value == 10),
+    ("get_datetime('2022-01-10').month", lambda value: value == 1),
+    ('len(get_unique_key())', lambda value: value == 32),
+    ('len(get_unique_keys(3))', lambda value: value == 3),
+    ("date_within_last(format_date(utc_now(), DT_FMT_YMDHMS), 1, 'days')", lambda value: value is True),
+])
+def test_utilslib_helpers(source, check):
+    # registered by utilslib, existing 'function' fields call them
+    import utilslib  # noqa: F401
+    assert check(evaluate(source)[0])
@@ -0,0 +1,126 @@
+"""Host scheduler: token bucket pacing, Retry-After, circuit breaker and a single retry layer."""
+import socket
+import threading
+import time
+
+import pytest
+import requests
+
+import utilslib
+from host_scheduler import CircuitOpenError, HostPolicy, HostScheduler
+
+
+def _response(status, headers=None):
+    response = requests.models.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    return response
+
+
+def test_token_bucket_paces_requests():
+    scheduler = HostScheduler(HostPolicy(rate=20, burst=1))
+    sent = []
+    started = time.monotonic()
+    for _ in range(5):
+        scheduler.run('host', 'GET', lambda: sent.append(time.monotonic()) or _response(200))
+    # the first token is there, the next four come every 1 / 20 s
+    assert time.monotonic() - started >= 0.19
+    assert all(b - a >= 0.04 for a, b in zip(sent, sent[1:]))
+
+
+def test_retry_after_pauses_the_whole_host():
+    scheduler = HostScheduler(HostPolicy(max_retries=1))
+    responses = iter([_response(429, {'Retry-After': '0.3'}), _response(200)])
+    first_sent = threading.Event()
+    sent = {}
+
+    def send():
+        first_sent.set()
+        return next(responses)
+
+    def other():
+        first_sent.wait(1)
+        time.sleep(0.05)
+        scheduler.run('host', 'GET', lambda: sent.setdefault('other', time.monotonic()) and _response(200))
+
+    thread = threading.Thread(target=other)
+    thread.start()
+    started = time.monotonic()
+    assert scheduler.run('host', 'GET', send).status_code == 200
+    thread.join(2)
+    assert time.monotonic() - started >= 0.3
+    # another request to the host waits for the end of the back off too
+    assert sent['other'] - started >= 0.3
+
+
+def test_long_retry_after_is_not_waited_for():
+    scheduler = HostScheduler(HostPolicy(max_retry_after=1))
+    calls = []
+    started = time.monotonic()
+    response = scheduler.run('host', 'GET', lambda: calls.append(1) or _response(503, {'Retry-After': '60'}))
+    assert response.status_code == 503
+    assert len(calls) == 1
+    assert time.monotonic() - started < 1
+
+
+def test_circuit_opens_probes_and_closes():
+    scheduler = HostScheduler(HostPolicy(max_retries=0, failure_threshold=2, reset_timeout=0.2))
+    calls = []
+
+    def send(status):
+        def _send():
+            calls.append(status)
+            return _response(status)
+        return _send
+
+    scheduler.run('host', 'GET', send(500))
+    scheduler.run('host', 'GET', send(500))
+    # open: nothing is sent
+    with pytest.raises(CircuitOpenError):
+        scheduler.run('host', 'GET', send(200))
+    assert calls == [500, 500]
+
+    # a failed probe opens the circuit again
+    time.sleep(0.25)
+    assert scheduler.run('host', 'GET', send(500)).status_code == 500
+    with pytest.raises(CircuitOpenError):
+        scheduler.run('host', 'GET', send(200))
+
+    # a successful probe closes it
+    time.sleep(0.25)
+    assert scheduler.run('host', 'GET', send(200)).status_code == 200
+    assert scheduler.run('host', 'GET', send(200)).status_code == 200
+    assert calls == [500, 500, 500, 200, 200]
+    assert scheduler.state('host').opened_at is None
+
+
+def test_one_connection_per_scheduler_attempt():
+    """ the pooled session of scheduled requests does not retry on its own """
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(16)
+    listener.settimeout(0.2)
+    accepted = []
+    stop = threading.Event()
+
+    def serve():
+        while not stop.is_set():
+            try:
+                conn, _ = listener.accept()
+            except socket.timeout:
+                continue
+            accepted.append(1)
+            conn.close()
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+    try:
+        scheduler = HostScheduler(HostPolicy(max_retries=2, backoff_base=0))
+        with pytest.raises(requests.exceptions.ConnectionError):
+            utilslib.invoke_http_request('http://127.0.0.1:{}/'.format(listener.getsockname()[1]), 'GET', {},
+                                         cache=False, scheduler=scheduler)
+    finally:
+        stop.set()
+        thread.join()
+        listener.close()
+    assert len(accepted) == 3
@@ -0,0 +1,25 @@
+"""The GET response cache must not serve responses which are only valid once."""
+import utilslib
+from stubs import StubServer
+
+
+def test_login_challenges_are_not_cached():
+    cache = utilslib.enable_http_cache()
+    try:
+        with StubServer() as server:
+            for _ in range(3):
+                utilslib.get_session_name('key', server.url, 'user', use_cache=False)
+        assert cache.stats()['hits'] == 0
+    finally:
+        utilslib.disable_http_cache()
+
+
+def test_other_gets_are_cached():
+    cache = utilslib.enable_http_cache()
+    try:
+        with StubServer() as server:
+            for _ in range(3):
+                utilslib.invoke_http_request(server.url + '/webservice.php?operation=listtypes', 'GET', {})
+        assert cache.stats()['hits'] == 2
+    finally:
+        utilslib.disable_http_cache()
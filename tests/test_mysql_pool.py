@@ -0,0 +1,47 @@
+"""MysqlConnectionPool keeps min_size connections open and closes the idle ones above it."""
+import time
+
+import mysql_mgr
+
+
+class _Connection(object):
+    def __init__(self):
+        self.open = True
+
+    def ping(self, reconnect=False):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.open = False
+
+
+def _pool(monkeypatch, **options):
+    opened = []
+    monkeypatch.setattr(mysql_mgr, 'connect', lambda *args: opened.append(_Connection()) or opened[-1])
+    return mysql_mgr.MysqlConnectionPool('user', 'password', 'host', 'database', **options), opened
+
+
+def test_first_acquire_opens_min_size(monkeypatch):
+    pool, opened = _pool(monkeypatch, min_size=3)
+    assert opened == []
+    conn = pool.acquire()
+    assert len(opened) == 3
+    assert pool.metrics()['idle'] == 2
+    pool.release(conn)
+    assert pool.metrics()['size'] == 3
+
+
+def test_idle_connections_above_min_size_are_reaped_on_acquire(monkeypatch):
+    pool, opened = _pool(monkeypatch, min_size=1, idle_timeout=0.05)
+    conns = [pool.acquire() for _ in range(3)]
+    for conn in conns:
+        pool.release(conn)
+    assert pool.metrics()['size'] == 3
+    time.sleep(0.1)
+    conn = pool.acquire()
+    assert pool.metrics()['size'] == 1
+    assert [conn.open for conn in opened] == [False, False, True]
+    pool.release(conn)
@@ -0,0 +1,86 @@
+"""Identifiers and statement chunking of the multi-row insert helpers."""
+import pymysql
+
+import mysql_mgr
+
+
+class _FakeCursor(object):
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, sql):
+        self.conn.statements.append(sql)
+        return 0 if sql.startswith('SELECT') else sql.count('),(') + 1
+
+    def fetchone(self):
+        return (self.conn.max_allowed_packet,)
+
+
+class _FakeConnection(object):
+    encoding = 'utf8'
+
+    def __init__(self, max_allowed_packet=16 * 1024 * 1024):
+        self.max_allowed_packet = max_allowed_packet
+        self.statements = []
+        self.commits = 0
+
+    def cursor(self, cursor_class=None):
+        return _FakeCursor(self)
+
+    def escape(self, value):
+        return pymysql.converters.escape_item(value, 'utf8')
+
+    def commit(self):
+        self.commits += 1
+
+    def inserts(self):
+        return [sql for sql in self.statements if sql.startswith('INSERT')]
+
+
+def test_quote_identifier():
+    assert mysql_mgr.quote_identifier('table') == '`table`'
+    assert mysql_mgr.quote_identifier('db.table') == '`db`.`table`'
+    assert mysql_mgr.quote_identifier('we`ird') == '`we``ird`'
+
+
+def test_rows_are_chunked_by_batch_size():
+    conn = _FakeConnection()
+    rows = [{'id': i, 'name': 'n{}'.format(i)} for i in range(25)]
+    assert mysql_mgr.insert_rows(conn, 'db.t', rows, batch_size=10) == 25
+    inserts = conn.inserts()
+    assert [sql.count('),(') + 1 for sql in inserts] == [10, 10, 5]
+    assert inserts[0].startswith("INSERT INTO `db`.`t` (`id`, `name`) VALUES (0,'n0'),(1,'n1')")
+    assert conn.commits == 1
+
+
+def test_rows_are_chunked_by_packet_size():
+    conn = _FakeConnection(max_allowed_packet=1024 + 500)
+    rows = [(i, 'x' * 90) for i in range(20)]
+    mysql_mgr.upsert_rows(conn, 't', rows, columns=['id', 'value'], update_columns=['value'])
+    inserts = conn.inserts()
+    assert len(inserts) > 1
+    assert sum(sql.count('),(') + 1 for sql in inserts) == 20
+    assert all(len(sql.encode('utf8')) <= conn.max_allowed_packet for sql in inserts)
+    assert all(sql.endswith(' ON DUPLICATE KEY UPDATE `value` = VALUES(`value`)') for sql in inserts)
+
+
+def test_max_allowed_packet_is_read_once_per_connection():
+    conn = _FakeConnection()
+    for _ in range(3):
+        mysql_mgr.insert_rows(conn, 't', [{'id': 1}])
+    assert [sql for sql in conn.statements if sql.startswith('SELECT')] == ['SELECT @@max_allowed_packet']
+    other = _FakeConnection()
+    mysql_mgr.insert_rows(other, 't', [{'id': 1}])
+    assert other.statements[0] == 'SELECT @@max_allowed_packet'
+
+
+def test_explicit_max_packet_size_skips_the_query():
+    conn = _FakeConnection()
+    mysql_mgr.insert_rows(conn, 't', [{'id': 1}], max_packet_size=4096)
+    assert conn.statements == ['INSERT INTO `t` (`id`) VALUES (1)']
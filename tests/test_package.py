@@ -0,0 +1,69 @@
+"""The package gives the same module objects the modules use between them, so its switches take effect,
+whatever the name of the directory holding it."""
+import importlib
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from stubs import StubServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _link(directory, name):
+    """ directory/name pointing at the checkout, the package is imported under that name """
+    os.symlink(ROOT, str(directory / name), target_is_directory=True)
+    return str(directory)
+
+
+@pytest.fixture(scope='module')
+def package(tmp_path_factory):
+    # a name no module uses, whatever the checkout is called
+    sys.path.insert(0, _link(tmp_path_factory.mktemp('package'), 'utilslib_package_under_test'))
+    return importlib.import_module('utilslib_package_under_test')
+
+
+CHECK = '''
+import sys
+import {name} as package
+import http_cache, instrumentation, rule_compiler, async_utilslib
+
+assert package.enable_http_cache is http_cache.enable_http_cache
+assert package.metrics_snapshot is instrumentation.metrics_snapshot
+assert package.clear_rule_cache is rule_compiler.clear_rule_cache
+assert package.ainvoke_http_request is async_utilslib.ainvoke_http_request
+utilslib_module = sys.modules[package.invoke_http_request.__module__]
+assert utilslib_module is package._module('utilslib')
+assert async_utilslib._request_context is utilslib_module._request_context
+'''
+
+
+@pytest.mark.parametrize('name', ['utilslib', 'checkout'])
+def test_names_come_from_the_shared_modules(tmp_path, name):
+    # in a fresh interpreter: 'utilslib', the name of the repository, is also the name of one of its modules
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([_link(tmp_path, name), ROOT]))
+    subprocess.run([sys.executable, '-c', textwrap.dedent(CHECK.format(name=name))], env=env, cwd=str(tmp_path),
+                   check=True)
+
+
+def test_http_cache_enabled_through_the_package_is_used(package):
+    cache = package.enable_http_cache()
+    try:
+        with StubServer() as server:
+            url = server.url + '/webservice.php?operation=listtypes'
+            package.invoke_http_request(url, 'GET', {})
+            package.invoke_http_request(url, 'GET', {})
+        assert cache.stats()['hits'] == 1
+    finally:
+        package.disable_http_cache()
+
+
+def test_metrics_recorded_by_the_modules_are_seen_by_the_package(package):
+    package.reset_metrics()
+    with StubServer() as server:
+        package.invoke_http_request(server.url + '/webservice.php?operation=listtypes', 'GET', {}, cache=False)
+    assert package.metrics_snapshot()['histograms']['http_request_seconds']
+    assert 'http_request_seconds' in package.prometheus_text()
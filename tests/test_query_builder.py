@@ -0,0 +1,70 @@
+"""Conditions are rendered from the config as it is at the call."""
+import pytest
+
+from query_builder import compile_condition, mysql_condition, render_condition
+
+
+def _config():
+    return {'condition': 'and', 'filters': [
+        {'field': 'status', 'operator': '=', 'value': 'open'},
+        {'condition': 'or', 'filters': [
+            {'field': 'amount', 'operator': 'between', 'value': 1, 'value2': 5},
+            {'field': 'owner', 'operator': '!=', 'value': "o'neil"},
+        ]},
+    ]}
+
+
+def test_changes_in_place_are_rendered():
+    config = _config()
+    assert render_condition(config) == "status = 'open' and amount between '1' AND '5' or owner != 'o\\'neil'"
+    config['filters'][0]['value'] = 'closed'
+    config['filters'][1]['filters'].pop()
+    assert render_condition(config) == "status = 'closed' and amount between '1' AND '5'"
+
+
+def test_mysql_placeholders():
+    sql, params = mysql_condition(_config())
+    assert sql == 'status = %s and (amount between %s AND %s or owner != %s)'
+    assert params == ('open', 1, 5, "o'neil")
+    template = compile_condition(_config(), 'mysql')
+    assert template.fragments == sql.split('%s')
+
+
+@pytest.mark.parametrize('leaf', [
+    {'field': 'a; drop', 'operator': '=', 'value': 1},
+    {'field': 'a', 'operator': '= 1 or', 'value': 1},
+])
+def test_invalid_names_are_refused(leaf):
+    with pytest.raises(ValueError):
+        render_condition({'condition': 'and', 'filters': [leaf, leaf]})
+
+
+def test_record_values_can_not_inject_sql():
+    import utilslib
+
+    condition_object = {'condition': 'AND', 'filters': [
+        {'field': 'lastname', 'operator': '=', 'value': '{{lastname}}'},
+        {'field': 'leadsource', 'operator': '=', 'value': 'Web'},
+    ]}
+    replacements = {'{{lastname}}': "x' OR id != '"}
+    query = utilslib.build_search_query(condition_object, 'Leads', replacements=replacements)
+    assert query == "SELECT * FROM Leads WHERE lastname = 'x\\' OR id != \\'' AND leadsource = 'Web';"
+    assert condition_object['filters'][0]['value'] == '{{lastname}}'
+
+
+def test_set_value_task_escapes_record_values(monkeypatch):
+    import utilslib
+
+    queries = []
+    monkeypatch.setattr(utilslib, 'iter_vtiger_query', lambda access, session, query, **kwargs: queries.append(query)
+                        or iter(()))
+    set_value_configs = {
+        'update_matched_records': True,
+        'rule': ['{{lastname}}', {'var': 'data.lastname'}],
+        'search_module_object': {'name': 'Leads', 'condition_object': {'condition': 'AND', 'filters': [
+            {'field': 'lastname', 'operator': '=', 'value': '{{lastname}}'},
+            {'field': 'leadsource', 'operator': '=', 'value': 'Web'}]}},
+        'set_value_fields': [{'name': 'description', 'type': 'static', 'value': 'x'}],
+    }
+    utilslib.invoke_set_value_task({'data': {'lastname': "x' OR id != '"}}, set_value_configs, {})
+    assert queries == ["SELECT * FROM Leads WHERE lastname = 'x\\' OR id != \\'' AND leadsource = 'Web';"]
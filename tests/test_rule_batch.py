@@ -0,0 +1,36 @@
+"""numpy evaluation gives the results of evaluating every record on its own."""
+import pytest
+from json_logic import jsonLogic
+
+from rule_batch import evaluate_rule_batch
+
+np = pytest.importorskip('numpy')
+
+BIG = 2 ** 60
+
+COLUMNS = {
+    'ints': [1, 2, 3, -4],
+    'floats': [0.5, 2.0, 3.25, -4.0],
+    'mixed': [1, 2.5, 3, -4.0],
+    'big': [BIG, BIG + 1, -BIG, 2 ** 53 + 1],
+    'big_mixed': [BIG + 1, 0.5, float(BIG), 2 ** 53 + 1],
+}
+
+OPERANDS = [{'var': name} for name in COLUMNS] + [2, 2.0, 2.5, BIG, BIG + 1, float(BIG), 2 ** 53 + 1]
+
+
+def _records():
+    return [{name: values[index] for name, values in COLUMNS.items()} for index in range(4)]
+
+
+@pytest.mark.parametrize('op', ['==', '!=', '<', '>', '<=', '>='])
+def test_numpy_matches_per_record(op):
+    records = _records()
+    for a in OPERANDS:
+        for b in OPERANDS:
+            if not isinstance(a, dict) and not isinstance(b, dict):
+                continue
+            rule = {op: [a, b]}
+            expected = [bool(jsonLogic(rule, record)) for record in records]
+            assert evaluate_rule_batch(rule, records, use_numpy=True).tolist() == expected, rule
+            assert evaluate_rule_batch(rule, records) == expected, rule
@@ -0,0 +1,49 @@
+"""Compiled rules follow the rule and the operations table as they are at evaluation."""
+from json_logic import jsonLogic
+
+from rule_compiler import compile_rule, evaluate_rule
+
+
+def test_rule_changed_in_place_is_compiled_again():
+    rule = {'==': [{'var': 'a'}, 1]}
+    assert evaluate_rule(rule, {'a': 1}) is True
+    rule['=='][1] = 2
+    assert evaluate_rule(rule, {'a': 1}) is False
+    assert evaluate_rule(rule, {'a': 2}) is True
+
+
+def test_operations_changed_after_compile_are_used():
+    operations = {'double': lambda data, value: value * 2}
+    rule = {'double': [{'triple': [1]}]}
+    func = compile_rule(rule, operations)
+    operations['triple'] = lambda data, value: value * 3
+    operations['double'] = lambda data, value: value * 20
+    assert func({}) == jsonLogic(rule, {}, operations) == 60
+
+
+def test_equal_values_of_other_types_are_not_mixed_up():
+    assert evaluate_rule({'var': 'a'}, {'a': 1}) == 1
+    assert evaluate_rule({'==': [1, 1.0]}) == evaluate_rule({'==': [True, 1.0]}) is True
+    assert evaluate_rule(['x', 1]) == ['x', 1]
+    assert evaluate_rule(['x', True]) == ['x', True]
+
+
+def test_cache_does_not_share_objects_with_the_caller():
+    values = ['x', 'y']
+    rule = {'in': [{'var': 'a'}, values]}
+    assert evaluate_rule(rule, {'a': 'z'}) is False
+    values.append('z')
+    assert evaluate_rule(rule, {'a': 'z'}) is True
+    fresh = {'in': [{'var': 'a'}, ['x', 'y']]}
+    assert evaluate_rule(fresh, {'a': 'z'}) is jsonLogic(fresh, {'a': 'z'}) is False
+
+
+def test_constant_results_are_new_objects():
+    rule = ['x', 1]
+    result = evaluate_rule(rule)
+    assert result == rule and result is not rule
+    result.append(2)
+    assert evaluate_rule(['x', 1]) == ['x', 1]
+    nested = evaluate_rule({'if': [True, [['a']], 'b']})
+    nested[0].append('c')
+    assert evaluate_rule({'if': [True, [['a']], 'b']}) == [['a']]
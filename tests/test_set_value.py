@@ -0,0 +1,24 @@
+"""Bulk set-value with and without a fetch_record limit."""
+import pytest
+
+import utilslib
+from stubs import StubServer
+
+CONDITION_OBJECT = {'condition': 'AND', 'filters': [
+    {'field': 'leadsource', 'operator': '=', 'value': 'Web Site'},
+    {'field': 'lastname', 'operator': '!=', 'value': 'None'},
+]}
+
+
+@pytest.mark.parametrize('fetch_record, expected', [(None, 5), ('', 5), (3, 3), ('2', 2)])
+def test_bulk_mode_fetch_record(fetch_record, expected):
+    with StubServer(records=5) as server:
+        vtiger_access = {'user_access_key': 'key', 'vtiger_url': server.url, 'vtiger_username': 'user'}
+        set_value_configs = {
+            'update_matched_records': True,
+            'search_module_object': {'name': 'Leads', 'condition_object': CONDITION_OBJECT,
+                                     'fetch_record': fetch_record},
+            'set_value_fields': [{'name': 'description', 'type': 'static', 'value': 'bulk'}],
+        }
+        results = utilslib.invoke_set_value_task({'data': {}}, set_value_configs, vtiger_access)
+    assert len(results) == expected
@@ -0,0 +1,68 @@
+"""Trigger batching: lazy thread, bounded close, direct sends once closed."""
+import threading
+import time
+
+import pytest
+
+import utilslib
+from trigger_batcher import BatcherClosedError, WorkflowTriggerBatcher
+
+
+def test_thread_starts_on_first_submit():
+    sent = []
+    batcher = WorkflowTriggerBatcher(lambda *args: sent.append(args), max_linger=0)
+    assert batcher._thread is None
+    assert batcher.flush(1)
+    batcher.submit('wf', 'import', {'id': 1}, 'http://service')
+    assert batcher._thread.is_alive()
+    assert batcher.close(1)
+    assert sent == [('wf', 'import', [{'id': 1}], 'http://service')]
+    with pytest.raises(BatcherClosedError):
+        batcher.submit('wf', 'import', {'id': 2}, 'http://service')
+
+
+def test_close_gives_up_after_timeout():
+    release = threading.Event()
+    batcher = WorkflowTriggerBatcher(lambda *args: release.wait(5), max_linger=0)
+    batcher.submit('wf', 'import', {'id': 1}, 'http://service')
+    started = time.monotonic()
+    assert batcher.close(0.1) is False
+    assert time.monotonic() - started < 1
+    release.set()
+
+
+def test_trigger_is_sent_directly_when_the_batcher_was_closed(monkeypatch):
+    sent = []
+    monkeypatch.setattr(utilslib, 'send_workflow_trigger', lambda *args: sent.append(args))
+    utilslib.enable_trigger_batching()
+    try:
+        # closed by another thread between the lookup of the batcher and the submit
+        utilslib._trigger_batcher.close()
+        utilslib.trigger_workflow('wf', 'import', [{'id': 1}], 'http://service')
+    finally:
+        assert utilslib.disable_trigger_batching(1)
+    assert sent == [('wf', 'import', [{'id': 1}], 'http://service')]
+
+
+def test_close_is_not_blocked_by_a_submit_waiting_for_room():
+    in_send = threading.Event()
+    release = threading.Event()
+
+    def send(*args):
+        in_send.set()
+        release.wait(5)
+
+    batcher = WorkflowTriggerBatcher(send, max_linger=0, max_queue_size=1, put_timeout=3)
+    batcher.submit('wf', 'update', {'id': 1}, 'http://service')
+    assert in_send.wait(1)
+    batcher.submit('wf', 'update', {'id': 2}, 'http://service')
+    # the queue is full, this submit blocks until the background thread takes the second trigger
+    submitter = threading.Thread(target=batcher.submit, args=('wf', 'update', {'id': 3}, 'http://service'))
+    submitter.start()
+    time.sleep(0.1)
+    started = time.monotonic()
+    assert batcher.close(0.2) is False
+    assert time.monotonic() - started < 1
+    release.set()
+    submitter.join(5)
+    assert not submitter.is_alive()
@@ -0,0 +1,88 @@
+"""Unique keys: format, order, and no collisions across threads and forked processes."""
+import os
+import string
+import threading
+import time
+
+import pytest
+
+import unique_key
+import utilslib
+from unique_key import new_unique_key, new_unique_keys
+
+_ALPHABET = string.digits + string.ascii_uppercase + string.ascii_lowercase
+
+
+def _decode(chars):
+    number = 0
+    for char in chars:
+        number = number * len(_ALPHABET) + _ALPHABET.index(char)
+    return number
+
+
+def test_format():
+    before = time.time_ns() // 1000
+    key = utilslib.get_unique_key()
+    after = time.time_ns() // 1000
+    assert len(key) == 32
+    assert set(key) <= set(_ALPHABET)
+    # the first ten characters are the creation time in microseconds
+    assert before - 1000 <= _decode(key[:10]) <= after + 1000
+    assert key[16:24] == unique_key._node
+    assert all(len(key) == 32 and set(key) <= set(_ALPHABET) for key in utilslib.get_unique_keys(100))
+
+
+@pytest.mark.parametrize('number', [0, 1, 61, 62, 62 ** 2 - 1, 62 ** 2, 62 ** 6 - 1, 62 ** 8 - 1, 62 ** 10 - 1])
+def test_encoders_match_the_generic_one(number):
+    assert unique_key._encode6(number % 62 ** 6) == unique_key._encode(number % 62 ** 6, 6)
+    assert unique_key._encode8(number % 62 ** 8) == unique_key._encode(number % 62 ** 8, 8)
+    assert unique_key._encode10(number) == unique_key._encode(number, 10)
+    assert _decode(unique_key._encode10(number)) == number
+
+
+def test_keys_increase():
+    keys = [new_unique_key() for _ in range(1000)]
+    keys += new_unique_keys(1000)
+    keys += [new_unique_key() for _ in range(1000)]
+    assert keys == sorted(keys)
+    assert len(set(keys)) == len(keys)
+
+
+def test_no_collision_across_threads():
+    results = [None] * 8
+
+    def work(index):
+        results[index] = [new_unique_key() for _ in range(5000)] + new_unique_keys(5000)
+    threads = [threading.Thread(target=work, args=(index,)) for index in range(len(results))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(keys == sorted(keys) for keys in results)
+    keys = [key for keys in results for key in keys]
+    assert len(set(keys)) == len(keys)
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_no_collision_across_a_fork():
+    parent_keys = [new_unique_key() for _ in range(1000)]
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # the child gets its own node and sequence, even though it starts with a copy of the parent state
+        try:
+            os.close(read_end)
+            keys = [unique_key._node] + [new_unique_key() for _ in range(5000)]
+            with os.fdopen(write_end, 'w') as pipe:
+                pipe.write('\n'.join(keys))
+        finally:
+            os._exit(0)
+    os.close(write_end)
+    parent_keys += [new_unique_key() for _ in range(5000)]
+    with os.fdopen(read_end) as pipe:
+        child_node, *child_keys = pipe.read().split('\n')
+    os.waitpid(pid, 0)
+    assert child_node != unique_key._node
+    assert len(child_keys) == 5000 and child_keys == sorted(child_keys)
+    keys = parent_keys + child_keys
+    assert len(set(keys)) == len(keys)
@@ -0,0 +1,90 @@
+"""Workflow DAG: branches, failures, cycles and parallel steps."""
+import threading
+
+import pytest
+
+import workflow_engine
+from workflow_engine import STEP_DONE, STEP_FAILED, STEP_SKIPPED, run_workflow
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """ web_service steps return their config, or raise it when it is an exception """
+    calls = []
+
+    def run(step, conf, vtiger_access):
+        calls.append(step['id'])
+        config = step.get('config')
+        if isinstance(config, Exception):
+            raise config
+        if callable(config):
+            return config(conf)
+        return config
+
+    monkeypatch.setitem(workflow_engine.STEP_RUNNERS, 'web_service', run)
+    return calls
+
+
+def _step(step_id, config=None, depends_on=()):
+    return {'id': step_id, 'type': 'web_service', 'config': config, 'depends_on': list(depends_on)}
+
+
+def _check(value):
+    return {'id': 'check', 'type': 'conditional', 'condition': {'==': [{'var': 'data.x'}, value]},
+            'true_steps': ['notify'], 'false_steps': ['update']}
+
+
+@pytest.mark.parametrize('value, taken, not_taken', [(1, 'notify', 'update'), (2, 'update', 'notify')])
+def test_branch_not_taken_is_skipped(calls, value, taken, not_taken):
+    workflow = {'steps': [_check(value), _step('notify', 'n'), _step('update', 'u'),
+                          _step('after_notify', 'a', depends_on=['notify'])]}
+    results = run_workflow(workflow, {'data': {'x': 1}})
+    assert results['check']['status'] == STEP_DONE
+    assert results[taken]['status'] == STEP_DONE
+    assert results[not_taken]['status'] == STEP_SKIPPED
+    # skipping carries on to the steps depending on a skipped one
+    assert results['after_notify']['status'] == (STEP_DONE if taken == 'notify' else STEP_SKIPPED)
+    assert not_taken not in calls
+
+
+def test_failure_skips_the_dependants(calls):
+    error = RuntimeError('boom')
+    workflow = {'steps': [_step('a', error), _step('b', 'b', depends_on=['a']), _step('c', 'c', depends_on=['b']),
+                          _step('other', 'o')]}
+    results = run_workflow(workflow, {})
+    assert results['a'] == {'status': STEP_FAILED, 'result': None, 'error': error}
+    assert results['b']['status'] == STEP_SKIPPED
+    assert results['c']['status'] == STEP_SKIPPED
+    assert results['other'] == {'status': STEP_DONE, 'result': 'o', 'error': None}
+    assert sorted(calls) == ['a', 'other']
+
+
+def test_results_of_the_dependencies_are_passed(calls):
+    workflow = {'steps': [_step('a', 1), _step('b', 2),
+                          _step('sum', lambda conf: conf['steps']['a']['result'] + conf['steps']['b']['result'],
+                                depends_on=['a', 'b'])]}
+    assert run_workflow(workflow, {})['sum']['result'] == 3
+
+
+@pytest.mark.parametrize('steps, message', [
+    ([_step('a', depends_on=['b']), _step('b', depends_on=['a'])], 'cycle'),
+    ([_step('a', depends_on=['a'])], 'cycle'),
+    ([_step('a', depends_on=['c']), _step('b', depends_on=['a']), _step('c', depends_on=['b'])], 'cycle'),
+    ([_step('a', depends_on=['missing'])], 'unknown step'),
+    ([{'id': 'a', 'type': 'nope'}], 'unknown type'),
+])
+def test_invalid_workflows_are_rejected(calls, steps, message):
+    with pytest.raises(ValueError, match=message):
+        run_workflow({'steps': steps}, {})
+    assert calls == []
+
+
+def test_independent_steps_run_in_parallel(calls):
+    # each step waits for the other two: it only finishes if the three run at the same time
+    barrier = threading.Barrier(3, timeout=5)
+    workflow = {'steps': [_step(step_id, lambda conf: barrier.wait()) for step_id in ('a', 'b', 'c')]
+                + [_step('join', 'done', depends_on=['a', 'b', 'c'])]}
+    results = run_workflow(workflow, {}, max_workers=3)
+    assert all(results[step_id]['status'] == STEP_DONE for step_id in ('a', 'b', 'c'))
+    assert results['join']['result'] == 'done'
+    assert calls[-1] == 'join'
@@ -0,0 +1,155 @@
+"""Coalesce many small workflow triggers into fewer requests"""
+import queue
+import threading
+import time
+
+from instrumentation import logger
+
+__all__ = ['WorkflowTriggerBatcher', 'BatcherClosedError']
+
+
+class BatcherClosedError(RuntimeError):
+    """ submit on a closed batcher, the trigger was not queued """
+
+
+class _Flush(object):
+    def __init__(self, stop=False):
+        self.stop = stop
+        self.done = threading.Event()
+
+
+class WorkflowTriggerBatcher(object):
+    """ background batcher for workflow triggers.
+        triggers for the same (service_url, workflow, event_type) are merged into one call of
+        send(workflow, event_type, data, service_url) where data is the list of all the submitted records,
+        once max_batch_size records are waiting or the oldest one waited max_linger seconds.
+        only event types listed in list_event_types are merged (the trigger API takes a list of records for
+        those), the other ones are sent one by one from the background thread.
+
+        params:
+        1. send: function doing the actual request
+        2. max_batch_size: max records sent in one request
+        3. max_linger: max seconds a record waits for others to join its batch
+        4. max_queue_size: submit blocks when that many triggers are waiting (backpressure)
+        5. put_timeout: seconds submit blocks before raising queue.Full, None blocks until there is room
+        the background thread is started by the first submit, a process which never triggers (e.g. a forked
+        worker) has no thread.
+        """
+
+    def __init__(self, send, max_batch_size=100, max_linger=0.05, max_queue_size=10000,
+                 list_event_types=('import', 'manual'), put_timeout=None):
+        self.send = send
+        self.max_batch_size = max_batch_size
+        self.max_linger = max_linger
+        self.list_event_types = tuple(list_event_types)
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._closed = False
+        self._thread = None
+        # close waits for the submits past their closed check so that nothing is queued behind the stop of
+        # the thread, the blocking put itself is done without the lock
+        self._lock = threading.Condition()
+        self._putting = 0
+
+    def submit(self, workflow, event_type, data, service_url):
+        """ queue a trigger, raises BatcherClosedError once the batcher is closed """
+        with self._lock:
+            if self._closed:
+                raise BatcherClosedError('trigger batcher is closed')
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='workflow-trigger-batcher', daemon=True)
+                self._thread.start()
+            self._putting += 1
+        try:
+            self._queue.put((service_url, workflow, event_type, data), timeout=self.put_timeout)
+        finally:
+            with self._lock:
+                self._putting -= 1
+                if not self._putting:
+                    self._lock.notify_all()
+
+    def flush(self, timeout=None):
+        """ send everything submitted so far, returns False if it did not finish within timeout """
+        if self._thread is None:
+            return True
+        return self._wait(_Flush(), _deadline(timeout))
+
+    def close(self, timeout=None):
+        """ send what is pending and stop the background thread, returns False if it did not finish within
+            timeout (the records still waiting are dropped with the daemon thread at exit)
+            """
+        deadline = _deadline(timeout)
+        with self._lock:
+            if self._closed:
+                return True
+            self._closed = True
+            if self._thread is None:
+                return True
+            if not self._lock.wait_for(lambda: not self._putting, timeout):
+                return False
+        return self._wait(_Flush(stop=True), deadline)
+
+    def _wait(self, flush, deadline):
+        try:
+            self._queue.put(flush, timeout=_remaining(deadline))
+        except queue.Full:
+            return False
+        return flush.done.wait(_remaining(deadline))
+
+    def _run(self):
+        pending = {}  # key -> (records, deadline)
+        while True:
+            timeout = None
+            if pending:
+                timeout = max(0, min(deadline for _, deadline in pending.values()) - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, _Flush):
+                for key in list(pending):
+                    self._send(key, pending.pop(key)[0])
+                item.done.set()
+                if item.stop:
+                    return
+                continue
+
+            if item is not None:
+                service_url, workflow, event_type, data = item
+                key = (service_url, workflow, event_type)
+                if event_type not in self.list_event_types:
+                    self._send_one(workflow, event_type, data, service_url)
+                else:
+                    records, deadline = pending.get(key) or ([], time.monotonic() + self.max_linger)
+                    if isinstance(data, list):
+                        records.extend(data)
+                    else:
+                        records.append(data)
+                    pending[key] = (records, deadline)
+
+            now = time.monotonic()
+            for key in list(pending):
+                records, deadline = pending[key]
+                if len(records) >= self.max_batch_size or deadline <= now:
+                    del pending[key]
+                    self._send(key, records)
+
+    def _send(self, key, records):
+        service_url, workflow, event_type = key
+        for start in range(0, len(records), self.max_batch_size):
+            self._send_one(workflow, event_type, records[start:start + self.max_batch_size], service_url)
+
+    def _send_one(self, workflow, event_type, data, service_url):
+        try:
+            self.send(workflow, event_type, data, service_url)
+        except Exception:
+            logger.exception('Error raised while sending workflow trigger %s (%s)', workflow, event_type)
+
+
+def _deadline(timeout):
+    return None if timeout is None else time.monotonic() + timeout
+
+
+def _remaining(deadline):
+    return None if deadline is None else max(0, deadline - time.monotonic())
@@ -0,0 +1,86 @@
+"""Fast, time ordered 32 character unique keys.
+
+key = time (10) + sequence (6) + node (8) + random (8), every part base62 encoded (0-9A-Za-z) so keys
+sort in ascii order by creation time:
+    time: microseconds since the epoch, from a monotonic clock anchored on the wall clock at start
+    sequence: per process counter, makes keys of one process strictly increasing
+    node: random per process value, drawn again in forked children
+    random: random bits of every key
+No lock is taken: the counter is an itertools.count, whose next() is atomic.
+"""
+import itertools
+import os
+import random
+import string
+import time
+
+__all__ = ['new_unique_key', 'new_unique_keys']
+
+_ALPHABET = string.digits + string.ascii_uppercase + string.ascii_lowercase
+_PAIRS = [a + b for a in _ALPHABET for b in _ALPHABET]
+_PAIR_BASE = len(_PAIRS)
+
+_NODE_WIDTH = 8
+_SEQUENCE_MOD = len(_ALPHABET) ** 6
+_RANDOM_BITS = 47
+
+
+def _encode(number, width):
+    """ fixed width base62, two digits at a time; width must be even """
+    chars = ''
+    for _ in range(width // 2):
+        number, pair = divmod(number, _PAIR_BASE)
+        chars = _PAIRS[pair] + chars
+    return chars
+
+
+# unrolled _encode for the widths used on every key
+def _encode6(number):
+    number, low = divmod(number, _PAIR_BASE)
+    high, middle = divmod(number, _PAIR_BASE)
+    return _PAIRS[high % _PAIR_BASE] + _PAIRS[middle] + _PAIRS[low]
+
+
+def _encode8(number):
+    number, low = divmod(number, _PAIR_BASE)
+    number, second = divmod(number, _PAIR_BASE)
+    high, first = divmod(number, _PAIR_BASE)
+    return _PAIRS[high % _PAIR_BASE] + _PAIRS[first] + _PAIRS[second] + _PAIRS[low]
+
+
+def _encode10(number):
+    high, low = divmod(number, _PAIR_BASE)
+    return _encode8(high) + _PAIRS[low]
+
+
+def _init():
+    global _wall_anchor_us, _mono_anchor_ns, _sequence, _node, _random
+    _wall_anchor_us = time.time_ns() // 1000
+    _mono_anchor_ns = time.monotonic_ns()
+    _sequence = itertools.count()
+    _random = random.Random(int.from_bytes(os.urandom(16), 'big'))
+    _node = _encode(_random.getrandbits(_RANDOM_BITS), _NODE_WIDTH)
+
+
+_init()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_init)
+
+
+def _now_us():
+    return _wall_anchor_us + (time.monotonic_ns() - _mono_anchor_ns) // 1000
+
+
+def new_unique_key():
+    return (_encode10(_now_us()) + _encode6(next(_sequence) % _SEQUENCE_MOD) + _node
+            + _encode8(_random.getrandbits(_RANDOM_BITS)))
+
+
+def new_unique_keys(count):
+    """ count keys in increasing order, sharing one clock read """
+    prefix = _encode10(_now_us())
+    node = _node
+    sequence = _sequence
+    getrandbits = _random.getrandbits
+    return [prefix + _encode6(next(sequence) % _SEQUENCE_MOD) + node + _encode8(getrandbits(_RANDOM_BITS))
+            for _ in range(count)]
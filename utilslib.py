@@ -1,49 +1,169 @@
-import requests
 from json_logic.builtins import BUILTINS
 from enums import HttpMethodEnum
 import json
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from mysql_mgr import *
+import importlib
+import functools
+import date_utils
+import instrumentation
+from instrumentation import *
+from date_utils import *
+from session_cache import SessionCache
+from substitution import replace_placeholders, replace_placeholders_in
+from trigger_batcher import WorkflowTriggerBatcher, BatcherClosedError
+from query_builder import render_condition
+from unique_key import new_unique_key, new_unique_keys
 from datetime import datetime, date, timedelta
-import dateutil.parser as parser
-import string
-import random
-import shortuuid
 import hashlib
+import time
+import os
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlsplit
 from json_logic import jsonLogic
+from rule_compiler import evaluate_rule
+from rule_batch import register_vector_op, DATE_VECTOR_OPS
+from expression import evaluate_expression, register_expression_helper
 
 DT_FMT_HMSf = '%H%M%S%f'
 
+# state of the requests sent by this thread: host_limits is set by the asyncio entry points (async_utilslib)
+_request_context = threading.local()
+
+# requests, pymysql and dateutil are slow to import: the helpers re-exported from the modules using them are
+# imported on first use (see __getattr__), the functions below import them when they are called.
+_LAZY_ATTRIBUTES = {
+    **{name: ('http_client', name) for name in (
+        'configure_http_pool', 'get_http_session', 'close_http_sessions', 'reset_http_sessions')},
+    **{name: ('http_cache', name) for name in (
+        'HttpResponseCache', 'enable_http_cache', 'disable_http_cache', 'get_http_cache')},
+    **{name: ('host_scheduler', name) for name in (
+        'HostPolicy', 'HostScheduler', 'CircuitOpenError', 'SlotTimeoutError', 'enable_host_scheduler',
+        'disable_host_scheduler', 'get_host_scheduler')},
+    **{name: ('mysql_mgr', name) for name in (
+        'MysqlDatabaseHandler', 'MysqlConnectionPool', 'PooledMysqlDatabaseHandler', 'get_mysql_pool',
+        'close_mysql_pools', 'fetch_single_row', 'fetch_rows', 'iter_rows', 'iter_row_batches', 'transaction',
+        'execute_many', 'insert_rows', 'upsert_rows')},
+}
 
-def invoke_http_request(endpoint, method, headers, payload=None, json_data=None, timeout=61):
+__all__ = [
+    'DT_FMT_HMSf', 'invoke_http_request', 'record_http_response', 'requests_retry_session',
+    'log_failed_http_request', 'is_success_request', 'date_within_next', 'date_within_last', 'str_to_datetime',
+    'get_datetime', 'get_unique_key', 'get_unique_keys', 'ops', 'buildquery', 'module_id_dict', 'vtiger_sessions',
+    'VTIGER_INVALID_SESSION_CODES', 'VTIGER_QUERY_PAGE_SIZE', 'vtiger_session_key', 'get_session_name',
+    'invalidate_session_name', 'is_invalid_session_response', 'vtiger_login', 'invoke_vtiger_request',
+    'enable_trigger_batching', 'disable_trigger_batching', 'flush_trigger_batching', 'trigger_workflow',
+    'send_workflow_trigger', 'json_logic_replace_data', 'json_logic_replacements', 'map_json_logic_rules',
+    'map_json_logic_replace_data', 'iter_vtiger_query_pages', 'iter_vtiger_query', 'run_external_workflow',
+    'trigger_set_value_task', 'build_set_value_element', 'revise_record', 'trigger_bulk_set_value_task',
+    'invoke_set_value_task', 'invoke_web_service_task', 'invoke_conditional_task', 'build_search_query',
+] + date_utils.__all__ + instrumentation.__all__ + list(_LAZY_ATTRIBUTES)
+
+# modules that used to be imported here, still reachable as attributes
+_LAZY_ATTRIBUTES.update({
+    'requests': ('requests', None),
+    'parser': ('dateutil.parser', None),
+    'HTTPAdapter': ('requests.adapters', 'HTTPAdapter'),
+    'Retry': ('urllib3.util.retry', 'Retry'),
+})
+
+
+def __getattr__(name):
+    target = _LAZY_ATTRIBUTES.get(name)
+    if target is None:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    module_name, attribute = target
+    value = importlib.import_module(module_name)
+    if attribute is not None:
+        value = getattr(value, attribute)
+    globals()[name] = value
+    return value
+
+
+def invoke_http_request(endpoint, method, headers, payload=None, json_data=None, timeout=61, session=None,
+                        cache=None, scheduler=None):
     """ here two exception block. one is for request exception and other is for json decoder exception.
     RequestException raise when some error occur in API response
     JSONDecodeError: sometimes we don't know our API response is in json format or not so, when we return
     response.json() it raise error if it not json format.
+    session: by default the pooled session for the endpoint host is used (see http_client.get_http_session),
+    pass a session to use your own one.
+    cache: HttpResponseCache for GET requests, by default the one of enable_http_cache if any, False to skip it.
+    scheduler: HostScheduler limiting the requests per host (rate, in-flight requests, 429 retries, circuit
+    breaker), by default the one of enable_host_scheduler if any, False to skip it. Cache hits are not scheduled.
     """
-    _request = requests_retry_session()
-    _request.headers.update({
-        **headers
-    })
-    try:
-        response = None
-        if method == HttpMethodEnum.GET.value:
-            response = _request.get(url=endpoint, data=payload, timeout=timeout)
-        if method == HttpMethodEnum.POST.value:
-            response = _request.post(url=endpoint, data=payload, json=json_data, timeout=timeout)
-        if method == HttpMethodEnum.PUT.value:
-            response = _request.put(url=endpoint, data=payload, timeout=timeout)
-        if method == HttpMethodEnum.DELETE.value:
-            response = _request.delete(url=endpoint, data=payload, timeout=timeout)
-        log_failed_http_request(endpoint, response.text, response.status_code)
-        return response.json(), response.status_code
-    except requests.exceptions.RequestException:
-        print('Error raised while invoking %s', endpoint)
-        raise
-    except json.decoder.JSONDecodeError:
-        print('JSON Decode Error raised while invoking %s', endpoint)
-        return response, response.status_code
+    import requests
+    from http_client import get_http_session
+    from http_cache import get_http_cache
+    from host_scheduler import get_host_scheduler
+
+    if cache is None:
+        cache = get_http_cache()
+    if scheduler is None:
+        scheduler = get_host_scheduler()
+    # a scheduled request is retried by the scheduler, the session must not retry on its own
+    _request = session or get_http_session(endpoint, scheduled=bool(scheduler))
+    host = urlsplit(endpoint).hostname or ''
+    host_limits = getattr(_request_context, 'host_limits', None)
+    if host_limits is not None:
+        _request = host_limits.session(_request, host)
+    if scheduler:
+        _request = scheduler.session(_request, host)
+    log_payload('%s %s payload: %s', method, endpoint, json_data if payload is None else payload)
+    with span('http_request', method=method, host=host) as request_span:
+        try:
+            response = None
+            if method == HttpMethodEnum.GET.value:
+                if cache:
+                    response = cache.get(_request, endpoint, headers, payload, timeout)
+                else:
+                    response = _request.get(url=endpoint, data=payload, headers=headers, timeout=timeout)
+            if method == HttpMethodEnum.POST.value:
+                response = _request.post(url=endpoint, data=payload, json=json_data, headers=headers,
+                                         timeout=timeout)
+            if method == HttpMethodEnum.PUT.value:
+                response = _request.put(url=endpoint, data=payload, headers=headers, timeout=timeout)
+            if method == HttpMethodEnum.DELETE.value:
+                response = _request.delete(url=endpoint, data=payload, headers=headers, timeout=timeout)
+            record_http_response(request_span, host, response)
+            if not is_success_request(response.status_code):
+                log_failed_http_request(endpoint, response.text, response.status_code)
+            result = response.json()
+            log_payload('%s %s response: %s', method, endpoint, result)
+            return result, response.status_code
+        except requests.exceptions.RequestException:
+            logger.error('Error raised while invoking %s', endpoint)
+            raise
+        except json.decoder.JSONDecodeError:
+            logger.warning('JSON Decode Error raised while invoking %s', endpoint)
+            return response, response.status_code
+
+
+def _in_request_context(func):
+    """ func running with the request context of this thread, for the helper threads of a task """
+    host_limits = getattr(_request_context, 'host_limits', None)
+    if host_limits is None:
+        return func
+
+    def run(*args):
+        _request_context.host_limits = host_limits
+        try:
+            return func(*args)
+        finally:
+            _request_context.host_limits = None
+    return run
+
+
+def record_http_response(request_span, host, response):
+    """ time to first byte, retries and status of a response, for the metrics """
+    if getattr(response, 'from_cache', False):
+        request_span.label(cache='hit')
+    else:
+        request_span.phase('ttfb', response.elapsed.total_seconds())
+        retries = getattr(getattr(response.raw, 'retries', None), 'history', None)
+        if retries:
+            inc_counter('http_request_retries_total', len(retries), host=host)
+    inc_counter('http_responses_total', host=host, status=response.status_code)
 
 
 def requests_retry_session(
@@ -51,6 +171,10 @@ def requests_retry_session(
         backoff_factor=0.3,
         status_forcelist=(500, 502, 504),
         session=None):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
     session = session or requests.Session()
     retry = Retry(
         total=retries,
@@ -67,8 +191,7 @@ def requests_retry_session(
 
 def log_failed_http_request(endpoint, response, status_code):
     if not is_success_request(status_code):
-        msg = 'Http {} | Error-{} : {}'.format(endpoint, status_code, response)
-        print('Error raised ', msg)
+        logger.warning('Error raised Http %s | Error-%s : %.1000s', endpoint, status_code, response)
 
 
 def is_success_request(status_code):
@@ -76,46 +199,57 @@ def is_success_request(status_code):
 
 
 def date_within_next(date, number, period):
+    now = utc_now()
     if period == "days":
-        return datetime.utcnow() <= str_to_datetime(date) <= (
-                datetime.utcnow() + timedelta(days=int(number)))
+        return now <= str_to_datetime(date) <= (now + timedelta(days=int(number)))
     elif period == "weeks":
-        return datetime.utcnow() <= str_to_datetime(date) <= (
-                datetime.utcnow() + timedelta(weeks=int(number)))
+        return now <= str_to_datetime(date) <= (now + timedelta(weeks=int(number)))
 
 
 def date_within_last(date, number, period):
+    now = utc_now()
     if period == "days":
-        return (datetime.utcnow() - timedelta(
-            days=int(number))) <= str_to_datetime(date) <= datetime.utcnow()
+        return (now - timedelta(days=int(number))) <= str_to_datetime(date) <= now
     elif period == "weeks":
-        return (datetime.utcnow() - timedelta(
-            weeks=int(number))) <= str_to_datetime(date) <= datetime.utcnow()
+        return (now - timedelta(weeks=int(number))) <= str_to_datetime(date) <= now
 
 
-def str_to_datetime(date_time, str_format="%Y-%m-%d %H:%M:%S"):
+def str_to_datetime(date_time, str_format=DT_FMT_YMDHMS):
+    if str_format == DT_FMT_YMDHMS:
+        return parse_datetime(date_time)
     return datetime.strptime(date_time, str_format)
 
 
 def get_datetime(date_string):
     """ this function will return datetime object with 2022-01-10 00:00:00 format"""
-    return parser.parse(date_string)
+    parsed = parse_iso_datetime(date_string)
+    if parsed is None:
+        import dateutil.parser as parser
+        parsed = parser.parse(date_string)
+    return parsed
 
 
 def get_unique_key():
     """
-    This method is used to get 32 bit unique key
-    Steps:
-        1. Get current timestamp in "%H%M%S%f" string format
-        2. Select random string of 8 char and add with timestamp
-        3. Generate 12 bit random string using shortuuid
-    :return: 32 bit Unique key
+    This method is used to get 32 char unique key
+    Keys are time ordered: microsecond timestamp, per process sequence and node, random part (see unique_key)
+    :return: 32 char Unique key
     """
+    return new_unique_key()
+
 
-    timestamp = datetime.now().strftime(DT_FMT_HMSf)
-    random_str = timestamp + ''.join(random.choice(string.digits + string.ascii_letters) for _ in range(8))
-    uuid_str = shortuuid.ShortUUID().random(length=12)
-    return '{}{}'.format(uuid_str, random_str)
+def get_unique_keys(count):
+    """ list of count unique keys, cheaper than calling get_unique_key count times """
+    return new_unique_keys(count)
+
+
+# 'function' set-value fields were evaluated in this module and used these helpers by name
+for _helper in (date_within_next, date_within_last, str_to_datetime, get_datetime, get_unique_key, get_unique_keys,
+                parse_iso_datetime):
+    register_expression_helper(_helper.__name__, _helper)
+register_expression_helper('DT_FMT_YMDHMS', DT_FMT_YMDHMS)
+register_expression_helper('DT_FMT_HMSf', DT_FMT_HMSf)
+del _helper
 
 
 ops = {
@@ -127,40 +261,37 @@ ops = {
     'date_within_last': lambda data, a, b, c: date_within_last(a, b, c),
     'date_after': lambda data, a, b: str_to_datetime(a) > str_to_datetime(b),
     'date_before': lambda data, a, b: str_to_datetime(a) < str_to_datetime(b),
-    'date_yesterday': lambda data, a: str_to_datetime(a).date() == datetime.utcnow().date() - timedelta(days=1),
-    'date_today': lambda data, a: str_to_datetime(a).date() == datetime.utcnow().date(),
-    'date_tomorrow': lambda data, a: str_to_datetime(a).date() == datetime.utcnow().date() + timedelta(days=1),
+    'date_yesterday': lambda data, a: str_to_datetime(a).date() == utc_now().date() - timedelta(days=1),
+    'date_today': lambda data, a: str_to_datetime(a).date() == utc_now().date(),
+    'date_tomorrow': lambda data, a: str_to_datetime(a).date() == utc_now().date() + timedelta(days=1),
     'date_is_empty': lambda data, a: a == ""
 }
 
+for _op_name, _vector_func in DATE_VECTOR_OPS.items():
+    register_vector_op(ops[_op_name], _vector_func)
 
-def buildquery(json_object):
-    if 'field' in json_object.keys():
-        # In this case the json_object is an object which describes a single query
-        if json_object.get("operator") != 'BETWEEN':
-            return json_object.get("field") + " " + json_object.get("operator") + " '" + json_object.get("value") + "' "
-        else:
-            return json_object.get("field") + " " + json_object.get("operator") + " '" + json_object.get(
-                "value") + "' " + 'AND' + " '" + json_object.get("value2") + "' "
 
-    # else it is an "condition+filters" JSON - Object
-    else:
-        i = 0
-        # result = "("
-        result = ""
-        filter_array = json_object.get("filters")
-        while i < len(filter_array):
-            # Add (maybe nested) expression
-            result += " " + buildquery(filter_array[i]) + " "
+def buildquery(json_object):
+    """ vtiger query condition of a condition_object, see query_builder. values are escaped string literals """
+    return render_condition(json_object)
 
-            # if we are already at the end of our filters array, do not add condition string
-            # or we WOULD end up with something like ( a OR b OR c OR )
 
-            if i != len(filter_array) - 1:
-                result += json_object.get("condition")
-            i = i + 1
-        # result += ")"
-        return result
+def build_search_query(condition_object, module, order_by='', limit=None, replacements=None):
+    """ vtiger SELECT of the records of module matching condition_object.
+        the placeholders of replacements (see json_logic_replacements) are replaced in the values of the
+        condition before it is rendered, so the values of a record are escaped like the other literals, and in
+        module and order_by, which are names taken from the config.
+        """
+    if replacements:
+        condition_object = replace_placeholders_in(condition_object, replacements)
+        module = replace_placeholders(module, replacements)
+        order_by = replace_placeholders(order_by, replacements)
+    query = 'SELECT * FROM {module} WHERE {condition}'.format(module=module, condition=buildquery(condition_object))
+    if order_by:
+        query += ' order by ' + order_by
+    if limit is not None:
+        query += ' LIMIT {}'.format(limit)
+    return query + ';'
 
 
 module_id_dict = {'Campaigns': '1', 'Invoice': '2', 'SalesOrder': '3', 'PurchaseOrder': '4', 'Quotes': '5', 'Faq': '6',
@@ -176,17 +307,58 @@ module_id_dict = {'Campaigns': '1', 'Invoice': '2', 'SalesOrder': '3', 'Purchase
                   'Predicting': '91', 'Notifications': '95'}
 
 
-def get_session_name(user_access_key, vtiger_url, vtiger_username):
+vtiger_sessions = SessionCache(default_ttl=300)
+
+VTIGER_INVALID_SESSION_CODES = ('INVALID_SESSIONID', 'AUTHENTICATION_REQUIRED')
+
+VTIGER_QUERY_PAGE_SIZE = 100
+
+
+def vtiger_session_key(user_access_key, vtiger_url, vtiger_username):
+    return vtiger_url.rstrip('/'), vtiger_username, hashlib.sha256(user_access_key.encode()).hexdigest()
+
+
+@timed('vtiger_session')
+def get_session_name(user_access_key, vtiger_url, vtiger_username, use_cache=True):
+    """ return a vtiger session name for the user.
+        sessions are cached per (vtiger_url, username, access key) until the expiry vtiger returns with the
+        challenge, and concurrent callers for the same user share one login.
+        """
+    if not use_cache:
+        return vtiger_login(user_access_key, vtiger_url, vtiger_username)[0]
+
+    key = vtiger_session_key(user_access_key, vtiger_url, vtiger_username)
+    return vtiger_sessions.get_or_create(
+        key, lambda: vtiger_login(user_access_key, vtiger_url, vtiger_username))
+
+
+def invalidate_session_name(user_access_key, vtiger_url, vtiger_username, session_name=None):
+    vtiger_sessions.invalidate(vtiger_session_key(user_access_key, vtiger_url, vtiger_username), session_name)
+
+
+def is_invalid_session_response(response):
+    if isinstance(response, dict) and not response.get('success', True):
+        return (response.get('error') or {}).get('code') in VTIGER_INVALID_SESSION_CODES
+    return False
+
+
+@timed('vtiger_login')
+def vtiger_login(user_access_key, vtiger_url, vtiger_username):
+    """ do getchallenge + login on vtiger. returns (session_name, ttl in seconds or None)"""
     # get challenge
     headers = {'content-type': 'application/json'}
 
     challenge_url = '{vtiger_url}/webservice.php?operation=getchallenge&username={vtiger_username}'.format(
         vtiger_url=vtiger_url, vtiger_username=vtiger_username)
 
-    response, status = invoke_http_request(challenge_url, 'GET', headers=headers)
+    # every login needs a fresh challenge token, never a cached one
+    response, status = invoke_http_request(challenge_url, 'GET', headers=headers, cache=False)
 
     if status == 200 and response.get('result', ''):
         token = response.get('result').get('token')
+        ttl = None
+        if response.get('result').get('expireTime') and response.get('result').get('serverTime'):
+            ttl = int(response.get('result').get('expireTime')) - int(response.get('result').get('serverTime'))
 
         # get md5 encoded access key
 
@@ -203,21 +375,109 @@ def get_session_name(user_access_key, vtiger_url, vtiger_username):
         response, status = invoke_http_request(login_url, 'POST', headers, payload)
 
         if status == 200 and response.get('result', ''):
-            return response.get('result').get('sessionName')
+            return response.get('result').get('sessionName'), ttl
+    return None, None
 
 
+def invoke_vtiger_request(vtiger_access, session_name, send_request):
+    """ call send_request(session_name) and when vtiger answers that the session is invalid, login again
+        and repeat the call once.
+        returns (response, status, session_name)
+        """
+    response, status = send_request(session_name)
+    if is_invalid_session_response(response) and vtiger_access.get('user_access_key', ''):
+        invalidate_session_name(vtiger_access.get('user_access_key'), vtiger_access.get('vtiger_url'),
+                                vtiger_access.get('vtiger_username'), session_name)
+        session_name = get_session_name(vtiger_access.get('user_access_key'), vtiger_access.get('vtiger_url'),
+                                        vtiger_access.get('vtiger_username'))
+        if session_name:
+            response, status = send_request(session_name)
+    return response, status, session_name
+
+
+_trigger_batcher = None
+_trigger_batcher_options = None
+_trigger_batcher_exit_timeout = None
+_trigger_batcher_lock = threading.Lock()
+
+
+def enable_trigger_batching(exit_timeout=30, **options):
+    """ from now on trigger_workflow queues import/manual triggers on a WorkflowTriggerBatcher which merges
+        the ones for the same service, workflow and event type into one request.
+        options are passed to WorkflowTriggerBatcher (max_batch_size, max_linger, max_queue_size, ...).
+        the queue is flushed at interpreter exit for up to exit_timeout seconds (None waits until it is sent),
+        or call flush_trigger_batching / disable_trigger_batching.
+        """
+    global _trigger_batcher, _trigger_batcher_options, _trigger_batcher_exit_timeout
+    with _trigger_batcher_lock:
+        previous = _trigger_batcher
+        _trigger_batcher_options = options
+        _trigger_batcher_exit_timeout = exit_timeout
+        _trigger_batcher = WorkflowTriggerBatcher(send_workflow_trigger, **options)
+    if previous is not None:
+        previous.close()
+
+
+def disable_trigger_batching(timeout=None):
+    """ send the queued triggers and stop batching, returns False if they were not sent within timeout """
+    global _trigger_batcher, _trigger_batcher_options
+    with _trigger_batcher_lock:
+        batcher, _trigger_batcher, _trigger_batcher_options = _trigger_batcher, None, None
+    if batcher is not None:
+        return batcher.close(timeout)
+    return True
+
+
+def flush_trigger_batching(timeout=None):
+    batcher = _trigger_batcher
+    return batcher.flush(timeout) if batcher is not None else True
+
+
+def _close_trigger_batching_at_exit():
+    if not disable_trigger_batching(_trigger_batcher_exit_timeout):
+        logger.warning('workflow triggers still queued after %ss at exit were dropped', _trigger_batcher_exit_timeout)
+
+
+def _reset_trigger_batcher_after_fork():
+    # the batcher thread is not copied in the child: a new batcher with the same options, its thread only
+    # starts when the child triggers a workflow
+    global _trigger_batcher, _trigger_batcher_lock
+    _trigger_batcher_lock = threading.Lock()
+    _trigger_batcher = None
+    if _trigger_batcher_options is not None:
+        _trigger_batcher = WorkflowTriggerBatcher(send_workflow_trigger, **_trigger_batcher_options)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_trigger_batcher_after_fork)
+atexit.register(_close_trigger_batching_at_exit)
+
+
+@timed('task', task='trigger_workflow')
 def trigger_workflow(workflow, event_type, data, service_url):
     """ call API to trigger any workflow
-        Required params: 1. workflow 2. event_type 3. data"""
+        Required params: 1. workflow 2. event_type 3. data
+        when trigger batching is enabled (enable_trigger_batching) the trigger is queued and sent later,
+        merged with other ones of the same workflow."""
+
+    batcher = _trigger_batcher
+    if batcher is not None and data and event_type in batcher.list_event_types:
+        try:
+            batcher.submit(workflow, event_type, data, service_url)
+            return None
+        except BatcherClosedError:
+            # batching was disabled meanwhile
+            pass
+
+    send_workflow_trigger(workflow, event_type, data, service_url)
 
+
+def send_workflow_trigger(workflow, event_type, data, service_url):
     headers = {'content_type': 'application/json'}
 
     endpoint = '{service_url}/api/v1/trigger_external_workflow'.format(service_url=service_url)
 
-    print(f"Endpoint: {endpoint}")
-    print(f"Event Type: {event_type}")
-    print(f"Data Type: {data}")
-    print(f"Service URl: {service_url}")
+    logger.debug('Triggering workflow %s, event type %s on %s', workflow, event_type, endpoint)
     if data:
         payload = {
             "workflow": workflow,
@@ -226,28 +486,119 @@ def trigger_workflow(workflow, event_type, data, service_url):
         }
 
     response, status = invoke_http_request(endpoint, 'POST', headers, json_data=payload, timeout=61)
-    print("response", response, "status", status)
+    logger.debug('Workflow trigger of %s answered with status %s', workflow, status)
 
 
 def json_logic_replace_data(rule, data, string_data=None, json_data=None):
-    replace_data = jsonLogic(rule, data, ops)
-    it = iter(replace_data)
-    res_dct = dict(zip(it, it))
+    res_dct = json_logic_replacements(rule, data)
 
     if string_data:
-        for key, val in res_dct.items():
-            string_data = string_data.replace(key, str(val))
-
-        return string_data
+        return replace_placeholders(string_data, res_dct)
     elif json_data:
+        # only the string leaves are rewritten, json_data itself is left untouched
+        return replace_placeholders_in(json_data, res_dct)
 
-        str_json_data = json.dumps(json_data)
-        for key, val in res_dct.items():
-            str_json_data = str_json_data.replace(key, str(val))
-        json_data = json.loads(str_json_data)
-        return json_data
 
+def json_logic_replacements(rule, data):
+    """ {placeholder: value} of a replace rule, which lists placeholders and values one after the other """
+    with frozen_utc_now(), span('rule_evaluation', mode='replace'):
+        replace_data = evaluate_rule(rule, data, ops)
+    it = iter(replace_data)
+    return dict(zip(it, it))
+
+
+def map_json_logic_rules(rule, records, workers=None, **options):
+    """ evaluate rule with ops on every record, spread over worker processes for large batches.
+        yields the results in the order of records, options are passed to rule_pool.map_rules.
+        """
+    from rule_pool import map_rules
+    return map_rules(rule, records, __name__ + ':ops', workers, **options)
+
+
+def map_json_logic_replace_data(rule, records, string_data=None, json_data=None, workers=None, **options):
+    """ json_logic_replace_data(rule, record, string_data, json_data) for every record, spread over worker
+        processes for large batches. yields the results in the order of records, options are passed to
+        rule_pool.map_in_processes.
+        """
+    from rule_pool import map_in_processes
+    return map_in_processes(_replace_data_call, (rule, string_data, json_data), records, workers, **options)
+
+
+def _replace_data_call(rule, string_data, json_data):
+    return functools.partial(json_logic_replace_data, rule, string_data=string_data, json_data=json_data)
+
+
+def iter_vtiger_query_pages(vtiger_access, session_name, query, page_size=VTIGER_QUERY_PAGE_SIZE, max_records=None,
+                            prefetch=False):
+    """ run a vtiger query page by page and yield the list of records of every page.
+        params:
+        1. query: vtiger query without LIMIT, it needs an order by for the pages to be stable
+        2. page_size: records per request, vtiger returns at most 100
+        3. max_records: stop after this many records, None for all
+        4. prefetch: request the next page in the background while the current one is processed
+        the session is renewed once when vtiger reports it as invalid. iteration stops at the first page that
+        can't be fetched.
+        """
+    query = query.strip().rstrip(';')
+    state = {'session_name': session_name}
 
+    def fetch_page(offset, size):
+        page_query = '{query} LIMIT {offset}, {size};'.format(query=query, offset=offset, size=size)
+
+        def send_query(session_name):
+            url = '{vtiger_url}/webservice.php?operation=query&sessionName={sessionName}&query={query}'.format(
+                sessionName=session_name, query=quote(page_query), vtiger_url=vtiger_access.get('vtiger_url'))
+            headers = {'content-type': 'application/json'}
+            return invoke_http_request(url, 'GET', headers)
+
+        response, status, state['session_name'] = invoke_vtiger_request(vtiger_access, state['session_name'],
+                                                                        send_query)
+        if not is_success_request(status) or not isinstance(response, dict) or not response.get('success', True):
+            logger.warning('query failed at offset %s, status: %s', offset, status)
+            log_payload('failed query response: %s', response)
+            return None
+        return response.get('result') or []
+
+    def page_sizes():
+        offset = 0
+        while max_records is None or offset < max_records:
+            size = page_size if max_records is None else min(page_size, max_records - offset)
+            yield offset, size
+            offset += size
+
+    sizes = page_sizes()
+    if not prefetch:
+        for offset, size in sizes:
+            records = fetch_page(offset, size)
+            if records:
+                yield records
+            if not records or len(records) < size:
+                return
+        return
+
+    fetch_page = _in_request_context(fetch_page)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        offset, size = next(sizes, (None, None))
+        future = executor.submit(fetch_page, offset, size) if size else None
+        while future is not None:
+            records = future.result()
+            future = None
+            if records and len(records) == size:
+                offset, size = next(sizes, (None, None))
+                if size:
+                    future = executor.submit(fetch_page, offset, size)
+            if records:
+                yield records
+
+
+def iter_vtiger_query(vtiger_access, session_name, query, page_size=VTIGER_QUERY_PAGE_SIZE, max_records=None,
+                      prefetch=False):
+    """ same as iter_vtiger_query_pages but yields the records one by one """
+    for records in iter_vtiger_query_pages(vtiger_access, session_name, query, page_size, max_records, prefetch):
+        yield from records
+
+
+@timed('task', task='external_workflow')
 def run_external_workflow(conf, external_workflow_config, vtiger_access):
     """ this function will get check if conditions are satisfied for triggering external workflow or not.
         input:  1.conf : conf object
@@ -262,56 +613,41 @@ def run_external_workflow(conf, external_workflow_config, vtiger_access):
     event_type = external_workflow_config.get('event_type', '')
 
     search_object = external_workflow_config.get('search_object', '')
-    print(f"Data: {data} \n Workflow: {workflow} \n Event Type: {event_type} \n Search Object: {search_object}")
+    logger.debug('External workflow %s, event type %s', workflow, event_type)
+    log_payload('External workflow data: %s, search object: %s', data, search_object)
     if search_object and search_object.get('condition_object', ''):
         rule = search_object.get('rule', '')
 
         # prepare query
-        condition = buildquery(search_object.get('condition_object'))
         module = search_object.get('search_module').get('name')
-        limit = str(search_object.get('fetch_record'))
+        limit = search_object.get('fetch_record')
 
         order_by = search_object.get('sort').get('column') + " " + search_object.get('sort').get('type', "")
 
-        query = 'SELECT * FROM {module} WHERE {condition} order by {order_by} LIMIT {limit};'.format(
-            module=module,
-            condition=condition,
-            order_by=order_by,
-            limit=limit)
-
-        # replace variable name with data using JSON_LOGIC.
-        print(f"Query: {query}")
-        if rule:
-            query = json_logic_replace_data(rule, conf, query)
+        # no LIMIT here, the records are fetched page by page up to fetch_record
+        query = build_search_query(search_object.get('condition_object'), module, order_by,
+                                   replacements=json_logic_replacements(rule, conf) if rule else None)
+        log_payload('External workflow query: %s', query)
 
         if vtiger_access.get('user_access_key', ''):
             session_name = get_session_name(vtiger_access.get('user_access_key'), vtiger_access.get('vtiger_url'),
                                             vtiger_access.get('vtiger_username'))
             if not session_name:
-                print("unable to get session id from dev server. Please try again")
+                logger.error('unable to get session id from dev server. Please try again')
                 return None
 
-            url = '{vtiger_url}/webservice.php?operation=query&sessionName={sessionName}&query={query}'.format(
-                sessionName=session_name, query=query, vtiger_url=vtiger_access.get('vtiger_url'))
-            print(f"Url: {url}")
-            headers = {'content-type': 'application/json'}
-            request_type = 'GET'
-            response, status = invoke_http_request(url, request_type, headers)
-
-            print(f"Response: {response}")
-
-            if response:
-                # trigger only if condition is satisfied
-                if response.get('result') and workflow and event_type:
-
-                    if event_type == 'import' or event_type == 'manual':
-                        # if event type = import/ manual then pass list
-
-                        trigger_workflow(workflow, event_type, response.get('result'),
-                                         vtiger_access.get('service_url'))
-                    else:
-                        trigger_workflow(workflow, event_type, response.get('result')[0],
-                                         vtiger_access.get('service_url'))
+            # trigger only if condition is satisfied
+            if workflow and event_type:
+                max_records = int(limit) if limit else None
+                if event_type == 'import' or event_type == 'manual':
+                    # if event type = import/ manual then pass list, one trigger per page of records
+                    for records in iter_vtiger_query_pages(vtiger_access, session_name, query,
+                                                           max_records=max_records, prefetch=True):
+                        trigger_workflow(workflow, event_type, records, vtiger_access.get('service_url'))
+                else:
+                    record = next(iter_vtiger_query(vtiger_access, session_name, query, max_records=1), None)
+                    if record:
+                        trigger_workflow(workflow, event_type, record, vtiger_access.get('service_url'))
     elif workflow and event_type and data:
         # trigger without condition
         if event_type == 'import' or event_type == 'manual':
@@ -321,6 +657,7 @@ def run_external_workflow(conf, external_workflow_config, vtiger_access):
             trigger_workflow(workflow, event_type, data, vtiger_access.get('service_url'))
 
 
+@timed('task', task='set_value_record')
 def trigger_set_value_task(set_value_fields, conf, rule, session_name, vtiger_access):
     """   this function will execute revise query on vtiger for setting values
             params:
@@ -335,52 +672,120 @@ def trigger_set_value_task(set_value_fields, conf, rule, session_name, vtiger_ac
             2. execute revise API on vtiger
             """
 
-    print("Inside trigger_set_value_task")
     id = conf.get('data').get('id', '')
     record_module = 'Leads'
     module = module_id_dict.get(record_module, '')
-    print("Id: {}".format(id))
-    print("Module {}".format(module))
+    logger.debug('Setting values on record %s of module %s', id, module)
     if id and record_module:
 
         id = id if "x" in id else module + 'x' + id
-        element = {"id": str(id)}
+        element = build_set_value_element(set_value_fields, conf, rule, id)
 
-        for record in set_value_fields:
-            name = record.get('name')
-            type = record.get('type')
-            value = record.get('value')
+        # call set value API
+        response, status, session_name = revise_record(element, session_name, vtiger_access)
 
-            if type == 'static':
-                if rule:
-                    value = json_logic_replace_data(rule, conf, string_data=value)
-                element[str(name)] = str(value)
+        log_payload('Revise response: %s', response)
+        if is_success_request(status):
+            return response
+        else:
+            logger.warning('something went wrong while invoking revise API for set value. status: %s', status)
+            return None
 
-            elif type == 'function':
-                if rule:
-                    value = json_logic_replace_data(rule, conf, string_data=value)
-                element[str(name)] = str(eval(value))
 
-        # call set value API
+def build_set_value_element(set_value_fields, conf, rule, record_id):
+    """ build the revise element of a record from set_value_fields, values are replaced using rule on conf.
+        'function' values are expressions evaluated with expression.evaluate_expression, with the names conf,
+        data and record.
+        """
+    element = {"id": str(record_id)}
+    replacements = names = None
+
+    for record in set_value_fields:
+        name = record.get('name')
+        type = record.get('type')
+        value = record.get('value')
+
+        if type == 'static':
+            if rule:
+                value = json_logic_replace_data(rule, conf, string_data=value)
+            element[str(name)] = str(value)
+
+        elif type == 'function':
+            # placeholders are bound at evaluation, so the expression is parsed once for all the records
+            if names is None:
+                replacements = json_logic_replacements(rule, conf) if rule else None
+                names = {'conf': conf, 'data': conf.get('data'), 'record': conf.get('record')}
+            element[str(name)] = str(evaluate_expression(value, names, replacements))
+    return element
+
+
+def revise_record(element, session_name, vtiger_access):
+    """ call the vtiger revise API for one element, returns (response, status, session_name) """
+    def send_revise(session_name):
         payload = {'operation': 'revise', 'sessionName': session_name, 'element': json.dumps(element)}
         url = '{vtiger_url}/webservice.php'.format(vtiger_url=vtiger_access.get('vtiger_url'))
         headers = {'Content-Type': 'application/x-www-form-urlencoded'}
         request_type = 'POST'
 
-        print("Url: {}".format(url))
-        print("Payload: {}".format(payload))
-
-        response, status = invoke_http_request(url, request_type, headers, payload=payload)
+        return invoke_http_request(url, request_type, headers, payload=payload)
 
-        print("Response: {}".format(response))
-        if is_success_request(status):
-            return response
-        else:
-            print("something went wrong while invoking revise API for set value. status:", status, "response:",
-                  response)
-            return None
+    return invoke_vtiger_request(vtiger_access, session_name, send_revise)
 
 
+@timed('task', task='bulk_set_value')
+def trigger_bulk_set_value_task(set_value_fields, records, conf, rule, session_name, vtiger_access, max_workers=8,
+                                retries=2, backoff_factor=0.3):
+    """   set values on every record of records with one revise call per record, run on a pool of max_workers.
+            params:
+            1.set_value_fields : list of fields to set, same as trigger_set_value_task
+            2.records : vtiger records to update, they need their "id"
+            3.conf : conf object, each record is available to the rule as conf['record']
+            4.rule : json logic rule
+            5.session_name : vtiger session
+            6.vtiger_access : json object containing vtiger credentials
+            7.retries : times the failed records only are sent again
+
+            returns one {'id', 'success', 'status', 'response'} dict per record, in the order of records.
+            vtiger has no standard bulk revise operation, so the records are sent concurrently.
+            """
+    import requests
+
+    results = []
+    elements = []
+    for record in records:
+        element = build_set_value_element(set_value_fields, {**conf, 'record': record}, rule, record.get('id'))
+        elements.append(element)
+        results.append({'id': element['id'], 'success': False, 'status': None, 'response': None})
+
+    state = {'session_name': session_name}
+
+    def revise(index):
+        try:
+            response, status, state['session_name'] = revise_record(elements[index], state['session_name'],
+                                                                    vtiger_access)
+        except requests.exceptions.RequestException as e:
+            response, status = str(e), None
+        success = status is not None and is_success_request(status) and isinstance(response, dict) \
+            and response.get('success', True)
+        results[index].update(success=bool(success), status=status, response=response)
+
+    revise = _in_request_context(revise)
+    pending = list(range(len(elements)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(backoff_factor * (2 ** (attempt - 1)))
+            list(executor.map(revise, pending))
+            pending = [index for index in pending if not results[index]['success']]
+            if not pending:
+                break
+
+    if pending:
+        logger.warning('revise failed for %s of %s records', len(pending), len(elements))
+    return results
+
+
+@timed('task', task='set_value')
 def invoke_set_value_task(conf, set_value_configs, vtiger_access):
     """   this function will execute set value task.
             params:
@@ -392,9 +797,10 @@ def invoke_set_value_task(conf, set_value_configs, vtiger_access):
             1. get configs and create query and replace data using json logic.
             2. check if conditions are satisfied using get query.
             3. call trigger_set_value_task function if conditions are satisfied.
+            with set_value_configs['update_matched_records'] the values are set on every record matched by
+            search_module_object (see trigger_bulk_set_value_task) and the list of per record results is returned.
             """
 
-    print("Set value task invoked")
     set_value_fields = set_value_configs.get('set_value_fields', '')
     search_module_object = set_value_configs.get('search_module_object', '')
     rule = set_value_configs.get('rule', '')
@@ -403,21 +809,17 @@ def invoke_set_value_task(conf, set_value_configs, vtiger_access):
     if vtiger_access.get('user_access_key', ''):
         session_name = get_session_name(vtiger_access.get('user_access_key'), vtiger_access.get('vtiger_url'),
                                         vtiger_access.get('vtiger_username'))
-        print("Session name: {}".format(session_name))
         if not session_name:
-            print("unable to get session id from vtiger server. Please try again")
+            logger.error('unable to get session id from vtiger server. Please try again')
             return None
 
-    print("Search module object: {}".format(search_module_object))
-    print("Set value fields: {}".format(set_value_fields))
+    log_payload('Set value search module object: %s, fields: %s', search_module_object, set_value_fields)
     if search_module_object and search_module_object.get('condition_object', ''):
-        condition = buildquery(search_module_object.get('condition_object'))
-
-        print("Condition {}".format(condition))
-
+        replacements = json_logic_replacements(rule, conf) if rule else None
         module = search_module_object.get('name')
 
-        limit = str(search_module_object.get('fetch_record', ''))
+        limit = search_module_object.get('fetch_record') or None
+        max_records = int(limit) if limit is not None else None
 
         # prepare query using search_module_object
 
@@ -426,45 +828,32 @@ def invoke_set_value_task(conf, set_value_configs, vtiger_access):
             order_by = search_module_object.get('sort').get('column') + " " + search_module_object.get('sort').get(
                 'type', "")
 
-        if limit and order_by:
-            query = 'SELECT * FROM {module} WHERE {condition} order by {order_by} LIMIT {limit};'.format(
-                module=module,
-                condition=condition,
-                order_by=order_by,
-                limit=limit)
-        elif limit:
-            query = 'SELECT * FROM {module} WHERE {condition} LIMIT {limit};'.format(
-                module=module,
-                condition=condition,
-                limit=limit)
-        elif order_by:
-            query = 'SELECT * FROM {module} WHERE {condition} order by {order_by};'.format(
-                module=module,
-                condition=condition,
-                order_by=order_by,
-            )
-        else:
-            query = 'SELECT * FROM {module} WHERE {condition};'.format(
-                module=module,
-                condition=condition,
-            )
+        if set_value_configs.get('update_matched_records') and set_value_fields:
+            # bulk mode: set the values on every matched record instead of the record of conf
+            query = build_search_query(search_module_object.get('condition_object'), module, order_by,
+                                       replacements=replacements)
+            log_payload('Set value query: %s', query)
 
-        if rule:
-            query = json_logic_replace_data(rule, conf, string_data=query)
+            records = list(iter_vtiger_query(vtiger_access, session_name, query,
+                                             max_records=max_records, prefetch=True))
+            return trigger_bulk_set_value_task(set_value_fields, records, conf, rule, session_name, vtiger_access,
+                                               max_workers=set_value_configs.get('max_workers', 8))
 
-        url = '{vtiger_url}/webservice.php?operation=query&sessionName={sessionName}&query={query}'.format(
-            sessionName=session_name, query=query, vtiger_url=vtiger_access.get('vtiger_url'))
+        query = build_search_query(search_module_object.get('condition_object'), module, order_by, max_records,
+                                   replacements)
+        log_payload('Set value query: %s', query)
 
-        print("URL {}".format(url))
+        def send_query(session_name):
+            url = '{vtiger_url}/webservice.php?operation=query&sessionName={sessionName}&query={query}'.format(
+                sessionName=session_name, query=quote(query), vtiger_url=vtiger_access.get('vtiger_url'))
 
-        headers = {'content-type': 'application/json'}
-        request_type = 'GET'
-        response, status = invoke_http_request(url, request_type, headers)
+            headers = {'content-type': 'application/json'}
+            request_type = 'GET'
+            return invoke_http_request(url, request_type, headers)
 
-        print("Query Response: ")
+        response, status, session_name = invoke_vtiger_request(vtiger_access, session_name, send_query)
 
         if response:
-            print(response)
             if response.get('result') and set_value_fields:
                 set_value_response = trigger_set_value_task(set_value_fields, conf, rule, session_name, vtiger_access)
                 return set_value_response
@@ -475,6 +864,7 @@ def invoke_set_value_task(conf, set_value_configs, vtiger_access):
         return set_value_response
 
 
+@timed('task', task='web_service')
 def invoke_web_service_task(conf, web_service_configs):
     """ Web service task:
         params:
@@ -506,6 +896,7 @@ def invoke_web_service_task(conf, web_service_configs):
             return response
 
 
+@timed('task', task='conditional')
 def invoke_conditional_task(conf, condition, true_task, false_task):
     """ this will execute conditional task.
         params:
@@ -514,7 +905,8 @@ def invoke_conditional_task(conf, condition, true_task, false_task):
         3. true_task: task to be triggered if condition is true
         4. false_task: task to be triggered if condition is false
         """
-    is_valid = jsonLogic(condition, conf, ops)
+    with frozen_utc_now(), span('rule_evaluation', mode='condition'):
+        is_valid = evaluate_rule(condition, conf, ops)
 
     if is_valid:
         return true_task
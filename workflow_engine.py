@@ -0,0 +1,170 @@
+"""Run a declarative graph of tasks with independent branches in parallel.
+
+workflow = {
+    'steps': [
+        {'id': 'check', 'type': 'conditional', 'condition': {...json logic...},
+         'true_steps': ['notify'], 'false_steps': ['update']},
+        {'id': 'notify', 'type': 'web_service', 'config': {...web_service_configs...}},
+        {'id': 'update', 'type': 'set_value', 'config': {...set_value_configs...}},
+        {'id': 'external', 'type': 'external_workflow', 'config': {...external_workflow_config...},
+         'depends_on': ['notify']},
+    ]
+}
+
+A step starts as soon as every step of its depends_on is done. Steps listed in true_steps/false_steps of a
+conditional step depend on it, the ones of the branch which is not taken are skipped, and so is everything
+depending on a skipped or failed step. The results of the finished dependencies of a step are available to
+its rules under conf['steps'][step_id].
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utilslib import (get_session_name, invoke_conditional_task, invoke_set_value_task, invoke_web_service_task,
+                      run_external_workflow)
+
+__all__ = ['run_workflow', 'STEP_DONE', 'STEP_SKIPPED', 'STEP_FAILED']
+
+STEP_DONE = 'done'
+STEP_SKIPPED = 'skipped'
+STEP_FAILED = 'failed'
+
+
+def _run_web_service(step, conf, vtiger_access):
+    return invoke_web_service_task(conf, step.get('config', {}))
+
+
+def _run_set_value(step, conf, vtiger_access):
+    return invoke_set_value_task(conf, step.get('config', {}), vtiger_access)
+
+
+def _run_external_workflow(step, conf, vtiger_access):
+    return run_external_workflow(conf, step.get('config', {}), vtiger_access)
+
+
+def _run_conditional(step, conf, vtiger_access):
+    return invoke_conditional_task(conf, step.get('condition'), True, False)
+
+
+STEP_RUNNERS = {
+    'web_service': _run_web_service,
+    'set_value': _run_set_value,
+    'external_workflow': _run_external_workflow,
+    'conditional': _run_conditional,
+}
+_VTIGER_STEPS = ('set_value', 'external_workflow')
+
+
+def run_workflow(workflow, conf, vtiger_access=None, max_workers=8):
+    """ run every step of workflow and return {step_id: {'status', 'result', 'error'}}.
+        status is STEP_DONE, STEP_SKIPPED or STEP_FAILED, error is the exception of a failed step.
+        """
+    vtiger_access = vtiger_access or {}
+    steps = {step['id']: step for step in workflow.get('steps', [])}
+    if not steps:
+        return {}
+    depends_on = _dependencies(steps)
+    dependents = {step_id: [] for step_id in steps}
+    for step_id, parents in depends_on.items():
+        for parent in parents:
+            dependents[parent].append(step_id)
+
+    # log in once up front, every step then gets the cached vtiger session
+    if vtiger_access.get('user_access_key', '') and any(step.get('type') in _VTIGER_STEPS
+                                                        for step in steps.values()):
+        get_session_name(vtiger_access.get('user_access_key'), vtiger_access.get('vtiger_url'),
+                         vtiger_access.get('vtiger_username'))
+
+    results = {}
+    waiting = {step_id: len(parents) for step_id, parents in depends_on.items()}
+    lock = threading.Lock()
+    finished = threading.Event()
+
+    def complete(step_id, status, result=None, error=None):
+        """ record the result of a step, returns the steps that became ready """
+        ready = []
+        skipped = []
+        with lock:
+            results[step_id] = {'status': status, 'result': result, 'error': error}
+            for child in dependents[step_id]:
+                if child in results:
+                    continue
+                if status != STEP_DONE or _branch_not_taken(steps[step_id], child, result):
+                    skipped.append(child)
+                    continue
+                waiting[child] -= 1
+                if waiting[child] == 0:
+                    ready.append(child)
+            if len(results) == len(steps):
+                finished.set()
+        for child in skipped:
+            ready.extend(skip(child))
+        return ready
+
+    def skip(step_id):
+        with lock:
+            if step_id in results:
+                return []
+        return complete(step_id, STEP_SKIPPED)
+
+    def run(step_id):
+        step = steps[step_id]
+        with lock:
+            step_conf = {**conf, 'steps': {parent: results[parent] for parent in depends_on[step_id]}}
+        try:
+            result = STEP_RUNNERS[step.get('type')](step, step_conf, vtiger_access)
+            ready = complete(step_id, STEP_DONE, result)
+        except Exception as e:
+            ready = complete(step_id, STEP_FAILED, error=e)
+        for child in ready:
+            executor.submit(run, child)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='workflow-step') as executor:
+        for step_id, count in list(waiting.items()):
+            if count == 0:
+                executor.submit(run, step_id)
+        finished.wait()
+    return results
+
+
+def _branch_not_taken(step, child, result):
+    if step.get('type') != 'conditional':
+        return False
+    not_taken = step.get('false_steps', []) if result else step.get('true_steps', [])
+    taken = step.get('true_steps', []) if result else step.get('false_steps', [])
+    return child in not_taken and child not in taken
+
+
+def _dependencies(steps):
+    depends_on = {step_id: set(step.get('depends_on', [])) for step_id, step in steps.items()}
+    for step_id, step in steps.items():
+        if step.get('type') not in STEP_RUNNERS:
+            raise ValueError('step {!r} has unknown type {!r}'.format(step_id, step.get('type')))
+        for child in step.get('true_steps', []) + step.get('false_steps', []):
+            if child not in steps:
+                raise ValueError('step {!r} branches to unknown step {!r}'.format(step_id, child))
+            depends_on[child].add(step_id)
+    for step_id, parents in depends_on.items():
+        for parent in parents:
+            if parent not in steps:
+                raise ValueError('step {!r} depends on unknown step {!r}'.format(step_id, parent))
+
+    # reject cycles, they would never become ready
+    visited = set()
+    for start in steps:
+        if start in visited:
+            continue
+        path, stack = set(), [(start, iter(depends_on[start]))]
+        path.add(start)
+        while stack:
+            node, parents = stack[-1]
+            parent = next(parents, None)
+            if parent is None:
+                stack.pop()
+                path.discard(node)
+                visited.add(node)
+            elif parent in path:
+                raise ValueError('workflow has a dependency cycle through step {!r}'.format(parent))
+            elif parent not in visited:
+                path.add(parent)
+                stack.append((parent, iter(depends_on[parent])))
+    return {step_id: sorted(parents) for step_id, parents in depends_on.items()}